@@ -32,8 +32,14 @@ export default function ChatPage() {
   const [messages, setMessages] = useState<Message[]>([])
   const [input, setInput] = useState("")
   const [isLoading, setIsLoading] = useState(false)
+  const [isAnswering, setIsAnswering] = useState(false)
   const [pdf, setPdf] = useState<PDFDoc | null>(null)
+  const [progress, setProgress] = useState(0)
+  const [ingestStatus, setIngestStatus] = useState("ingesting")
+  const [olderCursor, setOlderCursor] = useState<string | null>(null)
+  const [isLoadingOlder, setIsLoadingOlder] = useState(false)
   const messagesEndRef = useRef<HTMLDivElement>(null)
+  const keepScrollRef = useRef(false)
 
   const params = useParams();
 
@@ -58,31 +64,94 @@ export default function ChatPage() {
   }, [])
 
   useEffect(()=>{
-    const fetchConversation = async () => {
+    if(pdf == null || pdf.insert_status) return
+
+    // Listen to ingestion progress pushed by the server instead of polling the document
+    const controller = new AbortController()
+    const listenProgress = async () => {
       try {
-        const response = await axios.get(
-          `http://localhost:8000/api/v1/documents/${params.fileId}/user/pdf/chats`,
+        const response = await fetch(
+          `http://localhost:8000/api/v1/documents/${params.fileId}/progress`,
           {
             headers: {
-              Authorization: `Bearer ${JSON.parse(localStorage.getItem("user")!)["token"]} `,
-            }
+              Authorization: `Bearer ${JSON.parse(localStorage.getItem("user")!)["token"]}`,
+            },
+            signal: controller.signal,
           }
         );
-        setMessages(response.data)
+        const reader = response.body!.pipeThrough(new TextDecoderStream()).getReader()
+        let buffer = ""
+        while (true) {
+          const { value, done } = await reader.read()
+          if (done) break
+
+          buffer += value
+          const events = buffer.split("\n\n")
+          buffer = events.pop() ?? ""
+          for (const event of events) {
+            if (!event.startsWith("data: ")) continue
+
+            const data = JSON.parse(event.slice(6))
+            setProgress(data.percent ?? 0)
+            setIngestStatus(data.status)
+            if (data.status == "done") {
+              setPdf(prev => prev && { ...prev, insert_status: true })
+            }
+          }
+        }
       } catch (error) {
-        console.error(error);
+        if (!controller.signal.aborted) console.error(error);
       }
     }
 
+    listenProgress()
+    return () => controller.abort()
+  }, [pdf?.insert_status])
+
+  // The server returns the most recent chats, older pages are fetched with the `next_cursor` of the previous one
+  const fetchConversation = async (cursor: string | null = null) => {
+    try {
+      const response = await axios.get(
+        `http://localhost:8000/api/v1/documents/${params.fileId}/user/pdf/chats`,
+        {
+          params: cursor ? { cursor } : {},
+          headers: {
+            Authorization: `Bearer ${JSON.parse(localStorage.getItem("user")!)["token"]} `,
+          }
+        }
+      );
+      setMessages(prev => cursor ? [...response.data.chats, ...prev] : response.data.chats)
+      setOlderCursor(response.data.next_cursor)
+    } catch (error) {
+      console.error(error);
+    }
+  }
+
+  const loadOlderMessages = async () => {
+    setIsLoadingOlder(true)
+    keepScrollRef.current = true
+    try {
+      await fetchConversation(olderCursor)
+    } finally {
+      setIsLoadingOlder(false)
+    }
+  }
+
+  useEffect(()=>{
     if(pdf?.insert_status) {
       fetchConversation()
     } else {
       setMessages([])
+      setOlderCursor(null)
     }
   }, [pdf])
 
-  // Scroll to bottom of messages
+  // Scroll to bottom of messages, unless older ones were just added above
   useEffect(() => {
+    if (keepScrollRef.current) {
+      keepScrollRef.current = false
+      return
+    }
     messagesEndRef.current?.scrollIntoView({ behavior: "smooth" })
   }, [messages])
 
@@ -90,34 +159,71 @@ export default function ChatPage() {
     e.preventDefault()
     if (!input.trim()) return
 
+    const query = input
     setIsLoading(true)
+    setIsAnswering(true)
+    setMessages(prev => [...prev, {
+      role: "user",
+      content: query,
+      created_at: new Date(Date.now()).toISOString()
+    }])
+    setInput("")
+
+    // Render the answer as its tokens arrive instead of waiting for all of it
+    let answer = ""
+    const showAnswer = (content: string) => {
+      setIsLoading(false)
+      setMessages(prev => {
+        const last = prev[prev.length - 1]
+        const message: Message = { role: "assistant", content, created_at: last.role == "assistant" ? last.created_at : new Date(Date.now()).toISOString() }
+        return last.role == "assistant" ? [...prev.slice(0, -1), message] : [...prev, message]
+      })
+    }
+
     try {
-      setMessages(prev => [...prev, {
-        role: "user",
-        content: input,
-        created_at: new Date(Date.now()).toISOString()
-      }])
-      setInput("")
-
-      const response = await axios.post(
-        `http://localhost:8000/api/v1/documents/${params.fileId}/chats`,
-        { query: input },
+      const response = await fetch(
+        `http://localhost:8000/api/v1/documents/${params.fileId}/chats/stream`,
         {
+          method: "POST",
           headers: {
-            Authorization: `Bearer ${JSON.parse(localStorage.getItem("user")!)["token"]} `,
-          }
+            Authorization: `Bearer ${JSON.parse(localStorage.getItem("user")!)["token"]}`,
+            "Content-Type": "application/json",
+          },
+          body: JSON.stringify({ query }),
         }
       )
+      if (!response.ok) throw new Error(`Chat failed with status ${response.status}`)
+
+      const reader = response.body!.pipeThrough(new TextDecoderStream()).getReader()
+      let buffer = ""
+      while (true) {
+        const { value, done } = await reader.read()
+        if (done) break
+
+        buffer += value
+        const events = buffer.split("\n\n")
+        buffer = events.pop() ?? ""
+        for (const event of events) {
+          const lines = event.split("\n")
+          const name = lines.find(line => line.startsWith("event: "))?.slice(7) ?? "message"
+          const data = lines.find(line => line.startsWith("data: "))?.slice(6)
+          if (data === undefined) continue
 
-      setMessages(prev => [...prev, {
-        role: "assistant",
-        content: response.data.response,
-        created_at: response.data.created_at
-      }])
+          if (name == "error") {
+            throw new Error(JSON.parse(data).detail)
+          }
+          if (name == "message") {
+            answer += JSON.parse(data).token
+            showAnswer(answer)
+          }
+        }
+      }
     } catch (error) {
       console.error(error)
+      showAnswer(answer ? `${answer}\n\n_The answer was interrupted, please try again._` : "_Something went wrong, please try again._")
     } finally {
       setIsLoading(false)
+      setIsAnswering(false)
     }
   }
 
@@ -149,6 +255,14 @@ export default function ChatPage() {
                     </div>
                 )}
 
+                {pdf?.insert_status && olderCursor && (
+                  <div className="flex justify-center">
+                    <Button variant="outline" size="sm" disabled={isLoadingOlder} onClick={loadOlderMessages}>
+                      {isLoadingOlder ? "Loading..." : "Load earlier messages"}
+                    </Button>
+                  </div>
+                )}
+
                 {pdf?.insert_status && messages?.length>0 && messages?.map((message) => (
                     <div key={message.role+message.content+message.created_at} className={`flex ${message.role === "user" ? "justify-end" : "justify-start"}`}>
                       <div
@@ -167,9 +281,19 @@ export default function ChatPage() {
                     </div>
                   ))}
 
-                {pdf?.insert_status == false && (
+                {pdf?.insert_status == false && ingestStatus == "failed" && (
+                  <div className="flex items-center justify-center h-full">
+                    <p className="text-red-600">We could not process this document. Delete it and upload it again.</p>
+                  </div>
+                )}
+
+                {pdf?.insert_status == false && ingestStatus != "failed" && (
                   <div className="flex items-center justify-center h-full">
-                    <p className="text-gray-500">We are processing the document, please wait. If it takes too long, try to upload the document again.</p>
+                    <p className="text-gray-500">
+                      {ingestStatus == "retrying"
+                        ? `Processing the document failed at ${progress}%, retrying...`
+                        : `We are processing the document (${progress}%), please wait. If it takes too long, try to upload the document again.`}
+                    </p>
                   </div>
                 )}
 
@@ -202,9 +326,9 @@ export default function ChatPage() {
                   value={input}
                   onChange={(e) => setInput(e.target.value)}
                   placeholder="Ask a question about this PDF..."
-                  disabled={isLoading}
+                  disabled={isAnswering}
                 />
-                <Button type="submit" disabled={isLoading || !input.trim()} className="bg-purple-600 hover:bg-purple-700">
+                <Button type="submit" disabled={isAnswering || !input.trim()} className="bg-purple-600 hover:bg-purple-700">
                   <Send className="h-4 w-4" />
                 </Button>
               </form>
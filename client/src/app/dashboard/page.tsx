@@ -23,24 +23,39 @@ export default function Dashboard() {
     const [isUploading, setIsUploading] = useState(false);
     const [currentPdfFile, setCurrentPdfFile] = useState<File | null>(null);
 
-    useEffect(()=>{
-        const fetchDocs = async () => {
-            try {
-                const response = await axios.get(
-                    "http://localhost:8000/api/v1/documents/all",
-                    {
-                        headers: {
-                            Authorization: `Bearer ${JSON.parse(localStorage.getItem("user")!)["token"]} `,
-                        }
+    const [nextCursor, setNextCursor] = useState<string | null>(null);
+    const [isLoadingMore, setIsLoadingMore] = useState(false);
+
+    // The server returns a page at a time, older pages are fetched with the `next_cursor` of the previous one
+    const fetchDocs = async (cursor: string | null = null) => {
+        try {
+            const response = await axios.get(
+                "http://localhost:8000/api/v1/documents/all",
+                {
+                    params: cursor ? { cursor } : {},
+                    headers: {
+                        Authorization: `Bearer ${JSON.parse(localStorage.getItem("user")!)["token"]} `,
                     }
-                );
-                console.log(response.data.documents);
-                setFilteredPdfs(response.data.documents)
-            } catch (error) {
-                console.error(error);
-            }
+                }
+            );
+            console.log(response.data.documents);
+            setFilteredPdfs(prev => cursor ? [...prev, ...response.data.documents] : response.data.documents)
+            setNextCursor(response.data.next_cursor)
+        } catch (error) {
+            console.error(error);
         }
+    }
 
+    const loadMoreDocs = async () => {
+        setIsLoadingMore(true);
+        try {
+            await fetchDocs(nextCursor)
+        } finally {
+            setIsLoadingMore(false);
+        }
+    }
+
+    useEffect(()=>{
         fetchDocs()
     }, [])
 
@@ -159,5 +174,13 @@ export default function Dashboard() {
                     </Card>
                 ))}
             </div>
+
+            {nextCursor && (
+                <div className="flex justify-center pb-8">
+                    <Button variant="outline" disabled={isLoadingMore} className="cursor-pointer" onClick={loadMoreDocs}>
+                        {isLoadingMore ? "Loading..." : "Load more"}
+                    </Button>
+                </div>
+            )}
     </div>;
 }
\ No newline at end of file
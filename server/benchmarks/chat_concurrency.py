@@ -0,0 +1,65 @@
+"""
+Chat endpoint concurrency load test
+
+Sends POST /documents/{doc_id}/chats requests against a running API at increasing
+concurrency levels and reports throughput and latency per level, which shows how
+concurrent chat throughput scales on a single uvicorn worker.
+
+Usage (from the server directory, with the API running):
+    python -m benchmarks.chat_concurrency --token <jwt> --doc-id <document id> --concurrency 1 4 16 32
+"""
+import argparse
+import asyncio
+import statistics
+import time
+
+import httpx
+
+
+async def run_level(client: httpx.AsyncClient, url: str, concurrency: int, requests: int, query: str) -> tuple[float, list[float], int]:
+    latencies: list[float] = []
+    errors = 0
+    queue: asyncio.Queue[int] = asyncio.Queue()
+    for idx in range(requests):
+        queue.put_nowait(idx)
+
+    async def worker():
+        nonlocal errors
+        while not queue.empty():
+            idx = queue.get_nowait()
+            start = time.perf_counter()
+            response = await client.post(url, json={"query": f"{query} ({idx})"})
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    start = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return time.perf_counter() - start, latencies, errors
+
+async def main(args: argparse.Namespace):
+    url = f"{args.base_url}/api/v1/documents/{args.doc_id}/chats"
+    headers = {"Authorization": f"Bearer {args.token}"}
+
+    async with httpx.AsyncClient(headers=headers, timeout=args.timeout) as client:
+        print(f"{'concurrency':>12}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}")
+        for concurrency in args.concurrency:
+            elapsed, latencies, errors = await run_level(client, url, concurrency, args.requests, args.query)
+            latencies.sort()
+            p50 = statistics.median(latencies) * 1000
+            p95 = latencies[int(0.95 * (len(latencies) - 1))] * 1000
+            print(f"{concurrency:>12}{len(latencies) / elapsed:>10.2f}{p50:>10.0f}{p95:>10.0f}{errors:>8}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure chat throughput at increasing concurrency")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--token", required=True, help="JWT returned by /auth/login")
+    parser.add_argument("--doc-id", required=True, help="Id of an ingested document owned by the token's user")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+    parser.add_argument("--requests", type=int, default=50, help="Requests sent at each concurrency level")
+    parser.add_argument("--query", default="What is this document about?")
+    parser.add_argument("--timeout", type=float, default=120.0)
+    args = parser.parse_args()
+
+    asyncio.run(main(args))
@@ -0,0 +1,123 @@
+"""
+Chunker comparison benchmark
+
+Chunks and embeds a fixed corpus of PDFs with each chunker spec (see
+chunking.get_chunker) and reports:
+
+    chunks       number of points the corpus turns into
+    chunk s      time to split the extracted page text
+    embed s      time to embed every chunk
+    hit@k, mrr   retrieval quality, searching only the chunks of the query's pdf
+    ctx tokens   tokens of the top-k chunks, i.e. what the chat prompt pays for
+
+Without --queries, queries are generated from the corpus: a random sentence with
+a third of its words dropped, relevant to the chunks whose character offsets
+cover it. With --queries, a JSON lines file of {"pdf", "query", "answer"}, a chunk
+is relevant when it contains the answer text.
+
+Usage (from the server directory):
+    python -m benchmarks.chunking path/to/pdfs --chunkers character token:128 token:250
+    python -m benchmarks.chunking path/to/pdfs --queries queries.jsonl --k 5
+"""
+import argparse
+import json
+import random
+import re
+import time
+from pathlib import Path
+
+import numpy as np
+from langchain_core.documents.base import Document
+from pypdf import PdfReader
+
+from src.config import Config
+from src.docs_ingestion.chunking import get_chunker, load_tokenizer
+from src.docs_ingestion.embeddings import get_embedder
+
+SENTENCE = re.compile(r"[^.!?\n]{40,200}[.!?]")
+
+
+def load_pages(paths: list[Path]) -> dict[str, list[str]]:
+    return {str(path): [page.extract_text() for page in PdfReader(path).pages] for path in paths}
+
+def generate_queries(corpus: dict[str, list[str]], count: int, rng: random.Random) -> list[dict]:
+    sentences = [
+        {"pdf": pdf, "page": page, "start": match.start(), "end": match.end(), "text": match.group().strip()}
+        for pdf, pages in corpus.items()
+        for page, text in enumerate(pages)
+        for match in SENTENCE.finditer(text)
+    ]
+
+    queries = []
+    for sentence in rng.sample(sentences, min(count, len(sentences))):
+        words = sentence["text"].split()
+        kept = [word for word in words if rng.random() > 1 / 3] or words
+        queries.append({**sentence, "query": " ".join(kept)})
+    return queries
+
+def is_relevant(query: dict, chunk: Document) -> bool:
+    if "answer" in query:
+        return " ".join(query["answer"].split()) in " ".join(chunk.page_content.split())
+
+    middle = (query["start"] + query["end"]) // 2
+    return chunk.metadata["page"] == query["page"] and chunk.metadata["char_start"] <= middle < chunk.metadata["char_end"]
+
+def main(args: argparse.Namespace):
+    paths = sorted(Path(args.corpus).glob("*.pdf")) if Path(args.corpus).is_dir() else [Path(args.corpus)]
+    corpus = load_pages(paths)
+    print(f"{len(paths)} pdfs, {sum(len(pages) for pages in corpus.values())} pages")
+
+    if args.queries:
+        queries = [json.loads(line) for line in open(args.queries)]
+    else:
+        queries = generate_queries(corpus, args.num_queries, random.Random(0))
+
+    embedder = get_embedder(Config.EMBEDDING_BACKEND, Config.TRANSFORMER_MODEL)
+    tokenizer = load_tokenizer(Config.TRANSFORMER_MODEL)
+    query_vectors = embedder.encode([query["query"] for query in queries], batch_size=Config.EMBEDDING_BATCH_SIZE)
+    query_vectors /= np.linalg.norm(query_vectors, axis=1, keepdims=True)
+
+    print(f"{'chunker':<16}{'chunks':>8}{'chunk s':>9}{'embed s':>9}{'hit@' + str(args.k):>8}{'mrr':>7}{'ctx tokens':>12}")
+    for spec in args.chunkers:
+        chunker = get_chunker(spec)
+
+        start = time.perf_counter()
+        chunks = {
+            pdf: [chunk for page, text in enumerate(pages) for chunk in chunker.split(Document(page_content=text, metadata={"source": pdf, "page": page}))]
+            for pdf, pages in corpus.items()
+        }
+        chunk_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        vectors = {}
+        for pdf, pdf_chunks in chunks.items():
+            matrix = embedder.encode([chunk.page_content for chunk in pdf_chunks], batch_size=Config.EMBEDDING_BATCH_SIZE)
+            vectors[pdf] = matrix / np.linalg.norm(matrix, axis=1, keepdims=True)
+        embed_seconds = time.perf_counter() - start
+
+        hits, reciprocal_ranks, context_tokens = 0, 0.0, 0
+        for query, query_vector in zip(queries, query_vectors):
+            pdf_chunks = chunks[query["pdf"]]
+            top = np.argsort(vectors[query["pdf"]] @ query_vector)[::-1][:args.k]
+            ranks = [rank for rank, idx in enumerate(top, start=1) if is_relevant(query, pdf_chunks[idx])]
+            hits += bool(ranks)
+            reciprocal_ranks += 1 / ranks[0] if ranks else 0
+            context_tokens += sum(len(encoding.ids) for encoding in tokenizer.encode_batch([pdf_chunks[idx].page_content for idx in top]))
+
+        total_chunks = sum(len(pdf_chunks) for pdf_chunks in chunks.values())
+        print(
+            f"{spec:<16}{total_chunks:>8}{chunk_seconds:>9.2f}{embed_seconds:>9.2f}"
+            f"{hits / len(queries):>8.3f}{reciprocal_ranks / len(queries):>7.3f}{context_tokens / len(queries):>12.0f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare chunkers on chunk count, ingest time and retrieval quality")
+    parser.add_argument("corpus", help="A pdf, or a directory of pdfs")
+    parser.add_argument("--chunkers", nargs="+", default=["character", "token:128", "token:250"])
+    parser.add_argument("--queries", default=None, help="JSON lines of {\"pdf\", \"query\", \"answer\"}")
+    parser.add_argument("--num-queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+
+    main(args)
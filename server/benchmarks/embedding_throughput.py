@@ -0,0 +1,49 @@
+"""
+Per-document embedding throughput benchmark
+
+Compares the old one-encode-call-per-chunk path with the batched path used by
+QdrantService.ingest_documents, on the chunks of a single PDF.
+
+Usage (from the server directory):
+    python -m benchmarks.embedding_throughput path/to/file.pdf --batch-sizes 16 32 64 128
+"""
+import argparse
+import time
+
+from src.docs_ingestion.service import qdrant_service
+
+
+def run(pdf_path: str, batch_sizes: list[int], per_chunk: bool):
+    docs = qdrant_service.extract_text_from_pdf(pdf_path)
+    texts = [doc.page_content for doc in docs]
+    print(f"{pdf_path}: {len(texts)} chunks")
+
+    # Warm up the model so the first measurement doesn't pay for lazy initialisation
+    qdrant_service.encode_texts(texts[:8])
+
+    results = []
+    if per_chunk:
+        start = time.perf_counter()
+        for text in texts:
+            qdrant_service.model.encode([text], batch_size=1)
+        results.append(("per-chunk", time.perf_counter() - start))
+
+    for batch_size in batch_sizes:
+        start = time.perf_counter()
+        for offset in range(0, len(texts), batch_size):
+            qdrant_service.encode_texts(texts[offset:offset + batch_size], batch_size=batch_size)
+        results.append((f"batch={batch_size}", time.perf_counter() - start))
+
+    print(f"{'mode':<12}{'seconds':>10}{'chunks/sec':>14}")
+    for mode, elapsed in results:
+        print(f"{mode:<12}{elapsed:>10.2f}{len(texts) / elapsed:>14.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure chunk embedding throughput for a PDF")
+    parser.add_argument("pdf_path", help="Local path or URL of the PDF")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[16, 32, 64, 128])
+    parser.add_argument("--skip-per-chunk", action="store_true", help="Skip the unbatched baseline")
+    args = parser.parse_args()
+
+    run(args.pdf_path, args.batch_sizes, per_chunk=not args.skip_per_chunk)
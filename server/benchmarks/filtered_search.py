@@ -0,0 +1,129 @@
+"""
+Filtered vector search latency benchmark
+
+Fills a collection shaped like pdf_docs (many users, many pdfs each) with random
+vectors and measures the latency of searches filtered on user_id and source, as
+retrieve_documents does, for three layouts:
+
+    plain        no payload indexes (the original layout)
+    indexed      keyword indexes on user_id and source
+    multitenant  indexes plus is_tenant on user_id and per-tenant HNSW graphs (m=0, payload_m=16)
+
+By default it runs against an in-process local Qdrant stand-in, which needs no
+server but ignores payload indexes and HNSW settings, so it only checks that the
+layouts behave the same. Pass --url to measure a real Qdrant instance.
+
+Usage (from the server directory):
+    python -m benchmarks.filtered_search --points 10000 100000 --users 200
+    python -m benchmarks.filtered_search --url http://localhost:6333 --points 100000 1000000
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+from qdrant_client import QdrantClient, models
+
+DIM = 384
+LAYOUTS = ["plain", "indexed", "multitenant"]
+
+
+def create(client: QdrantClient, name: str, layout: str):
+    if client.collection_exists(name):
+        client.delete_collection(name)
+
+    client.create_collection(
+        collection_name=name,
+        vectors_config=models.VectorParams(size=DIM, distance=models.Distance.COSINE),
+        hnsw_config=models.HnswConfigDiff(payload_m=16, m=0) if layout == "multitenant" else None
+    )
+    if layout == "plain":
+        return
+
+    client.create_payload_index(
+        collection_name=name,
+        field_name="user_id",
+        field_schema=models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD, is_tenant=layout == "multitenant"),
+        wait=True
+    )
+    client.create_payload_index(
+        collection_name=name,
+        field_name="source",
+        field_schema=models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD),
+        wait=True
+    )
+
+def fill(client: QdrantClient, name: str, points: int, users: int, pdfs_per_user: int, rng: np.random.Generator):
+    batch = 1000
+    for start in range(0, points, batch):
+        size = min(batch, points - start)
+        vectors = rng.standard_normal((size, DIM), dtype=np.float32)
+        user_ids = rng.integers(0, users, size)
+        pdf_ids = rng.integers(0, pdfs_per_user, size)
+        client.upload_points(
+            collection_name=name,
+            points=[
+                models.PointStruct(
+                    id=start + idx,
+                    vector=vectors[idx].tolist(),
+                    payload={
+                        "user_id": f"user-{user_ids[idx]}",
+                        "source": f"pdf-{user_ids[idx]}-{pdf_ids[idx]}",
+                        "text": ""
+                    }
+                )
+                for idx in range(size)
+            ],
+            wait=True
+        )
+
+def measure(client: QdrantClient, name: str, users: int, pdfs_per_user: int, queries: int, rng: np.random.Generator) -> list[float]:
+    latencies = []
+    for _ in range(queries):
+        user, pdf = rng.integers(0, users), rng.integers(0, pdfs_per_user)
+        query_filter = models.Filter(
+            must=[
+                models.FieldCondition(key="user_id", match=models.MatchValue(value=f"user-{user}")),
+                models.FieldCondition(key="source", match=models.MatchValue(value=f"pdf-{user}-{pdf}"))
+            ]
+        )
+        start = time.perf_counter()
+        client.query_points(
+            collection_name=name,
+            query=rng.standard_normal(DIM, dtype=np.float32).tolist(),
+            query_filter=query_filter,
+            limit=5
+        )
+        latencies.append(time.perf_counter() - start)
+    return latencies
+
+def main(args: argparse.Namespace):
+    client = QdrantClient(url=args.url) if args.url else QdrantClient(":memory:")
+    rng = np.random.default_rng(0)
+
+    print(f"{'points':>10}{'layout':>14}{'p50 ms':>10}{'p95 ms':>10}")
+    for points in args.points:
+        for layout in args.layouts:
+            name = f"bench_filtered_{layout}"
+            create(client, name, layout)
+            fill(client, name, points, args.users, args.pdfs_per_user, rng)
+
+            latencies = sorted(measure(client, name, args.users, args.pdfs_per_user, args.queries, rng))
+            p50 = statistics.median(latencies) * 1000
+            p95 = latencies[int(0.95 * (len(latencies) - 1))] * 1000
+            print(f"{points:>10}{layout:>14}{p50:>10.2f}{p95:>10.2f}")
+
+            client.delete_collection(name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure filtered search latency as the collection grows")
+    parser.add_argument("--url", default=None, help="Qdrant url, defaults to an in-process local stand-in")
+    parser.add_argument("--points", type=int, nargs="+", default=[10_000, 50_000])
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--pdfs-per-user", type=int, default=5)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--layouts", nargs="+", choices=LAYOUTS, default=LAYOUTS)
+    args = parser.parse_args()
+
+    main(args)
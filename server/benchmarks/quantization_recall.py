@@ -0,0 +1,166 @@
+"""
+Quantization recall vs memory benchmark
+
+Compares the vector storage settings of create_collection on the same corpus:
+
+    none     float32 vectors in RAM (the original layout)
+    scalar   int8 quantized vectors in RAM, 4x smaller
+    binary   1 bit per dimension in RAM, 32x smaller
+
+each with and without rescoring the oversampled candidates against the original
+vectors, which Qdrant reads from disk when QDRANT_VECTORS_ON_DISK is set.
+
+Recall@k is measured against exact search. By default quantization is simulated
+with numpy, which needs no server. Pass --url to measure a real Qdrant instance,
+which also reports search latency. The RAM columns extrapolate the vector storage
+(HNSW graph and payloads excluded) to --corpus-size chunks, with the original
+vectors in RAM and on disk.
+
+Random clustered vectors stand in for the corpus unless --embeddings points to a
+.npy matrix of real chunk embeddings, which gives more representative recall.
+
+Usage (from the server directory):
+    python -m benchmarks.quantization_recall --points 100000 --corpus-size 5000000
+    python -m benchmarks.quantization_recall --url http://localhost:6333 --embeddings chunks.npy
+"""
+import argparse
+import statistics
+import time
+
+import numpy as np
+from qdrant_client import QdrantClient, models
+
+QUANTIZATIONS = ["none", "scalar", "binary"]
+
+
+def load_vectors(args: argparse.Namespace, rng: np.random.Generator) -> tuple[np.ndarray, np.ndarray]:
+    if args.embeddings:
+        vectors = np.load(args.embeddings).astype(np.float32)
+        rng.shuffle(vectors)
+        queries, vectors = vectors[:args.queries], vectors[args.queries:]
+    else:
+        # Chunks of one pdf sit close together, so draw points around cluster centers
+        centers = rng.standard_normal((args.points // 50 + 1, args.dim), dtype=np.float32)
+        def sample(size: int) -> np.ndarray:
+            return centers[rng.integers(0, len(centers), size)] + 0.7 * rng.standard_normal((size, args.dim), dtype=np.float32)
+        vectors, queries = sample(args.points), sample(args.queries)
+
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return vectors, queries
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    idx = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.take_along_axis(scores, idx, axis=1).argsort(axis=1)[:, ::-1]
+    return np.take_along_axis(idx, order, axis=1)
+
+def quantized_scores(vectors: np.ndarray, queries: np.ndarray, quantization: str) -> np.ndarray:
+    if quantization == "scalar":
+        # Same scheme as ScalarQuantizationConfig(type=INT8, quantile=0.99)
+        low, high = np.quantile(vectors, [0.005, 0.995])
+        step = (high - low) / 255
+        codes = np.round((np.clip(vectors, low, high) - low) / step).astype(np.uint8)
+        return queries @ (codes.astype(np.float32) * step + low).T
+    if quantization == "binary":
+        # Sign bits on both sides, matching hamming distance up to a constant
+        return np.sign(queries) @ np.sign(vectors).T
+    return queries @ vectors.T
+
+def simulate(vectors: np.ndarray, queries: np.ndarray, quantization: str, rescore: bool, k: int, oversampling: float) -> np.ndarray:
+    scores = quantized_scores(vectors, queries, quantization)
+    if quantization == "none" or not rescore:
+        return top_k(scores, k)
+
+    candidates = top_k(scores, int(k * oversampling))
+    exact = np.einsum("qd,qcd->qc", queries, vectors[candidates])
+    return np.take_along_axis(candidates, top_k(exact, k), axis=1)
+
+def quantization_config(quantization: str) -> models.QuantizationConfig | None:
+    if quantization == "scalar":
+        return models.ScalarQuantization(
+            scalar=models.ScalarQuantizationConfig(type=models.ScalarType.INT8, quantile=0.99, always_ram=True)
+        )
+    if quantization == "binary":
+        return models.BinaryQuantization(binary=models.BinaryQuantizationConfig(always_ram=True))
+    return None
+
+def create(client: QdrantClient, name: str, vectors: np.ndarray, quantization: str, on_disk: bool):
+    if client.collection_exists(name):
+        client.delete_collection(name)
+
+    client.create_collection(
+        collection_name=name,
+        vectors_config=models.VectorParams(size=vectors.shape[1], distance=models.Distance.COSINE, on_disk=on_disk),
+        quantization_config=quantization_config(quantization)
+    )
+    client.upload_collection(collection_name=name, vectors=vectors, ids=range(len(vectors)), batch_size=1000, wait=True)
+
+    # Wait for indexing and quantization to finish before measuring
+    while client.get_collection(name).status != models.CollectionStatus.GREEN:
+        time.sleep(1)
+
+def search(client: QdrantClient, name: str, queries: np.ndarray, quantization: str, rescore: bool, k: int, oversampling: float) -> tuple[np.ndarray, list[float]]:
+    search_params = None
+    if quantization != "none":
+        search_params = models.SearchParams(
+            quantization=models.QuantizationSearchParams(rescore=rescore, oversampling=oversampling)
+        )
+
+    results, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        response = client.query_points(collection_name=name, query=query.tolist(), limit=k, search_params=search_params)
+        latencies.append(time.perf_counter() - start)
+        results.append([point.id for point in response.points])
+    return np.array(results), latencies
+
+def ram_gb(corpus_size: int, dim: int, quantization: str, on_disk: bool) -> float:
+    original = 0 if on_disk else corpus_size * dim * 4
+    quantized = {"none": 0, "scalar": corpus_size * dim, "binary": corpus_size * dim / 8}[quantization]
+    return (original + quantized) / 1024 ** 3
+
+def main(args: argparse.Namespace):
+    rng = np.random.default_rng(0)
+    vectors, queries = load_vectors(args, rng)
+    exact = top_k(queries @ vectors.T, args.k)
+    client = QdrantClient(url=args.url) if args.url else None
+
+    print(f"{len(vectors)} vectors of dim {vectors.shape[1]}, RAM extrapolated to {args.corpus_size} chunks")
+    print(f"{'quantization':>14}{'rescore':>9}{'recall@' + str(args.k):>11}{'p50 ms':>9}{'RAM GB':>9}{'RAM GB on disk':>16}")
+    for quantization in args.quantizations:
+        name = f"bench_quantization_{quantization}"
+        if client is not None:
+            create(client, name, vectors, quantization, on_disk=args.on_disk)
+
+        for rescore in ([False, True] if quantization != "none" else [False]):
+            p50 = float("nan")
+            if client is not None:
+                found, latencies = search(client, name, queries, quantization, rescore, args.k, args.oversampling)
+                p50 = statistics.median(latencies) * 1000
+            else:
+                found = simulate(vectors, queries, quantization, rescore, args.k, args.oversampling)
+
+            recall = np.mean([len(set(a) & set(b)) / args.k for a, b in zip(found, exact)])
+            ram = ram_gb(args.corpus_size, vectors.shape[1], quantization, on_disk=False)
+            ram_on_disk = ram_gb(args.corpus_size, vectors.shape[1], quantization, on_disk=True)
+            print(f"{quantization:>14}{str(rescore):>9}{recall:>11.3f}{p50:>9.2f}{ram:>9.2f}{ram_on_disk:>16.2f}")
+
+        if client is not None:
+            client.delete_collection(name)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure recall and memory of the vector quantization settings")
+    parser.add_argument("--url", default=None, help="Qdrant url, defaults to a numpy simulation")
+    parser.add_argument("--embeddings", default=None, help=".npy matrix of real chunk embeddings")
+    parser.add_argument("--points", type=int, default=50_000, help="Random vectors to generate without --embeddings")
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--oversampling", type=float, default=2.0)
+    parser.add_argument("--on-disk", action="store_true", help="Store the original vectors on disk (--url only)")
+    parser.add_argument("--corpus-size", type=int, default=5_000_000)
+    parser.add_argument("--quantizations", nargs="+", choices=QUANTIZATIONS, default=QUANTIZATIONS)
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,59 @@
+"""
+API / worker startup time benchmark
+
+Runs each measurement in a fresh interpreter, as a new API replica or Celery
+worker would start, and reports for every embedding backend:
+
+    import     time to import the FastAPI app (what uvicorn waits for before serving)
+    load       time to load the embedding model on first use
+    encode     time of the first query encoding after loading
+    rss        peak resident memory of the process
+
+Usage (from the server directory):
+    python -m benchmarks.startup_time --backends sentence-transformers fastembed
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+
+PROBE = """
+import json, resource, time
+start = time.perf_counter()
+import src
+imported = time.perf_counter()
+from src.docs_ingestion.service import qdrant_service
+qdrant_service.model
+loaded = time.perf_counter()
+qdrant_service.encode_texts(["How long is the warranty period?"])
+encoded = time.perf_counter()
+print(json.dumps({
+    "import": imported - start,
+    "load": loaded - imported,
+    "encode": encoded - loaded,
+    "rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+}))
+"""
+
+
+def probe(backend: str) -> dict:
+    env = {**os.environ, "EMBEDDING_BACKEND": backend, "EMBEDDING_PRELOAD": "false"}
+    output = subprocess.run([sys.executable, "-c", PROBE], env=env, capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+def main(args: argparse.Namespace):
+    print(f"{'backend':<24}{'import s':>10}{'load s':>10}{'encode s':>10}{'rss MB':>10}")
+    for backend in args.backends:
+        runs = [probe(backend) for _ in range(args.repeat)]
+        best = {key: min(run[key] for run in runs) for key in runs[0]}
+        print(f"{backend:<24}{best['import']:>10.2f}{best['load']:>10.2f}{best['encode']:>10.3f}{best['rss_mb']:>10.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure app import, model load and first encode time per embedding backend")
+    parser.add_argument("--backends", nargs="+", default=["sentence-transformers", "fastembed"])
+    parser.add_argument("--repeat", type=int, default=3, help="Runs per backend, the best one is reported")
+    args = parser.parse_args()
+
+    main(args)
@@ -0,0 +1,31 @@
+"""composite indexes on documents and chats
+
+Revision ID: 8d2c6f0e5a17
+Revises: 3b7e1d9a4c21
+Create Date: 2026-10-18 11:02:15.883410
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = '8d2c6f0e5a17'
+down_revision: Union[str, None] = '3b7e1d9a4c21'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.create_index('ix_documents_user_id_created_at', 'documents', ['user_id', 'created_at'], unique=False)
+    op.create_index('ix_chats_user_id_pdf_id_created_at', 'chats', ['user_id', 'pdf_id', 'created_at'], unique=False)
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_index('ix_chats_user_id_pdf_id_created_at', table_name='chats')
+    op.drop_index('ix_documents_user_id_created_at', table_name='documents')
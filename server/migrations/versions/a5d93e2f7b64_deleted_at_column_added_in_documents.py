@@ -0,0 +1,29 @@
+"""deleted_at column added in documents table
+
+Revision ID: a5d93e2f7b64
+Revises: e41a7c3b9f02
+Create Date: 2026-10-18 19:02:41.583216
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'a5d93e2f7b64'
+down_revision: Union[str, None] = 'e41a7c3b9f02'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('documents', sa.Column('deleted_at', sa.DateTime(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('documents', 'deleted_at')
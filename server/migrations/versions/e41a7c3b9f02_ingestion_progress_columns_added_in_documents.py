@@ -0,0 +1,35 @@
+"""ingestion progress columns added in documents table
+
+Revision ID: e41a7c3b9f02
+Revises: 8d2c6f0e5a17
+Create Date: 2026-10-18 12:20:07.319558
+
+"""
+from typing import Sequence, Union
+
+from alembic import op
+import sqlalchemy as sa
+import sqlmodel
+
+
+# revision identifiers, used by Alembic.
+revision: str = 'e41a7c3b9f02'
+down_revision: Union[str, None] = '8d2c6f0e5a17'
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    """Upgrade schema."""
+    op.add_column('documents', sa.Column('chunks_done', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('documents', sa.Column('pages_done', sa.Integer(), server_default='0', nullable=False))
+    op.add_column('documents', sa.Column('pages_total', sa.Integer(), nullable=True))
+    op.add_column('documents', sa.Column('ingest_duration_ms', sa.Integer(), nullable=True))
+
+
+def downgrade() -> None:
+    """Downgrade schema."""
+    op.drop_column('documents', 'ingest_duration_ms')
+    op.drop_column('documents', 'pages_total')
+    op.drop_column('documents', 'pages_done')
+    op.drop_column('documents', 'chunks_done')
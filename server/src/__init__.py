@@ -1,14 +1,24 @@
 from fastapi import FastAPI
 from contextlib import asynccontextmanager
+import asyncio
 from fastapi.middleware.cors import CORSMiddleware
 
 from src.auth.routes import auth_router
 from src.docs_ingestion.routes import documents_router
 from src.db.main import initdb
+from src.docs_ingestion.service import qdrant_service
+from src.docs_ingestion.embeddings import get_embedder, get_reranker
+from src.config import Config
+from src.middlewares import RequestContextMiddleware, MaxBodySizeMiddleware
+from src.metrics import make_metrics_app
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     await initdb()
+    # Warm the embedding model in the background instead of blocking startup on it
+    asyncio.get_running_loop().run_in_executor(qdrant_service.executor, get_embedder)
+    if Config.RERANK_ENABLED:
+        asyncio.get_running_loop().run_in_executor(qdrant_service.executor, get_reranker)
     yield
     print("Server is stopping...")
 
@@ -21,13 +31,21 @@ app = FastAPI(
     lifespan=lifespan
 )
 
+# Added before CORS so the 413 responses still get CORS headers
+app.add_middleware(MaxBodySizeMiddleware, max_body_size=Config.MAX_UPLOAD_BYTES + 1024 * 1024)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["http://localhost:3000"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "traceparent"],
 )
 
+app.add_middleware(RequestContextMiddleware)
+
+app.mount("/metrics", make_metrics_app(Config.REDIS_URL, queues=["celery"]))
+
 app.include_router(auth_router, prefix=f"/api/{version}/auth", tags=["Authentication"])
 app.include_router(documents_router, prefix=f"/api/{version}/documents", tags=["Documents"])
\ No newline at end of file
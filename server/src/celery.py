@@ -1,9 +1,29 @@
 from celery import Celery
-import requests
-import json
+from celery.signals import worker_init, before_task_publish, task_prerun, task_postrun
+from celery.concurrency import get_implementation
+from contextlib import nullcontext
+from sqlmodel import Session, update, delete, select
+from prometheus_client import start_http_server
+from contextvars import Token
+from datetime import datetime, timedelta
+import asyncio
+import time
+import uuid
+import gc
+import os
 
 from src.config import Config
-from src.docs_ingestion.service import qdrant_service
+from src.docs_ingestion.service import qdrant_service, IngestCancelled
+from src.db.main import get_sync_engine
+from src.models import Document, Chat
+from src.docs_ingestion.progress import ProgressPublisher
+from src.docs_ingestion.context import answer_cache
+from src.docs_ingestion.cache import text_hash
+from src.docs_ingestion.handoff import ingest_handoff
+from src.docs_ingestion.storage import get_storage
+from src.metrics import CELERY_TASK_SECONDS, metrics_registry
+from src.tracing import current_traceparent, current_trace_id, start_span
+from src.utils import server_timing
 
 celery_app = Celery(
     "askpdf",
@@ -11,27 +31,257 @@ celery_app = Celery(
     backend=Config.REDIS_URL
 )
 
+progress_publisher = ProgressPublisher(redis_url=Config.REDIS_URL)
+
+# Needs `celery -A src.celery beat` running next to the workers
+if Config.RECONCILE_INTERVAL_SECONDS > 0:
+    celery_app.conf.beat_schedule = {
+        "reconcile-orphan-points": {
+            "task": "src.celery.reconcile_orphan_points",
+            "schedule": Config.RECONCILE_INTERVAL_SECONDS,
+            "kwargs": {"collection_name": "pdf_docs"}
+        }
+    }
+
+@worker_init.connect
+def preload_embedding_model(**kwargs):
+    """Load the model in the parent before the prefork pool starts, so children share its memory copy-on-write"""
+    if not Config.EMBEDDING_PRELOAD:
+        return
+
+    qdrant_service.model
+    # Fail the worker at startup, instead of every ingest, when TRANSFORMER_MODEL changed under an existing collection
+    if qdrant_service.client.collection_exists("pdf_docs"):
+        qdrant_service.check_vector_size("pdf_docs")
+    # Keep the cyclic GC from writing to (and so copying) the preloaded objects in every child
+    gc.freeze()
+
+@worker_init.connect
+def start_metrics_server(sender, **kwargs):
+    """Serve the worker's metrics from the parent process, adding up the pool children with PROMETHEUS_MULTIPROC_DIR"""
+    if not Config.CELERY_METRICS_PORT:
+        return
+
+    # Tasks of the prefork pool run in the children, whose metrics the parent only sees through PROMETHEUS_MULTIPROC_DIR
+    pool = get_implementation(sender.pool_cls)
+    if pool.__module__ not in ("celery.concurrency.solo", "celery.concurrency.thread") and "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        raise RuntimeError("CELERY_METRICS_PORT needs PROMETHEUS_MULTIPROC_DIR with the prefork pool, or --pool solo or threads")
+
+    start_http_server(Config.CELERY_METRICS_PORT, registry=metrics_registry())
+
+@before_task_publish.connect
+def inject_trace_context(headers: dict | None = None, **kwargs):
+    """Carry the trace of the request publishing a task in its message, e.g. from /ingest into the ingestion"""
+    traceparent = current_traceparent.get()
+    if headers is not None and traceparent is not None:
+        headers.setdefault("traceparent", traceparent)
+
+# task id -> (start time, token of the task's trace span)
+running_tasks: dict[str, tuple[float, Token]] = {}
+
+@task_prerun.connect
+def start_task_span(task_id: str, task, **kwargs):
+    parent = task.request.get("traceparent") or (task.request.headers or {}).get("traceparent")
+    running_tasks[task_id] = (time.perf_counter(), start_span(parent))
+
+@task_postrun.connect
+def end_task_span(task_id: str, task, state: str | None = None, **kwargs):
+    started = running_tasks.pop(task_id, None)
+    if started is None:
+        return
+
+    start, token = started
+    CELERY_TASK_SECONDS.labels(task=task.name, state=state or "UNKNOWN").observe(time.perf_counter() - start)
+    current_traceparent.reset(token)
+
+def update_document(document_id: str, **values) -> bool:
+    """
+    Write straight to the documents table through the worker's pooled connection.
+
+    Returns False, writing nothing, when the document was deleted meanwhile.
+    """
+    with Session(get_sync_engine()) as session:
+        result = session.exec(update(Document).where(Document.id == uuid.UUID(document_id)).where(Document.deleted_at.is_(None)).values(**values))
+        session.commit()
+        return result.rowcount > 0
+
+def discard_deleted_ingest(collection_name: str, document_id: str, pdf_path: str):
+    """
+    Delete the points an ingestion upserted after its document was deleted.
+
+    purge_document may have run while the ingestion was still upserting, so
+    the ingestion cleans up after itself as well.
+    """
+    points = qdrant_service.delete_points(collection_name, pdf_path)
+    qdrant_service.checkpoint.clear(document_id)
+    print(f"ingest_docs_into_qdrant: Document {document_id} was deleted while ingesting, deleted {points} points")
+
+def reusable_points(pdf_url: str) -> int:
+    """Number of points the ingested pdf at `pdf_url` was left with, 0 if it is deleted or gone"""
+    with Session(get_sync_engine()) as session:
+        statement = select(Document.chunks_done).where(Document.pdf_url == pdf_url).where(Document.insert_status == True).where(Document.deleted_at.is_(None))
+        return session.exec(statement).first() or 0
+
+def discard_handoff(handoff_key: str | None):
+    """Drop the handed off pdf once it is no longer needed, retries parse it again"""
+    if ingest_handoff is None or handoff_key is None:
+        return
+
+    try:
+        ingest_handoff.discard(handoff_key)
+    except Exception as e:
+        print("discard_handoff: Error: ", str(e))
+
+# Ingestion is idempotent and checkpointed, so a task lost with its worker is
+# redelivered and failures are retried, resuming after the last committed batch
+@celery_app.task(
+    bind=True,
+    acks_late=True,
+    reject_on_worker_lost=True,
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    max_retries=3
+)
+def ingest_docs_into_qdrant(self, collection_name: str, document_id: str, pdf_path: str, user_id: str, reuse_from: str | None = None, handoff_key: str | None = None):
+    try:
+        start = time.perf_counter()
+        progress_publisher.publish(document_id, "ingesting")
+
+        def on_progress(chunks_done: int, pages_done: int, pages_total: int | None):
+            if not update_document(document_id, chunks_done=chunks_done, pages_done=pages_done, pages_total=pages_total):
+                raise IngestCancelled(document_id)
+            progress_publisher.publish(document_id, "ingesting", chunks_done, pages_done, pages_total)
+
+        timings: dict[str, float] = {}
+        handoff = ingest_handoff.fetch(handoff_key) if ingest_handoff is not None and handoff_key is not None else nullcontext(None)
+        with handoff as local_path:
+            if handoff_key is not None and local_path is None:
+                print("ingest_docs_into_qdrant: Handed off pdf not found, downloading it")
+
+            # The duplicate found at upload may have been deleted since
+            reuse_points = reusable_points(reuse_from) if reuse_from is not None else 0
+
+            qdrant_service.ingest_documents(
+                collection_name=collection_name,
+                document_id=document_id,
+                pdf_path=pdf_path,
+                user_id=user_id,
+                reuse_from=reuse_from if reuse_points else None,
+                reuse_points=reuse_points,
+                local_path=local_path,
+                on_progress=on_progress,
+                timings=timings
+            )
+        discard_handoff(handoff_key)
+
+        if not update_document(document_id, insert_status=True, ingest_duration_ms=round((time.perf_counter() - start) * 1000)):
+            discard_deleted_ingest(collection_name, document_id, pdf_path)
+            return
+        progress_publisher.publish(document_id, "done")
+
+        # Timings stay empty when the points of a duplicate were reused
+        print(f"ingest_docs_into_qdrant: Document ingested successfully, trace {current_trace_id()}" + (f", {server_timing(timings)}" if timings else ""))
+    except IngestCancelled:
+        discard_handoff(handoff_key)
+        discard_deleted_ingest(collection_name, document_id, pdf_path)
+    except Exception as e:
+        print(f"ingest_docs_into_qdrant: Error in trace {current_trace_id()}: ", str(e))
+        failed = self.request.retries >= self.max_retries
+        if failed:
+            discard_handoff(handoff_key)
+        progress_publisher.publish(document_id, "failed" if failed else "retrying")
+        raise Exception("ingest_docs_into_qdrant: Error ingesting the document")
+
+
+def delete_chats(document_id: str, batch_size: int = Config.PURGE_BATCH_SIZE) -> int:
+    """Delete the chats of a document `batch_size` rows at a time, each batch in its own transaction"""
+    deleted = 0
+    with Session(get_sync_engine()) as session:
+        while True:
+            batch = select(Chat.id).where(Chat.pdf_id == uuid.UUID(document_id)).limit(batch_size).scalar_subquery()
+            result = session.exec(delete(Chat).where(Chat.id.in_(batch)))
+            session.commit()
+            if result.rowcount == 0:
+                return deleted
+            deleted += result.rowcount
+
+async def delete_stored_pdf(pdf_url: str):
+    """Delete an uploaded pdf with a storage client of its own, the module one belongs to the API's event loop"""
+    storage = get_storage()
+    try:
+        await storage.delete(pdf_url.split("/")[-1])
+    finally:
+        await storage.close()
+
+@celery_app.task(
+    acks_late=True,
+    reject_on_worker_lost=True,
+    autoretry_for=(Exception,),
+    retry_backoff=True,
+    max_retries=5
+)
+def purge_document(collection_name: str, document_id: str, pdf_path: str):
+    """
+    Remove everything left of a deleted document: its points, its chats, its
+    stored pdf, then its row.
+
+    The delete route has already set `deleted_at`, so the document is hidden
+    meanwhile. Each step is idempotent, so a retry picks up where a failed run
+    stopped, and the row goes last so a failed purge is still visible in the
+    documents table, where reconcile_orphan_points queues it again.
+    """
+    try:
+        points = qdrant_service.delete_points(collection_name, pdf_path)
+        qdrant_service.checkpoint.clear(document_id)
+        chats = delete_chats(document_id)
+        asyncio.run(delete_stored_pdf(pdf_path))
+
+        with Session(get_sync_engine()) as session:
+            content_hash = session.exec(select(Document.content_hash).where(Document.id == uuid.UUID(document_id))).first()
+            session.exec(delete(Document).where(Document.id == uuid.UUID(document_id)))
+            session.commit()
+
+            # Cached answers are shared by every copy of the pdf, drop them with the last one
+            if content_hash is None:
+                answer_cache.invalidate(text_hash(pdf_path))
+            elif session.exec(select(Document.id).where(Document.content_hash == content_hash).limit(1)).first() is None:
+                answer_cache.invalidate(content_hash)
+
+        print(f"purge_document: Deleted {points} points and {chats} chats of document {document_id}")
+        return {"points": points, "chats": chats}
+    except Exception as e:
+        print("purge_document: Error: ", str(e))
+        raise Exception("purge_document: Error purging the document")
+
 @celery_app.task
-def ingest_docs_into_qdrant(collection_name: str, pdf_path: str, token: str, user_id: str):
+def reconcile_orphan_points(collection_name: str) -> dict:
+    """
+    Purge the points of pdfs that have no row in the documents table anymore,
+    e.g. deleted before purge_document existed, and report how many were reclaimed.
+
+    Documents deleted more than PURGE_GRACE_SECONDS ago whose purge never
+    finished, e.g. it ran out of retries, get their purge queued again.
+    """
     try:
-        qdrant_service.ingest_documents(collection_name=collection_name, pdf_path=pdf_path, user_id=user_id)
-
-        response = requests.patch(
-            "http://localhost:8000/api/v1/documents/update/status",
-            data=json.dumps({
-                "pdf_path": pdf_path,
-                "insert_status": True
-            }),
-            headers={
-                "Content-Type": "application/json",
-                "Authorization": f"Bearer {token}"
-            }
-        )
-
-        if response.status_code != 200:
-            raise Exception("ingest_docs_into_qdrant: Error making a patch request to update status")
-
-        print("ingest_docs_into_qdrant: Document ingested successfully")
+        with Session(get_sync_engine()) as session:
+            cutoff = datetime.now() - timedelta(seconds=Config.PURGE_GRACE_SECONDS)
+            stuck = session.exec(select(Document.id, Document.pdf_url).where(Document.deleted_at < cutoff)).all()
+        for document_id, pdf_url in stuck:
+            purge_document.delay(collection_name=collection_name, document_id=str(document_id), pdf_path=pdf_url)
+
+        # Points are deleted once the scroll is done, so it doesn't skip any
+        orphans: list[str] = []
+        kept = 0
+        with Session(get_sync_engine()) as session:
+            for sources in qdrant_service.iter_sources(collection_name):
+                known = set(session.exec(select(Document.pdf_url).where(Document.pdf_url.in_(sources))).all())
+                kept += len(known)
+                orphans.extend(source for source in sources if source not in known)
+
+        reclaimed = sum(qdrant_service.delete_points(collection_name, source) for source in orphans)
+
+        print(f"reconcile_orphan_points: Reclaimed {reclaimed} points of {len(orphans)} deleted pdfs, {kept} pdfs kept, {len(stuck)} purges queued again")
+        return {"orphan_pdfs": len(orphans), "reclaimed_points": reclaimed, "kept_pdfs": kept, "requeued_purges": len(stuck)}
     except Exception as e:
-        print("ingest_docs_into_qdrant: Error: ", str(e))
-        raise Exception("ingest_docs_into_qdrant: Error ingesting the document")
\ No newline at end of file
+        print("reconcile_orphan_points: Error: ", str(e))
+        raise Exception("reconcile_orphan_points: Error reconciling the collection")
@@ -2,22 +2,98 @@ from pydantic_settings import BaseSettings, SettingsConfigDict
 
 class Settings(BaseSettings):
     DATABASE_URL: str
+    SYNC_DATABASE_URL: str | None = None # used by the Celery worker, derived from DATABASE_URL by default
+    DB_ECHO: bool = False # log every SQL statement
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 10
+    DB_POOL_TIMEOUT: int = 30 # seconds to wait for a free connection
+    DB_POOL_RECYCLE: int = 30 * 60
+    DB_POOL_PRE_PING: bool = True
+    DB_STATEMENT_CACHE_SIZE: int = 100 # set to 0 behind pgbouncer in transaction mode
     JWT_SECRET_KEY: str
     
     # Supabase
-    SUPABASE_URL: str
-    SUPABASE_KEY: str
+    SUPABASE_URL: str | None = None # required with STORAGE_BACKEND=supabase
+    SUPABASE_KEY: str | None = None
+
+    # Storage
+    STORAGE_BACKEND: str = "supabase" # or "s3" for any S3-compatible store, e.g. the MinIO in docker-compose.yaml, or "local"
+    STORAGE_LOCAL_DIR: str = "storage" # where STORAGE_BACKEND=local keeps the files, must be shared with the workers
+    STORAGE_BUCKET: str = "docs"
+    MAX_UPLOAD_BYTES: int = 50 * 1024 * 1024
+    UPLOAD_CHUNK_BYTES: int = 1024 * 1024 # read from the spooled upload at a time
+    UPLOAD_PART_BYTES: int = 8 * 1024 * 1024 # S3 multipart part size, at least 5 MiB
+    S3_ENDPOINT_URL: str = "http://localhost:9000"
+    S3_ACCESS_KEY_ID: str = "minioadmin"
+    S3_SECRET_ACCESS_KEY: str = "minioadmin"
+    S3_REGION: str = "us-east-1"
+    S3_PUBLIC_URL: str | None = None # base url of public objects, S3_ENDPOINT_URL by default
 
     # Groq
-    GROQ_API_KEY: str
+    GROQ_API_KEY: str | None = None # required with LLM_BACKEND=groq
+    LLM_BACKEND: str = "groq" # or "fake" for load tests, which answers without any network call
+    FAKE_LLM_LATENCY_MS: int = 300 # time to the first token
+    FAKE_LLM_TOKENS_PER_SECOND: float = 200
+    FAKE_LLM_ANSWER_TOKENS: int = 150
     
     # Qdrant
-    QDRANT_HOST: str
-    QDRANT_PORT: int
+    QDRANT_HOST: str = "localhost"
+    QDRANT_PORT: int = 6333
+    QDRANT_LOCATION: str | None = None # ":memory:" or a directory to run Qdrant in-process instead, e.g. for load tests
     TRANSFORMER_MODEL: str
+    EMBEDDING_BACKEND: str = "sentence-transformers" # or "fastembed" for ONNX Runtime inference
+    EMBEDDING_PRELOAD: bool = False # load the model in the Celery parent so prefork children share it
+    EMBEDDING_BATCH_SIZE: int = 64
+    EMBEDDING_CACHE_ENABLED: bool = False # ~1.6 KB of Redis per chunk (384 float32 + key), about 1.6 GB per million chunks
+    EMBEDDING_CACHE_REDIS_URL: str | None = None # a separate instance with maxmemory and allkeys-lru, REDIS_URL by default
+    EMBEDDING_CACHE_TTL_SECONDS: int = 7 * 24 * 60 * 60
+    QUERY_CACHE_BACKEND: str = "memory" # "memory" or "redis" to share the cache across replicas
+    QUERY_CACHE_SIZE: int = 1024
+    QUERY_CACHE_TTL_SECONDS: int = 60 * 60
+    INFERENCE_WORKERS: int = 2 # threads for CPU model inference in the API process
+    QDRANT_UPSERT_BATCH_SIZE: int = 256
+    QDRANT_MULTITENANCY: bool = False # per-user HNSW graphs instead of one global graph
+    QDRANT_QUANTIZATION: str = "none" # "scalar" (int8, 4x smaller) or "binary" (32x smaller)
+    QDRANT_VECTORS_ON_DISK: bool = False # keep the original vectors on disk, quantized ones stay in RAM
+    QDRANT_RESCORE: bool = True # re-rank quantized candidates with the original vectors
+    QDRANT_OVERSAMPLING: float = 2.0 # candidates fetched per result before rescoring
+    RETRIEVAL_MODE: str = "dense" # "hybrid" fuses dense and BM25 sparse search with reciprocal rank fusion
+    SPARSE_MODEL: str = "Qdrant/bm25"
+    HYBRID_PREFETCH_LIMIT: int = 20 # candidates from each search fed into the fusion
+    RETRIEVAL_LIMIT: int = 5 # chunks added to the chat prompt
+    RERANK_ENABLED: bool = False # over-fetch and re-order the chunks with a cross-encoder
+    RERANK_MODEL: str = "cross-encoder/ms-marco-MiniLM-L-6-v2"
+    RERANK_CANDIDATES: int = 50
+    RERANK_BATCH_SIZE: int = 16
+    RERANK_BUDGET_MS: int = 250 # past this, the chunks are kept in vector search order
+
+    # Ingestion
+    CHUNKER: str = "token" # or "character" for the original 300 character chunks
+    CHUNK_MAX_TOKENS: int = 250 # MiniLM models truncate their input at 256 tokens
+    CHUNK_OVERLAP_TOKENS: int = 32
+    INGEST_PARSE_WORKERS: int = 4 # parse processes per ingest task, 1 parses in the task process and 0 uses every core. Every prefork child starts its own, so keep this times the worker concurrency near the core count
+    INGEST_PAGES_PER_TASK: int = 16
+    INGEST_HANDOFF: str = "none" # "spool" or "redis" to pass the uploaded bytes to the worker instead of it downloading the pdf
+    INGEST_SPOOL_DIR: str = "/tmp/askpdf-spool" # must be shared by the API and the workers
+    HANDOFF_REDIS_URL: str | None = None # a separate instance for INGEST_HANDOFF=redis, which otherwise hands off through the spool to keep pdfs out of the broker
+    INGEST_HANDOFF_TTL_SECONDS: int = 60 * 60
+    PURGE_BATCH_SIZE: int = 1000 # points and chats deleted at a time when a document is deleted
+    RECONCILE_INTERVAL_SECONDS: int = 24 * 60 * 60 # how often celery beat purges orphan points, 0 disables it
+    PURGE_GRACE_SECONDS: int = 60 * 60 # deleted documents still in the table after this get their purge queued again by the reconciliation
+
+    # Chat
+    CHAT_HISTORY_TURNS: int = 20
+    CHAT_CONTEXT_TOKEN_BUDGET: int = 6000
+    CHAT_HISTORY_SUMMARY: bool = False
+    CHAT_SUMMARY_TTL_SECONDS: int = 7 * 24 * 60 * 60
+    ANSWER_CACHE_ENABLED: bool = False
+    ANSWER_CACHE_THRESHOLD: float = 0.95 # cosine similarity between query embeddings
+    ANSWER_CACHE_MAX_ENTRIES: int = 500 # per pdf
+    ANSWER_CACHE_TTL_SECONDS: int = 7 * 24 * 60 * 60
 
     # Celery
     REDIS_URL: str
+    CELERY_METRICS_PORT: int = 0 # Prometheus endpoint of the worker, e.g. 9808. Needs the solo or threads pool, or PROMETHEUS_MULTIPROC_DIR with prefork
 
     model_config = SettingsConfigDict(
         env_file=".env",
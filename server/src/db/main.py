@@ -1,17 +1,46 @@
 from sqlmodel import create_engine, SQLModel
-from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlmodel.ext.asyncio.session import AsyncSession
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.engine import Engine, make_url
+from functools import lru_cache
 
 from src.config import Config
+from src.metrics import instrument_engine
 
-engine = AsyncEngine(
-    create_engine(
-        url=Config.DATABASE_URL,
-        echo=True
-    )
+engine = create_async_engine(
+    url=Config.DATABASE_URL,
+    echo=Config.DB_ECHO,
+    pool_size=Config.DB_POOL_SIZE,
+    max_overflow=Config.DB_MAX_OVERFLOW,
+    pool_timeout=Config.DB_POOL_TIMEOUT,
+    pool_recycle=Config.DB_POOL_RECYCLE,
+    pool_pre_ping=Config.DB_POOL_PRE_PING,
+    connect_args={
+        # asyncpg's own statement cache, and the one of SQLAlchemy's asyncpg adapter
+        "statement_cache_size": Config.DB_STATEMENT_CACHE_SIZE,
+        "prepared_statement_cache_size": Config.DB_STATEMENT_CACHE_SIZE
+    } if make_url(Config.DATABASE_URL).drivername == "postgresql+asyncpg" else {}
+)
+instrument_engine(engine.sync_engine)
+
+async_session = async_sessionmaker(
+    bind=engine, class_=AsyncSession, expire_on_commit=False
 )
 
+@lru_cache
+def get_sync_engine() -> Engine:
+    """Pooled sync engine for the Celery worker, created on first use in each process"""
+    # sqlite+aiosqlite (load tests) maps to the stdlib sqlite3 driver
+    url = Config.SYNC_DATABASE_URL or Config.DATABASE_URL.replace("+asyncpg", "+psycopg2").replace("+aiosqlite", "")
+    engine = create_engine(
+        url=url,
+        pool_size=2,
+        max_overflow=2,
+        pool_pre_ping=True
+    )
+    instrument_engine(engine)
+    return engine
+
 async def initdb():
     async with engine.begin() as conn:
         await conn.run_sync(
@@ -20,9 +49,5 @@ async def initdb():
 
 async def get_db_session():
     """Dependency to provide the session object"""
-    async_session = sessionmaker(
-        bind=engine, class_=AsyncSession, expire_on_commit=False
-    )
-
     async with async_session() as session:
         yield session
\ No newline at end of file
@@ -0,0 +1,219 @@
+from collections import OrderedDict
+import redis.asyncio as aioredis
+import threading
+import hashlib
+import json
+import time
+import numpy as np
+import redis
+
+
+def text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+class EmbeddingStore:
+    """
+    Content-addressed store of chunk embeddings in Redis.
+
+    Vectors are keyed by model name and the sha256 of the chunk text, so a chunk
+    that was already embedded for any document skips model inference.
+
+    Every chunk costs about 1.6 KB with 384 dimensions, so keep it out of the
+    Celery broker: point EMBEDDING_CACHE_REDIS_URL at an instance with a
+    maxmemory limit and an LRU eviction policy.
+    """
+    client: redis.Redis
+
+    def __init__(self, redis_url: str, model_name: str, ttl_seconds: int):
+        self.client = redis.Redis.from_url(redis_url)
+        self.model_name = model_name
+        self.ttl_seconds = ttl_seconds
+
+    def key(self, text: str) -> str:
+        return f"askpdf:embedding:{self.model_name}:{text_hash(text)}"
+
+    def get_many(self, texts: list[str]) -> list[np.ndarray | None]:
+        try:
+            values = self.client.mget([self.key(text) for text in texts])
+        except Exception as e:
+            print("EmbeddingStore.get_many: Error: ", str(e))
+            return [None] * len(texts)
+
+        return [np.frombuffer(value, dtype=np.float32) if value is not None else None for value in values]
+
+    def set_many(self, texts: list[str], vectors: np.ndarray):
+        try:
+            pipeline = self.client.pipeline(transaction=False)
+            for text, vector in zip(texts, vectors):
+                pipeline.set(self.key(text), np.asarray(vector, dtype=np.float32).tobytes(), ex=self.ttl_seconds)
+            pipeline.execute()
+        except Exception as e:
+            print("EmbeddingStore.set_many: Error: ", str(e))
+
+class QueryEmbeddingCache:
+    """
+    LRU cache of query embeddings with size and TTL eviction.
+
+    Entries are keyed by model name and the normalized query text. When a redis url
+    is given, Redis acts as a second level shared by every API replica.
+    """
+    client: redis.Redis | None
+
+    def __init__(self, model_name: str, max_size: int, ttl_seconds: int, redis_url: str | None = None):
+        self.model_name = model_name
+        self.max_size = max_size
+        self.ttl_seconds = ttl_seconds
+        self.client = redis.Redis.from_url(redis_url) if redis_url else None
+
+        self.entries: OrderedDict[str, tuple[float, np.ndarray]] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        return " ".join(query.casefold().split())
+
+    def key(self, query: str) -> str:
+        return f"askpdf:query_embedding:{self.model_name}:{text_hash(self.normalize(query))}"
+
+    def _put_local(self, key: str, vector: np.ndarray):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.ttl_seconds, vector)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def get(self, query: str) -> np.ndarray | None:
+        key = self.key(query)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                expires_at, vector = entry
+                if expires_at > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return vector
+                del self.entries[key]
+
+        if self.client is not None:
+            try:
+                value = self.client.get(key)
+            except Exception as e:
+                print("QueryEmbeddingCache.get: Error: ", str(e))
+                value = None
+
+            if value is not None:
+                vector = np.frombuffer(value, dtype=np.float32)
+                self._put_local(key, vector)
+                with self.lock:
+                    self.hits += 1
+                return vector
+
+        with self.lock:
+            self.misses += 1
+        return None
+
+    def set(self, query: str, vector: np.ndarray):
+        key = self.key(query)
+        vector = np.asarray(vector, dtype=np.float32)
+        self._put_local(key, vector)
+
+        if self.client is not None:
+            try:
+                self.client.set(key, vector.tobytes(), ex=self.ttl_seconds)
+            except Exception as e:
+                print("QueryEmbeddingCache.set: Error: ", str(e))
+
+    def stats(self) -> dict:
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "backend": "redis" if self.client is not None else "memory",
+                "size": len(self.entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0
+            }
+
+class AnswerCache:
+    """
+    Semantic cache of chat answers per pdf content.
+
+    An answer is reused for a new query on a pdf with the same content hash when
+    every other message the LLM would get is the same (system prompt, retrieved
+    chunks, summary and history turns) and the query embedding is within
+    `threshold` cosine similarity of the cached one, which skips the LLM call.
+    Identical pdfs, deduplicated on upload, share their answers. Entries of a
+    pdf live in one Redis hash, so deleting its last copy drops them all at once.
+    """
+    client: aioredis.Redis
+    sync_client: redis.Redis
+
+    def __init__(self, redis_url: str, threshold: float, max_entries: int, ttl_seconds: int):
+        self.client = aioredis.Redis.from_url(redis_url)
+        self.sync_client = redis.Redis.from_url(redis_url)
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+
+    def key(self, content_hash: str) -> str:
+        return f"askpdf:answer_cache:{content_hash}"
+
+    @staticmethod
+    def prompt_hash(messages: list[dict]) -> str:
+        """Digest of the LLM messages except the final query, so a follow-up in a conversation only matches the same conversation"""
+        return text_hash(json.dumps(messages[:-1]))
+
+    async def get(self, content_hash: str, prompt_hash: str, query_vector: np.ndarray) -> str | None:
+        """The answer of the most similar cached query with the same prompt, if it passes the threshold"""
+        try:
+            # Only entries with the same prompt are candidates
+            entries = [
+                json.loads(value)
+                async for _, value in self.client.hscan_iter(self.key(content_hash), match=f"{prompt_hash}:*", count=self.max_entries)
+            ]
+        except Exception as e:
+            print("AnswerCache.get: Error: ", str(e))
+            return None
+
+        if not entries:
+            return None
+
+        vectors = np.vstack([np.frombuffer(bytes.fromhex(entry["vector"]), dtype=np.float32) for entry in entries])
+        query_vector = np.asarray(query_vector, dtype=np.float32)
+        similarities = vectors @ query_vector / (np.linalg.norm(vectors, axis=1) * np.linalg.norm(query_vector) + 1e-12)
+
+        best = int(np.argmax(similarities))
+        return entries[best]["answer"] if similarities[best] >= self.threshold else None
+
+    async def set(self, content_hash: str, prompt_hash: str, query: str, query_vector: np.ndarray, answer: str):
+        key = self.key(content_hash)
+        value = json.dumps({
+            "query": query,
+            "vector": np.asarray(query_vector, dtype=np.float32).tobytes().hex(),
+            "answer": answer
+        })
+
+        try:
+            # Keep the hash bounded by evicting random entries
+            size = await self.client.hlen(key)
+            if size >= self.max_entries:
+                evicted = await self.client.hrandfield(key, size - self.max_entries + 1)
+                if evicted:
+                    await self.client.hdel(key, *evicted)
+
+            pipeline = self.client.pipeline(transaction=False)
+            pipeline.hset(key, f"{prompt_hash}:{text_hash(query)}", value)
+            pipeline.expire(key, self.ttl_seconds)
+            await pipeline.execute()
+        except Exception as e:
+            print("AnswerCache.set: Error: ", str(e))
+
+    def invalidate(self, content_hash: str):
+        """Drop every cached answer of a pdf, from the worker"""
+        try:
+            self.sync_client.delete(self.key(content_hash))
+        except Exception as e:
+            print("AnswerCache.invalidate: Error: ", str(e))
@@ -0,0 +1,239 @@
+from functools import lru_cache
+from typing import Iterable, Iterator, Protocol
+import re
+
+from langchain_text_splitters import CharacterTextSplitter
+from langchain_core.documents.base import Document
+
+from src.config import Config
+
+# Chunkers are pickled into the parsing pool processes (see parsing.py), so they
+# only hold their settings and load the tokenizer lazily in each process
+
+HEADING_PATTERN = re.compile(r"^(#{1,6}\s|(\d+\.)+\d*\s+\S|[IVXLC]+\.\s+\S|(Section|Article|Chapter|Clause)\s+\d)", re.IGNORECASE)
+SENTENCE_END = ".!?"
+
+
+class Chunker(Protocol):
+    def split(self, page: Document) -> list[Document]:
+        """
+        Split one page into chunks, keeping the page metadata.
+
+        Every chunk gets `char_start` and `char_end`, the offsets of its text in
+        the page text, so `page_content[char_start:char_end]` is the chunk.
+        """
+        ...
+
+class CharacterChunker:
+    """The original splitter: chunks of `chunk_size` characters split on blank lines"""
+
+    def __init__(self, chunk_size: int = 300, chunk_overlap: int = 50):
+        self.chunk_size = chunk_size
+        self.chunk_overlap = chunk_overlap
+
+    def split(self, page: Document) -> list[Document]:
+        text_splitter = CharacterTextSplitter(chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap, add_start_index=True)
+
+        chunks = text_splitter.split_documents([page])
+        for chunk in chunks:
+            start = chunk.metadata.pop("start_index")
+            chunk.metadata["char_start"] = start
+            chunk.metadata["char_end"] = start + len(chunk.page_content)
+
+        return chunks
+
+@lru_cache(maxsize=None)
+def load_tokenizer(model_name: str):
+    from tokenizers import Tokenizer
+
+    # Same hub name resolution as FastEmbedEmbedder
+    if "/" not in model_name:
+        model_name = f"sentence-transformers/{model_name}"
+
+    tokenizer = Tokenizer.from_pretrained(model_name)
+    tokenizer.no_truncation()
+    tokenizer.no_padding()
+    return tokenizer
+
+class TokenChunker:
+    """
+    Chunks of up to `max_tokens` tokens of the embedding model, built from whole paragraphs.
+
+    Headings start a new chunk and are recorded as the `section` of the chunks
+    that follow them. Paragraphs longer than `max_tokens` are split in token
+    windows that end on a sentence boundary when possible, overlapping by
+    `overlap_tokens`.
+    """
+
+    def __init__(self, tokenizer_name: str, max_tokens: int = 250, overlap_tokens: int = 32):
+        self.tokenizer_name = tokenizer_name
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+
+    @property
+    def tokenizer(self):
+        return load_tokenizer(self.tokenizer_name)
+
+    def blocks(self, text: str) -> list[tuple[int, int, bool]]:
+        """Split page text into (start, end, is_heading) paragraphs and headings"""
+        lines = []
+        offset = 0
+        for line in text.split("\n"):
+            lines.append((offset, offset + len(line), line.strip()))
+            offset += len(line) + 1
+
+        longest = max((len(stripped) for _, _, stripped in lines), default=0)
+
+        blocks = []
+        start = None
+        previous = ""
+        for line_start, line_end, stripped in lines:
+            if not stripped:
+                if start is not None:
+                    blocks.append((start, end, False))
+                    start = None
+                continue
+
+            is_heading = len(stripped) <= 80 and stripped[-1] not in SENTENCE_END + ",;" and (
+                HEADING_PATTERN.match(stripped) is not None or (stripped.isupper() and any(c.isalpha() for c in stripped))
+            )
+            # pypdf rarely keeps blank lines, so a short line ending a sentence also ends a paragraph
+            paragraph_ended = previous[-1:] in SENTENCE_END and len(previous) < 0.8 * longest
+
+            if start is not None and (is_heading or paragraph_ended):
+                blocks.append((start, end, False))
+                start = None
+
+            if is_heading:
+                blocks.append((line_start, line_end, True))
+            else:
+                if start is None:
+                    start = line_start
+                end = line_end
+            previous = stripped
+
+        if start is not None:
+            blocks.append((start, end, False))
+
+        return blocks
+
+    def windows(self, text: str, start: int, end: int) -> list[tuple[int, int]]:
+        """Token windows over text[start:end], as character spans"""
+        encoding = self.tokenizer.encode(text[start:end], add_special_tokens=False)
+        offsets = [(start + token_start, start + token_end) for token_start, token_end in encoding.offsets]
+
+        spans = []
+        i = 0
+        while i < len(offsets):
+            j = min(i + self.max_tokens, len(offsets))
+            if j < len(offsets):
+                # End on a sentence boundary in the second half of the window when there is one
+                for k in range(j - 1, i + (j - i) // 2, -1):
+                    if text[offsets[k][1] - 1] in SENTENCE_END:
+                        j = k + 1
+                        break
+
+            spans.append((offsets[i][0], offsets[j - 1][1]))
+            if j == len(offsets):
+                break
+            i = max(j - self.overlap_tokens, i + 1)
+
+        return spans
+
+    def split(self, page: Document) -> list[Document]:
+        text = page.page_content
+        blocks = self.blocks(text)
+        token_counts = [len(encoding.ids) for encoding in self.tokenizer.encode_batch(
+            [text[start:end] for start, end, _ in blocks], add_special_tokens=False
+        )]
+
+        spans: list[tuple[int, int, str | None]] = []
+        # (start, end, token count, is_heading) of the blocks of the chunk being built
+        current: list[tuple[int, int, int, bool]] = []
+        section = None
+
+        def flush(keep_overlap: bool):
+            nonlocal current
+            if not current:
+                return
+            spans.append((current[0][0], current[-1][1], section))
+
+            # Carry trailing short paragraphs (list items, table rows) into the next chunk
+            kept, tokens = [], 0
+            if keep_overlap:
+                for block in reversed(current[1:]):
+                    tokens += block[2]
+                    if tokens > self.overlap_tokens:
+                        break
+                    kept.insert(0, block)
+            current = kept
+
+        for (start, end, is_heading), count in zip(blocks, token_counts):
+            headings_only = bool(current) and all(block[3] for block in current)
+
+            if is_heading:
+                # Consecutive headings (chapter, then section) stay together
+                if not headings_only:
+                    flush(keep_overlap=False)
+                section = text[start:end].strip()
+                current.append((start, end, count, True))
+                continue
+
+            if count > self.max_tokens:
+                # Headings right before a long paragraph go into its first window rather than a chunk of their own
+                heading_start = current[0][0] if headings_only else None
+                if heading_start is None:
+                    flush(keep_overlap=False)
+                current = []
+
+                for window_start, window_end in self.windows(text, start, end):
+                    spans.append((heading_start if heading_start is not None else window_start, window_end, section))
+                    heading_start = None
+                continue
+
+            # Headings are never left alone in a chunk, even if that overshoots max_tokens by a few tokens
+            if current and not headings_only and sum(block[2] for block in current) + count > self.max_tokens:
+                flush(keep_overlap=True)
+                if sum(block[2] for block in current) + count > self.max_tokens:
+                    current = []
+            current.append((start, end, count, False))
+
+        flush(keep_overlap=False)
+
+        chunks = []
+        for start, end, chunk_section in spans:
+            metadata = {**page.metadata, "char_start": start, "char_end": end}
+            if chunk_section is not None:
+                metadata["section"] = chunk_section
+            chunks.append(Document(page_content=text[start:end], metadata=metadata))
+
+        return chunks
+
+def carry_sections(chunks: Iterable[Document]) -> Iterator[Document]:
+    """
+    Give the chunks above the first heading of a page the section of the pages
+    before it. Chunkers split one page at a time, so this runs over the chunks
+    of the whole pdf, in page order.
+    """
+    section = None
+    for chunk in chunks:
+        if "section" in chunk.metadata:
+            section = chunk.metadata["section"]
+        elif section is not None:
+            chunk.metadata["section"] = section
+        yield chunk
+
+def get_chunker(name: str = Config.CHUNKER) -> Chunker:
+    """
+    Build a chunker from a spec: "token[:<max_tokens>[:<overlap_tokens>]]" or
+    "character[:<chunk_size>[:<chunk_overlap>]]"
+    """
+    kind, *params = name.split(":")
+    if kind == "character":
+        return CharacterChunker(*map(int, params))
+    if kind == "token":
+        max_tokens = int(params[0]) if params else Config.CHUNK_MAX_TOKENS
+        overlap_tokens = int(params[1]) if len(params) > 1 else Config.CHUNK_OVERLAP_TOKENS
+        return TokenChunker(Config.TRANSFORMER_MODEL, max_tokens=max_tokens, overlap_tokens=overlap_tokens)
+
+    raise ValueError(f"Unknown chunker: {name}")
@@ -0,0 +1,153 @@
+from datetime import datetime
+import redis.asyncio as aioredis
+import json
+
+from src.config import Config
+from src.docs_ingestion.cache import AnswerCache
+
+
+def estimate_tokens(text: str) -> int:
+    # Roughly 4 characters per token for English text with llama-style tokenizers
+    return len(text) // 4 + 1
+
+class ChatContextBuilder:
+    """Fit the chat history and retrieved chunks into a fixed prompt token budget"""
+
+    def __init__(self, token_budget: int):
+        self.token_budget = token_budget
+
+    def build(
+        self,
+        system_prompt: str,
+        history: list[dict],
+        context_documents: list[str],
+        query: str,
+        summary: str | None = None
+    ) -> tuple[list[dict], list[dict]]:
+        """
+        Build the LLM messages and return them with the history turns that did not fit.
+
+        The system prompt and query are always sent. Retrieved chunks come next in rank
+        order, then the running summary, then history turns from newest to oldest.
+        """
+        budget = self.token_budget - estimate_tokens(system_prompt) - estimate_tokens(query)
+
+        chunks = []
+        for doc in context_documents:
+            cost = estimate_tokens(doc)
+            if cost > budget:
+                break
+            chunks.append(doc)
+            budget -= cost
+
+        summary_messages = []
+        if summary and estimate_tokens(summary) <= budget:
+            summary_messages.append({"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"})
+            budget -= estimate_tokens(summary)
+
+        kept = 0
+        for turn in reversed(history):
+            cost = estimate_tokens(turn["content"])
+            if cost > budget:
+                break
+            kept += 1
+            budget -= cost
+
+        recent, dropped = history[len(history) - kept:], history[:len(history) - kept]
+
+        messages = [{"role": "system", "content": system_prompt}]
+        messages.extend(summary_messages)
+        messages.extend([{"role": turn["role"], "content": turn["content"]} for turn in recent])
+        messages.extend([{"role": "user", "content": doc} for doc in chunks])
+        messages.append({"role": "user", "content": query})
+
+        return messages, dropped
+
+class ChatSummaryStore:
+    """Running summary of the turns that fell out of the history window, cached in Redis per user and document"""
+    client: aioredis.Redis
+
+    def __init__(self, redis_url: str, ttl_seconds: int, batch_tokens: int):
+        self.client = aioredis.Redis.from_url(redis_url)
+        self.ttl_seconds = ttl_seconds
+        self.batch_tokens = batch_tokens
+
+    def key(self, user_id: str, doc_id: str) -> str:
+        return f"askpdf:chat_summary:{user_id}:{doc_id}"
+
+    async def get(self, user_id: str, doc_id: str) -> tuple[str | None, datetime | None]:
+        """Return the summary and the created_at of the last turn folded into it"""
+        try:
+            value = await self.client.get(self.key(user_id, doc_id))
+        except Exception as e:
+            print("ChatSummaryStore.get: Error: ", str(e))
+            return None, None
+
+        if value is None:
+            return None, None
+
+        data = json.loads(value)
+        return data["summary"], datetime.fromisoformat(data["until"])
+
+    def batches(self, turns: list[dict]) -> list[list[dict]]:
+        """Split turns into runs of at most `batch_tokens`, so a long backlog is folded in several LLM calls"""
+        batches, batch, tokens = [], [], 0
+        for turn in turns:
+            cost = estimate_tokens(turn["content"])
+            if batch and tokens + cost > self.batch_tokens:
+                batches.append(batch)
+                batch, tokens = [], 0
+            batch.append(turn)
+            tokens += cost
+
+        if batch:
+            batches.append(batch)
+        return batches
+
+    async def fold(self, user_id: str, doc_id: str, turns: list[dict], ai_service):
+        """
+        Fold history turns into the running summary.
+
+        `turns` are every turn not sent to the LLM, oldest first: those older than the
+        history window and those the token budget dropped. Turns already folded are skipped.
+        """
+        try:
+            summary, until = await self.get(user_id, doc_id)
+            turns = [turn for turn in turns if until is None or turn["created_at"] > until]
+
+            for batch in self.batches(turns):
+                transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in batch)
+                summary = await ai_service.aget_ai_response([
+                    {
+                        "role": "system",
+                        "content": "Update the running summary of a conversation about a document with the new turns. Keep names, numbers and conclusions. Reply with the summary only."
+                    },
+                    {
+                        "role": "user",
+                        "content": f"Current summary:\n{summary or '(empty)'}\n\nNew turns:\n{transcript}"
+                    }
+                ])
+
+                # Saved after every batch, so a failure halfway doesn't fold the same turns twice
+                value = json.dumps({"summary": summary, "until": batch[-1]["created_at"].isoformat()})
+                await self.client.set(self.key(user_id, doc_id), value, ex=self.ttl_seconds)
+        except Exception as e:
+            print("ChatSummaryStore.fold: Error: ", str(e))
+
+chat_context_builder = ChatContextBuilder(
+    token_budget=Config.CHAT_CONTEXT_TOKEN_BUDGET
+)
+
+chat_summary_store = ChatSummaryStore(
+    redis_url=Config.REDIS_URL,
+    ttl_seconds=Config.CHAT_SUMMARY_TTL_SECONDS,
+    batch_tokens=Config.CHAT_CONTEXT_TOKEN_BUDGET
+)
+
+
+answer_cache = AnswerCache(
+    redis_url=Config.REDIS_URL,
+    threshold=Config.ANSWER_CACHE_THRESHOLD,
+    max_entries=Config.ANSWER_CACHE_MAX_ENTRIES,
+    ttl_seconds=Config.ANSWER_CACHE_TTL_SECONDS
+)
\ No newline at end of file
@@ -0,0 +1,165 @@
+from typing import Protocol
+from qdrant_client import models
+import threading
+import numpy as np
+
+from src.config import Config
+
+# Model libraries are imported inside the embedders: importing torch alone costs
+# seconds, and processes that never embed (or use fastembed) shouldn't pay for it
+
+
+class Embedder(Protocol):
+    name: str
+    dimension: int
+
+    def encode(self, texts: list[str], batch_size: int) -> np.ndarray:
+        """Encode texts into a float32 matrix of shape (len(texts), dim)"""
+        ...
+
+class SentenceTransformerEmbedder:
+    def __init__(self, model_name: str):
+        from sentence_transformers import SentenceTransformer
+
+        self.name = f"sentence-transformers:{model_name}"
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.dimension = self.model.get_sentence_embedding_dimension()
+
+    def encode(self, texts: list[str], batch_size: int) -> np.ndarray:
+        embeddings = self.model.encode(
+            texts,
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+        return np.asarray(embeddings, dtype=np.float32)
+
+class FastEmbedEmbedder:
+    """ONNX Runtime inference through fastembed, lighter and faster than torch on CPU-only workers"""
+
+    def __init__(self, model_name: str):
+        from fastembed import TextEmbedding
+
+        # fastembed expects the full hub name, e.g. sentence-transformers/all-MiniLM-L6-v2
+        if "/" not in model_name:
+            model_name = f"sentence-transformers/{model_name}"
+
+        self.name = f"fastembed:{model_name}"
+        self.model = TextEmbedding(model_name=model_name)
+        self.dimension = self.model.embedding_size
+
+    def encode(self, texts: list[str], batch_size: int) -> np.ndarray:
+        embeddings = list(self.model.embed(texts, batch_size=batch_size))
+        return np.asarray(embeddings, dtype=np.float32).reshape(len(texts), -1)
+
+class SparseEmbedder:
+    """
+    BM25 term weights through fastembed, for exact matches on part numbers, clause ids and names.
+
+    Only term frequencies are stored with the chunks. Qdrant applies the IDF at
+    query time, so the weights stay correct as the corpus grows.
+    """
+
+    def __init__(self, model_name: str):
+        from fastembed import SparseTextEmbedding
+
+        self.name = f"fastembed:{model_name}"
+        self.model = SparseTextEmbedding(model_name=model_name)
+
+    def encode(self, texts: list[str], batch_size: int) -> list[models.SparseVector]:
+        return [
+            models.SparseVector(indices=embedding.indices.tolist(), values=embedding.values.tolist())
+            for embedding in self.model.embed(texts, batch_size=batch_size)
+        ]
+
+    def encode_query(self, query: str) -> models.SparseVector:
+        embedding = next(iter(self.model.query_embed(query)))
+        return models.SparseVector(indices=embedding.indices.tolist(), values=embedding.values.tolist())
+
+class Reranker(Protocol):
+    name: str
+
+    def score(self, query: str, texts: list[str], batch_size: int) -> np.ndarray:
+        """Relevance of each text to the query, higher is more relevant"""
+        ...
+
+class CrossEncoderReranker:
+    def __init__(self, model_name: str):
+        from sentence_transformers import CrossEncoder
+
+        self.name = f"sentence-transformers:{model_name}"
+        self.model = CrossEncoder(model_name, device="cpu")
+
+    def score(self, query: str, texts: list[str], batch_size: int) -> np.ndarray:
+        scores = self.model.predict(
+            [(query, text) for text in texts],
+            batch_size=batch_size,
+            convert_to_numpy=True,
+            show_progress_bar=False
+        )
+        return np.asarray(scores, dtype=np.float32)
+
+class FastEmbedReranker:
+    def __init__(self, model_name: str):
+        from fastembed.rerank.cross_encoder import TextCrossEncoder
+
+        # fastembed ships the ONNX exports of the cross-encoder/ models under Xenova/
+        if model_name.startswith("cross-encoder/"):
+            model_name = f"Xenova/{model_name.split('/', 1)[1]}"
+
+        self.name = f"fastembed:{model_name}"
+        self.model = TextCrossEncoder(model_name=model_name)
+
+    def score(self, query: str, texts: list[str], batch_size: int) -> np.ndarray:
+        return np.asarray(list(self.model.rerank(query, texts, batch_size=batch_size)), dtype=np.float32)
+
+EMBEDDERS = {
+    "sentence-transformers": SentenceTransformerEmbedder,
+    "fastembed": FastEmbedEmbedder,
+}
+
+RERANKERS = {
+    "sentence-transformers": CrossEncoderReranker,
+    "fastembed": FastEmbedReranker,
+}
+
+_embedders: dict[tuple[str, str], Embedder] = {}
+_embedders_lock = threading.Lock()
+
+def get_embedder(backend: str = Config.EMBEDDING_BACKEND, model_name: str = Config.TRANSFORMER_MODEL) -> Embedder:
+    """
+    Load an embedding model once per process, on first use.
+
+    Calling this in a Celery parent process before the pool forks lets every
+    prefork child share the model weights copy-on-write.
+    """
+    key = (backend, model_name)
+    if key not in _embedders:
+        with _embedders_lock:
+            if key not in _embedders:
+                _embedders[key] = EMBEDDERS[backend](model_name)
+
+    return _embedders[key]
+
+_sparse_embedders: dict[str, SparseEmbedder] = {}
+
+def get_sparse_embedder(model_name: str = Config.SPARSE_MODEL) -> SparseEmbedder:
+    """Load a sparse embedding model once per process, on first use"""
+    if model_name not in _sparse_embedders:
+        with _embedders_lock:
+            if model_name not in _sparse_embedders:
+                _sparse_embedders[model_name] = SparseEmbedder(model_name)
+
+    return _sparse_embedders[model_name]
+
+_rerankers: dict[tuple[str, str], Reranker] = {}
+
+def get_reranker(backend: str = Config.EMBEDDING_BACKEND, model_name: str = Config.RERANK_MODEL) -> Reranker:
+    """Load a cross-encoder once per process, on first use, with the same backend as the embeddings"""
+    key = (backend, model_name)
+    if key not in _rerankers:
+        with _embedders_lock:
+            if key not in _rerankers:
+                _rerankers[key] = RERANKERS[backend](model_name)
+
+    return _rerankers[key]
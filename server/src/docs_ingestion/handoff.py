@@ -0,0 +1,138 @@
+from starlette.concurrency import run_in_threadpool
+from contextlib import contextmanager
+from fastapi import UploadFile
+from typing import BinaryIO, ContextManager, Iterator, Protocol
+import redis.asyncio as aioredis
+import tempfile
+import shutil
+import time
+import os
+import redis
+
+from src.config import Config
+
+
+class Handoff(Protocol):
+    """
+    Pass the bytes of an upload from the API to the ingestion worker, so the
+    worker doesn't download the pdf again from its public url.
+
+    Handoffs are best effort: when `fetch` yields None the worker falls back to
+    the url.
+    """
+
+    async def put(self, key: str, file: UploadFile):
+        ...
+
+    def fetch(self, key: str) -> ContextManager[str | None]:
+        """Yield a local path to the handed off pdf, or None if it is gone"""
+        ...
+
+    def discard(self, key: str):
+        ...
+
+class SpoolHandoff:
+    """A directory shared by the API and the workers, e.g. a volume mounted in both containers"""
+
+    def __init__(self, spool_dir: str, ttl_seconds: int):
+        self.spool_dir = spool_dir
+        self.ttl_seconds = ttl_seconds
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.spool_dir, os.path.basename(key))
+
+    def write(self, key: str, file: BinaryIO):
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.sweep()
+
+        # Written under a temporary name and renamed, so the worker never sees a partial file
+        fd, partial = tempfile.mkstemp(dir=self.spool_dir, suffix=".part")
+        try:
+            with os.fdopen(fd, "wb") as out:
+                file.seek(0)
+                shutil.copyfileobj(file, out, length=Config.UPLOAD_CHUNK_BYTES)
+            os.replace(partial, self.path(key))
+        except BaseException:
+            os.remove(partial)
+            raise
+
+    async def put(self, key: str, file: UploadFile):
+        await run_in_threadpool(self.write, key, file.file)
+
+    @contextmanager
+    def fetch(self, key: str) -> Iterator[str | None]:
+        path = self.path(key)
+        yield path if os.path.isfile(path) else None
+
+    def discard(self, key: str):
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+    def sweep(self):
+        """Drop the files of ingestions that never ran or failed for good"""
+        cutoff = time.time() - self.ttl_seconds
+        for entry in os.scandir(self.spool_dir):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+class RedisHandoff:
+    """A short-lived Redis key, for workers that share no filesystem with the API"""
+    client: aioredis.Redis
+    sync_client: redis.Redis
+
+    def __init__(self, redis_url: str, ttl_seconds: int):
+        self.client = aioredis.Redis.from_url(redis_url)
+        self.sync_client = redis.Redis.from_url(redis_url)
+        self.ttl_seconds = ttl_seconds
+
+    def key(self, key: str) -> str:
+        return f"askpdf:handoff:{key}"
+
+    async def put(self, key: str, file: UploadFile):
+        # Appended chunk by chunk, then renamed so the worker never reads a partial value
+        partial = f"{self.key(key)}:part"
+        await file.seek(0)
+        await self.client.delete(partial)
+        while chunk := await file.read(Config.UPLOAD_CHUNK_BYTES):
+            async with self.client.pipeline(transaction=False) as pipe:
+                pipe.append(partial, chunk)
+                pipe.expire(partial, self.ttl_seconds)
+                await pipe.execute()
+        await self.client.rename(partial, self.key(key))
+
+    @contextmanager
+    def fetch(self, key: str) -> Iterator[str | None]:
+        data = self.sync_client.get(self.key(key))
+        if data is None:
+            yield None
+            return
+
+        with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+            tmp.write(data)
+            tmp.flush()
+            del data
+            yield tmp.name
+
+    def discard(self, key: str):
+        self.sync_client.delete(self.key(key))
+
+def get_handoff(mode: str = Config.INGEST_HANDOFF) -> Handoff | None:
+    if mode == "none":
+        return None
+    if mode == "redis":
+        # Pdfs of up to MAX_UPLOAD_BYTES would crowd the broker's memory, so they never go through REDIS_URL
+        if Config.HANDOFF_REDIS_URL:
+            return RedisHandoff(redis_url=Config.HANDOFF_REDIS_URL, ttl_seconds=Config.INGEST_HANDOFF_TTL_SECONDS)
+        print("get_handoff: HANDOFF_REDIS_URL is not set, handing off through INGEST_SPOOL_DIR")
+        mode = "spool"
+    if mode == "spool":
+        return SpoolHandoff(spool_dir=Config.INGEST_SPOOL_DIR, ttl_seconds=Config.INGEST_HANDOFF_TTL_SECONDS)
+
+    raise ValueError(f"Unknown ingest handoff: {mode}")
+
+ingest_handoff = get_handoff()
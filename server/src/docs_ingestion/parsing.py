@@ -0,0 +1,126 @@
+from contextlib import contextmanager
+from collections import deque
+from typing import Iterator
+import tempfile
+import mmap
+import os
+
+from langchain_core.documents.base import Document
+from billiard.pool import ApplyResult
+from pypdf import PdfReader
+import requests
+import billiard
+
+from src.docs_ingestion.chunking import Chunker
+from src.metrics import track
+
+# Functions in this module run inside pool processes, so keep it free of
+# imports that build clients or load models (e.g. src.docs_ingestion.service)
+
+
+@contextmanager
+def local_pdf(pdf_path: str) -> Iterator[str]:
+    """Yield a local file path for the pdf, downloading it to a temp file if it is a url"""
+    if os.path.isfile(pdf_path):
+        yield pdf_path
+        return
+
+    with tempfile.NamedTemporaryFile(suffix=".pdf") as tmp:
+        with requests.get(pdf_path, stream=True, timeout=60) as response:
+            response.raise_for_status()
+            for block in response.iter_content(chunk_size=1024 * 1024):
+                tmp.write(block)
+        tmp.flush()
+        yield tmp.name
+
+@contextmanager
+def open_pdf(local_path: str) -> Iterator[PdfReader]:
+    """
+    Read the pdf through a memory map, so its bytes stay in the page cache
+    instead of being copied into the heap of every process that parses it
+    """
+    with open(local_path, "rb") as file, mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+        yield PdfReader(mapped)
+
+def count_pages(local_path: str) -> int:
+    with open_pdf(local_path) as reader:
+        return len(reader.pages)
+
+def iter_page_chunks(
+    local_path: str,
+    source: str,
+    chunker: Chunker,
+    start: int = 0,
+    end: int | None = None,
+    total_pages: int | None = None,
+    timings: dict[str, float] | None = None
+) -> Iterator[Document]:
+    """Extract and split pages [start, end) of the pdf one at a time, keeping the same metadata as PyPDFLoader"""
+    with open_pdf(local_path) as reader:
+        total_pages = total_pages or len(reader.pages)
+        for page_number in range(start, total_pages if end is None else end):
+            with track("parse", timings):
+                text = reader.pages[page_number].extract_text()
+
+            page = Document(
+                page_content=text,
+                metadata={
+                    "source": source,
+                    "page": page_number,
+                    "total_pages": total_pages
+                }
+            )
+            with track("chunk", timings):
+                page_chunks = chunker.split(page)
+            yield from page_chunks
+
+def parse_page_range(
+    local_path: str,
+    source: str,
+    start: int,
+    end: int,
+    total_pages: int,
+    chunker: Chunker
+) -> list[Document]:
+    """Extract and split pages [start, end) of the pdf in a pool process"""
+    return list(iter_page_chunks(local_path, source, chunker, start=start, end=end, total_pages=total_pages))
+
+def iter_chunks_parallel(
+    local_path: str,
+    source: str,
+    chunker: Chunker,
+    workers: int,
+    pages_per_task: int
+) -> Iterator[Document]:
+    """
+    Parse and split page ranges across a process pool and yield the chunks in page order.
+
+    The pool is billiard's, Celery's fork of multiprocessing, which unlike
+    ProcessPoolExecutor may be started from the daemonic children of the
+    default prefork worker pool. Only `2 * workers` page ranges are in flight
+    at once, so memory stays bounded while the consumer embeds and upserts the
+    earlier pages.
+    """
+    total_pages = count_pages(local_path)
+    ranges = [(start, min(start + pages_per_task, total_pages)) for start in range(0, total_pages, pages_per_task)]
+
+    # Not worth starting processes for a single range
+    if len(ranges) <= 1:
+        yield from iter_page_chunks(local_path, source, chunker, total_pages=total_pages)
+        return
+
+    pool = billiard.Pool(processes=min(workers, len(ranges)))
+    pending: deque[ApplyResult] = deque()
+    try:
+        for start, end in ranges:
+            pending.append(pool.apply_async(
+                parse_page_range, (local_path, source, start, end, total_pages, chunker)
+            ))
+            if len(pending) >= 2 * workers:
+                yield from pending.popleft().get()
+
+        while pending:
+            yield from pending.popleft().get()
+    finally:
+        pool.terminate()
+        pool.join()
@@ -0,0 +1,98 @@
+import redis.asyncio as aioredis
+import redis
+from typing import AsyncIterator
+import json
+
+
+class IngestCheckpoint:
+    """
+    Number of leading chunks of a document whose points are committed to Qdrant.
+
+    Written after every upsert batch, so a retried or redelivered ingestion task
+    resumes from the last committed batch instead of re-embedding the whole pdf.
+    """
+    client: redis.Redis
+
+    def __init__(self, redis_url: str, ttl_seconds: int = 7 * 24 * 60 * 60):
+        self.client = redis.Redis.from_url(redis_url)
+        self.ttl_seconds = ttl_seconds
+
+    def key(self, document_id: str) -> str:
+        return f"askpdf:ingest:checkpoint:{document_id}"
+
+    def get(self, document_id: str) -> int:
+        value = self.client.get(self.key(document_id))
+        return int(value) if value is not None else 0
+
+    def set(self, document_id: str, chunks_done: int):
+        self.client.set(self.key(document_id), chunks_done, ex=self.ttl_seconds)
+
+    def clear(self, document_id: str):
+        self.client.delete(self.key(document_id))
+
+def progress_channel(document_id: str) -> str:
+    return f"askpdf:ingest:progress:{document_id}"
+
+class ProgressPublisher:
+    """
+    Publishes ingestion progress events on a Redis pub/sub channel per document.
+
+    The latest event is also kept under the channel name so a subscriber that
+    connects mid-ingestion starts from the current state.
+    """
+    client: redis.Redis
+
+    def __init__(self, redis_url: str, ttl_seconds: int = 24 * 60 * 60):
+        self.client = redis.Redis.from_url(redis_url)
+        self.ttl_seconds = ttl_seconds
+
+    def publish(self, document_id: str, status: str, chunks_done: int = 0, pages_done: int = 0, pages_total: int | None = None):
+        percent = 100 if status == "done" else round(100 * pages_done / pages_total) if pages_total else 0
+        event = json.dumps({
+            "status": status,
+            "percent": percent,
+            "chunks_done": chunks_done,
+            "pages_done": pages_done,
+            "pages_total": pages_total
+        })
+
+        try:
+            channel = progress_channel(document_id)
+            pipeline = self.client.pipeline(transaction=False)
+            pipeline.set(channel, event, ex=self.ttl_seconds)
+            pipeline.publish(channel, event)
+            pipeline.execute()
+        except Exception as e:
+            print("ProgressPublisher.publish: Error: ", str(e))
+
+async def subscribe_progress(client: aioredis.Redis, document_id: str, timeout: float = 15.0) -> AsyncIterator[dict | None]:
+    """
+    Yield progress events for a document until it is done or failed.
+
+    Yields None every `timeout` seconds without events so callers can send keep-alives.
+    """
+    channel = progress_channel(document_id)
+    pubsub = client.pubsub()
+    await pubsub.subscribe(channel)
+    try:
+        # Subscribe first, then read the latest state, so no event falls in between
+        latest = await client.get(channel)
+        if latest is not None:
+            event = json.loads(latest)
+            yield event
+            if event["status"] in ("done", "failed"):
+                return
+
+        while True:
+            message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=timeout)
+            if message is None:
+                yield None
+                continue
+
+            event = json.loads(message["data"])
+            yield event
+            if event["status"] in ("done", "failed"):
+                return
+    finally:
+        await pubsub.unsubscribe(channel)
+        await pubsub.aclose()
@@ -1,18 +1,33 @@
-from fastapi import APIRouter, status, File, UploadFile, Depends, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, status, File, UploadFile, Depends, HTTPException, BackgroundTasks, Query
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlmodel.ext.asyncio.session import AsyncSession
 from sqlmodel import update, select
 from typing import Annotated
+from datetime import datetime
+import json
+import time
+import uuid
 from src.middlewares import token_bearer
-from src.docs_ingestion.service import supabase_service, qdrant_service, ai_service
-from src.celery import ingest_docs_into_qdrant
+from src.docs_ingestion.service import qdrant_service, ai_service
+from src.docs_ingestion.storage import storage, UploadReader
+from src.docs_ingestion.handoff import ingest_handoff
+from src.celery import ingest_docs_into_qdrant, purge_document
 from src.models import Document
-from src.db.main import get_db_session
+from src.db.main import get_db_session, async_session
 from src.docs_ingestion.schemas import UpdateInsertStatus, ChatRequestBody
+from src.docs_ingestion.context import chat_context_builder, chat_summary_store, answer_cache
+from src.docs_ingestion.cache import text_hash
+from src.config import Config
+from src.utils import decode_cursor, keyset_page, next_cursor, server_timing, generate_file_path
+from src.metrics import track
+from src.docs_ingestion.progress import subscribe_progress
+import redis.asyncio as aioredis
 from src import models
 
 documents_router = APIRouter()
 
+redis_client = aioredis.Redis.from_url(Config.REDIS_URL)
+
 @documents_router.post("/ingest", status_code=status.HTTP_201_CREATED)
 async def ingest_documents(
     file: Annotated[UploadFile, File()],
@@ -20,22 +35,57 @@ async def ingest_documents(
     session: AsyncSession = Depends(get_db_session),
 ):
     try:
-        # Upload file to storage
-        pdf_path = supabase_service.upload_file(file=file)
+        # Rejected early when Starlette already knows the size of the spooled file
+        if file.size is not None and file.size > Config.MAX_UPLOAD_BYTES:
+            raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="File is too large")
+
+        # Stream the file to storage, hashing it on the way
+        reader = UploadReader(file=file, chunk_size=Config.UPLOAD_CHUNK_BYTES, max_bytes=Config.MAX_UPLOAD_BYTES)
+        file_key = generate_file_path(file.filename)
+        with track("upload"):
+            pdf_path = await storage.upload(
+                key=file_key,
+                chunks=reader,
+                content_type=file.content_type or "application/pdf"
+            )
+        content_hash = reader.sha256
+
+        # Look for an already ingested pdf with the same bytes, whose vectors can be reused
+        statement = select(Document).where(Document.deleted_at.is_(None)).where(Document.content_hash == content_hash).where(Document.insert_status == True).limit(1)
+        result = await session.exec(statement)
+        duplicate = result.first()
+
+        # Pass the spooled bytes on to the worker, unless it shares the points of the duplicate
+        handoff_key = None
+        if ingest_handoff is not None and duplicate is None:
+            try:
+                await ingest_handoff.put(file_key, file)
+                handoff_key = file_key
+            except Exception as e:
+                # The worker downloads the pdf from storage instead
+                print("ingest_documents API: Error handing off the pdf: ", str(e))
 
         # Create an entry into database
         document = Document(
             pdf_url=pdf_path,
             pdf_name=file.filename,
             user_id=token_details["user"]["id"],
-            insert_status=False
+            insert_status=False,
+            content_hash=content_hash
         )
 
         session.add(document)
         await session.commit()
 
         # Ingest pdf into qdrant collection
-        ingest_docs_into_qdrant.delay(collection_name="pdf_docs", pdf_path=pdf_path, token=token_details["token"], user_id=token_details["user"]["id"])
+        ingest_docs_into_qdrant.delay(
+            collection_name="pdf_docs",
+            document_id=str(document.id),
+            pdf_path=pdf_path,
+            user_id=str(token_details["user"]["id"]),
+            reuse_from=duplicate.pdf_url if duplicate else None,
+            handoff_key=handoff_key
+        )
 
         return JSONResponse(
             content={
@@ -43,6 +93,8 @@ async def ingest_documents(
             },
             status_code=status.HTTP_201_CREATED
         )
+    except HTTPException:
+        raise
     except Exception as e:
         print("ingest_documents API: Error: ", str(e))
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
@@ -55,7 +107,7 @@ async def update_docs_ingestion_status(
     session: AsyncSession = Depends(get_db_session)
 ):
     try:
-        statement = select(Document).where(models.Document.pdf_url == body.pdf_path).where(Document.user_id == token_details["user"]["id"])
+        statement = select(Document).where(Document.deleted_at.is_(None)).where(models.Document.pdf_url == body.pdf_path).where(Document.user_id == token_details["user"]["id"])
         result = await session.exec(statement)
         if result.first() is None:
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Document not found")
@@ -73,96 +125,250 @@ async def update_docs_ingestion_status(
 
 @documents_router.get("/all")
 async def get_all_docs(
+    limit: int = Query(default=50, ge=1, le=200),
+    cursor: str | None = None,
     token_details = Depends(token_bearer),
     session: AsyncSession = Depends(get_db_session)
 ):
+    """Newest documents first, paginated with the `next_cursor` of the previous page"""
+    after = decode_cursor(cursor) if cursor else None
+
     try:
-        statement = select(Document).where(Document.user_id == token_details["user"]["id"])
-        result = await session.exec(statement)
+        statement = select(Document).where(Document.deleted_at.is_(None)).where(Document.user_id == token_details["user"]["id"])
+        result = await session.exec(keyset_page(statement, Document, after, limit))
+        rows = result.all()
 
-        docs = [{"id": doc.id.hex, "pdf_name": doc.pdf_name, "created_at": doc.created_at.strftime("%Y-%m-%d")} for doc in result.all()]
-        return JSONResponse(content={"documents": docs}, status_code=status.HTTP_200_OK)
+        docs = [{"id": doc.id.hex, "pdf_name": doc.pdf_name, "created_at": doc.created_at.strftime("%Y-%m-%d")} for doc in rows[:limit]]
+        return JSONResponse(content={"documents": docs, "next_cursor": next_cursor(rows, limit)}, status_code=status.HTTP_200_OK)
     except Exception as e:
         print(f"get_docs_ingestion_status: Error: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
+@documents_router.get("/cache/stats")
+async def get_cache_stats(
+    token_details = Depends(token_bearer)
+):
+    return JSONResponse(content={"query_embedding": qdrant_service.query_cache.stats()}, status_code=status.HTTP_200_OK)
+
 @documents_router.delete("/{doc_id}")
 async def delete_pdf(
-    doc_id: str,
+    doc_id: uuid.UUID,
     token_details = Depends(token_bearer),
     session: AsyncSession = Depends(get_db_session)
 ):
     try:
-        statement = select(Document).where(Document.id == doc_id).where(Document.user_id == token_details["user"]["id"])
+        statement = select(Document).where(Document.deleted_at.is_(None)).where(Document.id == doc_id).where(Document.user_id == token_details["user"]["id"])
         result = await session.exec(statement)
         
         data = result.first()
         if data is None:
-            return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found")
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found")
 
-        pdf_path = data.pdf_url.split("/")[-1]
-        supabase_service.delete_file(pdf_path)
-        await session.delete(data)
+        # Hidden from every route and from dedup right away, the worker deletes the row once the purge is done
+        data.deleted_at = datetime.now()
+        session.add(data)
         await session.commit()
 
-        return JSONResponse(content={"message": "Document deleted successfully"}, status_code=status.HTTP_200_OK)
+        # Its points, chats, stored pdf and row are deleted by the worker, reconcile_orphan_points retries purges that never finish
+        purge_document.delay(collection_name="pdf_docs", document_id=str(data.id), pdf_path=data.pdf_url)
+
+        return JSONResponse(content={"message": "Document deleted successfully"}, status_code=status.HTTP_202_ACCEPTED)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"delete_pdf: Error: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
 @documents_router.get("/{doc_id}")
 async def get_pdf_details(
-    doc_id: str,
+    doc_id: uuid.UUID,
     token_details = Depends(token_bearer),
     session: AsyncSession = Depends(get_db_session)
 ):
     try:
-        statement = select(Document).where(Document.id == doc_id).where(Document.user_id == token_details["user"]["id"])
+        statement = select(Document).where(Document.deleted_at.is_(None)).where(Document.id == doc_id).where(Document.user_id == token_details["user"]["id"])
         result = await session.exec(statement)
 
         data = result.first()
         if data is None:
-            return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found")
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found")
 
         doc = {
             "id": data.id.hex,
             "name": data.pdf_name,
             "url": data.pdf_url, 
-            "insert_status": data.insert_status
+            "insert_status": data.insert_status,
+            "chunks_done": data.chunks_done,
+            "pages_done": data.pages_done,
+            "pages_total": data.pages_total,
+            "ingest_duration_ms": data.ingest_duration_ms
         }
 
         return JSONResponse(content=doc, status_code=status.HTTP_200_OK)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"get_pdf_details: Error: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
+@documents_router.get("/{doc_id}/progress")
+async def get_ingestion_progress(
+    doc_id: uuid.UUID,
+    token_details = Depends(token_bearer),
+    session: AsyncSession = Depends(get_db_session)
+):
+    """Push ingestion progress as Server-Sent Events until the document is ingested or fails"""
+    try:
+        statement = select(Document).where(Document.deleted_at.is_(None)).where(Document.id == doc_id).where(Document.user_id == token_details["user"]["id"])
+        result = await session.exec(statement)
+        data = result.first()
+    except Exception as e:
+        print(f"get_ingestion_progress: Error: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+    if data is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found")
+
+    insert_status = data.insert_status
+
+    async def event_stream():
+        if insert_status:
+            yield f"data: {json.dumps({'status': 'done', 'percent': 100})}\n\n"
+            return
+
+        try:
+            async for event in subscribe_progress(redis_client, str(doc_id)):
+                if event is None:
+                    yield ": keep-alive\n\n"
+                else:
+                    yield f"data: {json.dumps(event)}\n\n"
+        except Exception as e:
+            print(f"get_ingestion_progress: Error: {e}")
+            yield f"event: error\ndata: {json.dumps({'detail': 'Something went wrong!'})}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
 @documents_router.get("/{doc_id}/user/pdf/chats")
 async def get_chats(
-    doc_id: str,
+    doc_id: uuid.UUID,
+    limit: int = Query(default=100, ge=1, le=500),
+    cursor: str | None = None,
     token_details = Depends(token_bearer),
     session: AsyncSession = Depends(get_db_session)
 ):
+    """Most recent chats in chronological order, older pages are fetched with the `next_cursor` of the previous one"""
+    before = decode_cursor(cursor) if cursor else None
+
     try:
-        statement = select(Document).where(Document.id == doc_id).where(Document.user_id == token_details["user"]["id"])
+        statement = select(Document).where(Document.deleted_at.is_(None)).where(Document.id == doc_id).where(Document.user_id == token_details["user"]["id"])
         result = await session.exec(statement)
         data = result.first()
         if not data:
-            return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found")
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found")
 
         statement = select(models.Chat).where(models.Chat.user_id == token_details["user"]["id"]).where(models.Chat.pdf_id == doc_id)
-        result = await session.exec(statement)
-        chats = result.all()
+        result = await session.exec(keyset_page(statement, models.Chat, before, limit))
+        rows = result.all()
 
-        conversations = [{"id": chat.id.hex, "role": chat.role, "content": chat.content, "created_at": chat.created_at.strftime("%Y-%m-%d %H:%M:%S")} for chat in chats]
-        return JSONResponse(content=conversations, status_code=status.HTTP_200_OK)
+        conversations = [{"id": chat.id.hex, "role": chat.role, "content": chat.content, "created_at": chat.created_at.strftime("%Y-%m-%d %H:%M:%S")} for chat in reversed(rows[:limit])]
+        return JSONResponse(content={"chats": conversations, "next_cursor": next_cursor(rows, limit)}, status_code=status.HTTP_200_OK)
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"get_chats: Error: {e}")
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
 
+CHAT_SYSTEM_PROMPT = """
+    You are a helpful AI assistant.
+    You are given the following extracted parts of a long document and a question.
+    Provide a conversational answer.
+    Construct a response that appropriately completes the question.
+
+    Constraints:
+    1. Avoid repeating information.
+    2. Answer the question as concisely as possible.
+    
+    Return answer as string output in markdown format.
+"""
+
+async def build_chat_messages(
+    session: AsyncSession,
+    background_tasks: BackgroundTasks,
+    doc_id: uuid.UUID,
+    user_id: uuid.UUID,
+    pdf_url: str,
+    query: str,
+    timings: dict[str, float] | None = None
+) -> list[dict]:
+    """Save the user query and build the LLM messages from the recent chat history and retrieved context"""
+    with track("history", timings):
+        # Save user query
+        chat = models.Chat(user_id=user_id, pdf_id=doc_id, role="user", content=query)
+        session.add(chat)
+        await session.commit()
+
+        # Turns up to `until` are already folded into the running summary
+        summary, until = None, None
+        if Config.CHAT_HISTORY_SUMMARY:
+            summary, until = await chat_summary_store.get(user_id, doc_id)
+
+        # Get only the most recent conversations
+        statement = select(models.Chat).where(models.Chat.user_id == user_id).where(models.Chat.pdf_id == doc_id).where(models.Chat.id != chat.id)
+        if until is not None:
+            statement = statement.where(models.Chat.created_at > until)
+        statement = statement.order_by(models.Chat.created_at.desc()).limit(Config.CHAT_HISTORY_TURNS)
+        result = await session.exec(statement)
+        conversations = reversed(result.all())
+        chat_history = [{"role": chat.role, "content": chat.content, "created_at": chat.created_at} for chat in conversations]
+
+        # Turns older than the window are never sent again, so they are folded along with the ones the token budget drops
+        overflow = []
+        if Config.CHAT_HISTORY_SUMMARY and len(chat_history) == Config.CHAT_HISTORY_TURNS:
+            statement = select(models.Chat).where(models.Chat.user_id == user_id).where(models.Chat.pdf_id == doc_id).where(models.Chat.created_at < chat_history[0]["created_at"])
+            if until is not None:
+                statement = statement.where(models.Chat.created_at > until)
+            result = await session.exec(statement.order_by(models.Chat.created_at))
+            overflow = [{"role": chat.role, "content": chat.content, "created_at": chat.created_at} for chat in result.all()]
+
+    # Retrieve data from qdrant
+    context_documents = await qdrant_service.aretrieve_documents(collection_name="pdf_docs", query=query, user_id=str(user_id), pdf_url=pdf_url, limit=Config.RETRIEVAL_LIMIT, timings=timings)
+
+    messages, dropped = chat_context_builder.build(CHAT_SYSTEM_PROMPT, chat_history, context_documents, query, summary=summary)
+    if Config.CHAT_HISTORY_SUMMARY and (overflow or dropped):
+        background_tasks.add_task(chat_summary_store.fold, user_id, doc_id, overflow + dropped, ai_service)
+
+    return messages
+
+def answer_cache_key(document: Document) -> str:
+    """Cached answers are shared by identical pdfs, documents uploaded before content hashing keep their own"""
+    return document.content_hash or text_hash(document.pdf_url)
+
+async def get_cached_answer(document: Document, query: str, messages: list[dict], timings: dict[str, float] | None = None) -> str | None:
+    """Answer of a similar earlier query on the same pdf content that was given the same prompt"""
+    if not Config.ANSWER_CACHE_ENABLED:
+        return None
+
+    with track("answer_cache", timings):
+        # Served from the query embedding cache, retrieval just encoded it
+        query_vector = await qdrant_service.aencode_query(query)
+        return await answer_cache.get(answer_cache_key(document), answer_cache.prompt_hash(messages), query_vector)
+
+async def cache_answer(document: Document, query: str, messages: list[dict], answer: str):
+    if not Config.ANSWER_CACHE_ENABLED:
+        return
+
+    query_vector = await qdrant_service.aencode_query(query)
+    await answer_cache.set(answer_cache_key(document), answer_cache.prompt_hash(messages), query, query_vector, answer)
+
 @documents_router.post("/{doc_id}/chats")
 async def chat(
-    doc_id: str,
+    doc_id: uuid.UUID,
     body: ChatRequestBody,
+    background_tasks: BackgroundTasks,
     token_details = Depends(token_bearer),
     session: AsyncSession = Depends(get_db_session)
 ):
@@ -170,56 +376,110 @@ async def chat(
         request_body = body.dict()
 
         # Check user has the pdf
-        statement = select(Document).where(Document.id == doc_id).where(Document.user_id == token_details["user"]["id"])
+        statement = select(Document).where(Document.deleted_at.is_(None)).where(Document.id == doc_id).where(Document.user_id == token_details["user"]["id"])
         result = await session.exec(statement)
         data = result.first()
         if not data:
-            return HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found")
-
-        # Save user query
-        chat = models.Chat(user_id=token_details["user"]["id"], pdf_id=doc_id, role="user", content=request_body["query"])
-        session.add(chat)
-        await session.commit()
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found")
 
-        # Get the previous conversations
-        statement = select(models.Chat).where(models.Chat.user_id == token_details["user"]["id"]).where(models.Chat.pdf_id == doc_id).order_by(models.Chat.created_at)
-        result = await session.exec(statement)
-        conversations = result.all()
-        chat_history = [{"role": chat.role, "content": chat.content} for chat in conversations]
-
-        # Retrieve data from qdrant
-        context_documents = qdrant_service.retrieve_documents(collection_name="pdf_docs", query=request_body["query"], user_id=token_details["user"]["id"], pdf_url=data.pdf_url, limit=5)
-
-        messages = [
-            {
-                "role": "system",
-                "content": """
-                    You are a helpful AI assistant.
-                    You are given the following extracted parts of a long document and a question.
-                    Provide a conversational answer.
-                    Construct a response that appropriately completes the question.
-
-                    Constraints:
-                    1. Avoid repeating information.
-                    2. Answer the question as concisely as possible.
-                    
-                    Return answer as string output in markdown format.
-                """
-            },
-        ]
-        messages.extend(chat_history)
-        messages.extend([{"role": "user", "content": doc} for doc in context_documents])
-        messages.append({"role": "user", "content": request_body["query"]})
+        timings: dict[str, float] = {}
+        messages = await build_chat_messages(session, background_tasks, doc_id, token_details["user"]["id"], data.pdf_url, request_body["query"], timings)
 
-        # Get response from AI
-        response = ai_service.get_ai_response(messages)
+        response = await get_cached_answer(data, request_body["query"], messages, timings)
+        if response is None:
+            # Get response from AI
+            with track("llm", timings):
+                response = await ai_service.aget_ai_response(messages)
+            background_tasks.add_task(cache_answer, data, request_body["query"], messages, response)
 
         # Save user query
         chat = models.Chat(user_id=token_details["user"]["id"], pdf_id=doc_id, role="assistant", content=response)
         session.add(chat)
         await session.commit()
 
-        return JSONResponse(content={"response": response}, status_code=status.HTTP_200_OK)
+        return JSONResponse(
+            content={"response": response},
+            status_code=status.HTTP_200_OK,
+            headers={"Server-Timing": server_timing(timings)}
+        )
+    except HTTPException:
+        raise
     except Exception as e:
         print(f"chat: Error: {e}")
-        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
\ No newline at end of file
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+@documents_router.post("/{doc_id}/chats/stream")
+async def chat_stream(
+    doc_id: uuid.UUID,
+    body: ChatRequestBody,
+    background_tasks: BackgroundTasks,
+    token_details = Depends(token_bearer),
+    session: AsyncSession = Depends(get_db_session)
+):
+    """Same as chat, but sends the answer tokens as Server-Sent Events as they are generated"""
+    try:
+        request_body = body.dict()
+        user_id = token_details["user"]["id"]
+
+        # Check user has the pdf
+        statement = select(Document).where(Document.deleted_at.is_(None)).where(Document.id == doc_id).where(Document.user_id == user_id)
+        result = await session.exec(statement)
+        data = result.first()
+        if not data:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Document not found")
+
+        timings: dict[str, float] = {}
+        messages = await build_chat_messages(session, background_tasks, doc_id, user_id, data.pdf_url, request_body["query"], timings)
+        cached_answer = await get_cached_answer(data, request_body["query"], messages, timings)
+    except HTTPException:
+        raise
+    except Exception as e:
+        print(f"chat_stream: Error: {e}")
+        raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+    async def answer_tokens():
+        if cached_answer is None:
+            with track("llm", timings):
+                async for token in ai_service.astream_ai_response(messages):
+                    yield token
+        else:
+            # A cached answer is sent as a single token
+            yield cached_answer
+
+    async def event_stream():
+        start = time.perf_counter()
+        time_to_first_token = None
+        tokens: list[str] = []
+        try:
+            async for token in answer_tokens():
+                if time_to_first_token is None:
+                    time_to_first_token = time.perf_counter() - start
+                tokens.append(token)
+                yield f"data: {json.dumps({'token': token})}\n\n"
+
+            if cached_answer is None:
+                await cache_answer(data, request_body["query"], messages, "".join(tokens))
+
+            # The request session is closed once the response starts, so persist with a new one
+            async with async_session() as stream_session:
+                chat = models.Chat(user_id=user_id, pdf_id=doc_id, role="assistant", content="".join(tokens))
+                stream_session.add(chat)
+                await stream_session.commit()
+
+            done = {
+                "ttft_ms": round((time_to_first_token or 0) * 1000),
+                "total_ms": round((time.perf_counter() - start) * 1000),
+                "cached": cached_answer is not None,
+                "stages_ms": {stage: round(duration) for stage, duration in timings.items()}
+            }
+            yield f"event: done\ndata: {json.dumps(done)}\n\n"
+        except Exception as e:
+            print(f"chat_stream: Error: {e}")
+            yield f"event: error\ndata: {json.dumps({'detail': 'Something went wrong!'})}\n\n"
+
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        # Retrieval stages are done before streaming starts, the llm stage and TTFT come in the done event
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", "Server-Timing": server_timing(timings)}
+    )
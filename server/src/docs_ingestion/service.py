@@ -1,139 +1,659 @@
-from supabase import Client
-from fastapi import UploadFile, HTTPException, status
-from qdrant_client import QdrantClient, models
+from fastapi import HTTPException, status
+from qdrant_client import QdrantClient, AsyncQdrantClient, models
 from qdrant_client.models import VectorParams, Distance, PointStruct
-from sentence_transformers import SentenceTransformer
-from langchain_text_splitters import CharacterTextSplitter
 from langchain_community.document_loaders import PyPDFLoader
 from langchain_core.documents.base import Document
-from groq import Groq
+from groq import Groq, AsyncGroq
+from concurrent.futures import ThreadPoolExecutor
+from functools import cached_property, partial
+from itertools import islice
+import numpy as np
+import asyncio
+import redis
+import uuid
 import time
+import os
+from typing import Iterator, AsyncIterator, Callable
 
 from src.config import Config
-from src.utils import generate_file_path
+from src.utils import batched
+from src.metrics import track, track_iter
+from src.docs_ingestion.parsing import local_pdf, iter_chunks_parallel, iter_page_chunks
+from src.docs_ingestion.chunking import Chunker, carry_sections, get_chunker
+from src.docs_ingestion.cache import EmbeddingStore, QueryEmbeddingCache
+from src.docs_ingestion.progress import IngestCheckpoint
+from src.docs_ingestion.embeddings import Embedder, SparseEmbedder, Reranker, get_embedder, get_sparse_embedder, get_reranker
 
+POINT_ID_NAMESPACE = uuid.UUID("6f3c1b52-9d1e-4c8a-b6a4-2f0e7d5c9a13")
 
-class SupabaseService:
-    client: Client
+# Named sparse vector stored next to the unnamed dense vector of every point
+SPARSE_VECTOR_NAME = "bm25"
 
-    def __init__(self, supabase_url: str, supabase_key: str):
-        self.client = Client(
-            supabase_url=supabase_url,
-            supabase_key=supabase_key
-        )
+# (chunks_done, pages_done, pages_total)
+ProgressCallback = Callable[[int, int, int | None], None]
 
-    def upload_file(self, file: UploadFile):
-        try:
-            response = self.client.storage.from_("docs").upload(
-                path=generate_file_path(file.filename),
-                file=file.file.read(),
-                file_options={
-                    "content-type": file.content_type,
-                }
-            )
+class IngestCancelled(Exception):
+    """Raised by a progress callback to stop an ingestion, e.g. of a document deleted meanwhile"""
 
-            return f"{Config.SUPABASE_URL}/storage/v1/object/public/{response.full_path}"
-        except Exception as e:
-            print("upload_file: Error: ", str(e))
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Something went wrong!")
 
-    def delete_file(self, pdf_path: str):
-        try:
-            self.client.storage.from_("docs").remove(pdf_path)
-        except Exception as e:
-            print("delete_file: Error: ", str(e))
-            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Something went wrong!")
+class LocalAsyncClient:
+    """
+    Async facade over the sync client of Qdrant's local mode, where the data
+    lives in that one client and a separate AsyncQdrantClient would not see it
+    """
+
+    def __init__(self, client: QdrantClient, executor: ThreadPoolExecutor):
+        self.client = client
+        self.executor = executor
+
+    def __getattr__(self, name: str):
+        method = getattr(self.client, name)
+
+        async def call(*args, **kwargs):
+            return await asyncio.get_running_loop().run_in_executor(self.executor, partial(method, *args, **kwargs))
+
+        return call
 
 class QdrantService:
     client: QdrantClient
-    model: SentenceTransformer
+    async_client: AsyncQdrantClient | LocalAsyncClient
+    executor: ThreadPoolExecutor
+    embedding_store: EmbeddingStore | None
+    query_cache: QueryEmbeddingCache
+    indexed_collections: set[str]
+    sparse_collections: dict[str, bool]
+    checkpoint: IngestCheckpoint
+    lock_client: redis.Redis
+
+    def __init__(self, qdrant_host: str, qdrant_port: str, transformer_model: str, location: str | None = None):
+        if location:
+            # In-process Qdrant, in memory or in a directory, for load tests and development
+            self.client = QdrantClient(location=location) if location == ":memory:" else QdrantClient(path=location)
+            self.async_client = LocalAsyncClient(self.client, ThreadPoolExecutor(max_workers=4, thread_name_prefix="qdrant-local"))
+        else:
+            self.client = QdrantClient(host=qdrant_host, port=qdrant_port)
+            self.async_client = AsyncQdrantClient(host=qdrant_host, port=qdrant_port)
+        self.transformer_model = transformer_model
+        self.executor = ThreadPoolExecutor(max_workers=Config.INFERENCE_WORKERS, thread_name_prefix="inference")
+        self.indexed_collections = set()
+        self.sparse_collections = {}
+        self.checkpoint = IngestCheckpoint(redis_url=Config.REDIS_URL)
+        self.lock_client = redis.Redis.from_url(Config.REDIS_URL)
+        self.embedding_store = None
+        if Config.EMBEDDING_CACHE_ENABLED:
+            self.embedding_store = EmbeddingStore(
+                redis_url=Config.EMBEDDING_CACHE_REDIS_URL or Config.REDIS_URL,
+                model_name=f"{Config.EMBEDDING_BACKEND}:{transformer_model}",
+                ttl_seconds=Config.EMBEDDING_CACHE_TTL_SECONDS
+            )
+        self.query_cache = QueryEmbeddingCache(
+            model_name=f"{Config.EMBEDDING_BACKEND}:{transformer_model}",
+            max_size=Config.QUERY_CACHE_SIZE,
+            ttl_seconds=Config.QUERY_CACHE_TTL_SECONDS,
+            redis_url=Config.REDIS_URL if Config.QUERY_CACHE_BACKEND == "redis" else None
+        )
 
-    def __init__(self, qdrant_host: str, qdrant_port: str, transformer_model: str):
-        self.client = QdrantClient(host=qdrant_host, port=qdrant_port)
-        self.model = SentenceTransformer(transformer_model)
+    @property
+    def model(self) -> Embedder:
+        """The embedding model, loaded once per process on first use"""
+        return get_embedder(Config.EMBEDDING_BACKEND, self.transformer_model)
 
-    def extract_text_from_pdf(self, pdf_path: str, chunk_size: int=300, chunk_overlap: int=50) -> list[Document]:
+    @property
+    def sparse_model(self) -> SparseEmbedder:
+        return get_sparse_embedder(Config.SPARSE_MODEL)
+
+    @property
+    def reranker(self) -> Reranker:
+        return get_reranker(Config.EMBEDDING_BACKEND, Config.RERANK_MODEL)
+
+    def iter_chunks_from_pdf(
+        self,
+        pdf_path: str,
+        chunker: Chunker | None = None,
+        local_path: str | None = None,
+        timings: dict[str, float] | None = None
+    ) -> Iterator[Document]:
+        """
+        Lazily yield chunks page by page so only one page of text is held at a time.
+
+        `local_path` is a local copy of the pdf at `pdf_path`, handed off by the API,
+        which is parsed instead of downloading the pdf again. Parse and chunk times
+        are added to `timings`, except in the pool processes of a parallel parse.
+        """
         try:
-            # Load the pdf
+            chunker = chunker or get_chunker()
+
+            # Parse page ranges across worker cores, merged back in page order
+            workers = Config.INGEST_PARSE_WORKERS or os.cpu_count() or 1
+            if workers > 1:
+                with local_pdf(local_path or pdf_path) as path:
+                    yield from carry_sections(iter_chunks_parallel(
+                        path,
+                        source=pdf_path,
+                        chunker=chunker,
+                        workers=workers,
+                        pages_per_task=Config.INGEST_PAGES_PER_TASK
+                    ))
+                return
+
+            if local_path is not None:
+                yield from carry_sections(iter_page_chunks(local_path, source=pdf_path, chunker=chunker, timings=timings))
+                return
+
+            # Load the pdf one page at a time
             loader = PyPDFLoader(pdf_path)
-            docs = loader.load()
 
             # Split into chunks
-            text_splitter = CharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-            docs = text_splitter.split_documents(docs)
+            def split_pages() -> Iterator[Document]:
+                for page in track_iter(loader.lazy_load(), "parse", timings):
+                    with track("chunk", timings):
+                        page_chunks = chunker.split(page)
+                    yield from page_chunks
 
-            return docs
+            yield from carry_sections(split_pages())
         except Exception as e:
-            print("extract_text_from_pdf: Error: ", str(e))
+            print("iter_chunks_from_pdf: Error: ", str(e))
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Something went wrong!")
 
+    def extract_text_from_pdf(self, pdf_path: str, chunker: Chunker | None = None) -> list[Document]:
+        return list(self.iter_chunks_from_pdf(pdf_path, chunker=chunker))
+
     def create_collection(self, collection_name: str):
         try:
+            # In multitenant mode, skip the global HNSW graph and build one per user_id instead
+            hnsw_config = None
+            if Config.QDRANT_MULTITENANCY:
+                hnsw_config = models.HnswConfigDiff(payload_m=16, m=0)
+
             self.client.create_collection(
                 collection_name=collection_name,
-                vectors_config=VectorParams(size=384, distance=Distance.COSINE)
+                vectors_config=VectorParams(
+                    size=self.model.dimension,
+                    distance=Distance.COSINE,
+                    on_disk=Config.QDRANT_VECTORS_ON_DISK
+                ),
+                sparse_vectors_config={
+                    SPARSE_VECTOR_NAME: models.SparseVectorParams(modifier=models.Modifier.IDF)
+                },
+                hnsw_config=hnsw_config,
+                quantization_config=self.quantization_config()
             )
+            self.sparse_collections[collection_name] = True
+            self.create_payload_indexes(collection_name)
         except Exception as e:
             print("create_collection: Error: ", str(e))
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Something went wrong!")
 
-    def ingest_documents(self, collection_name: str, pdf_path: str, user_id: str):
-        try:
-            if not self.client.collection_exists(collection_name):
-                self.create_collection(collection_name)
+    def quantization_config(self) -> models.QuantizationConfig | None:
+        """Compressed copy of the vectors kept in RAM for search, per QDRANT_QUANTIZATION"""
+        if Config.QDRANT_QUANTIZATION == "scalar":
+            return models.ScalarQuantization(
+                scalar=models.ScalarQuantizationConfig(
+                    type=models.ScalarType.INT8,
+                    quantile=0.99,
+                    always_ram=True
+                )
+            )
+        if Config.QDRANT_QUANTIZATION == "binary":
+            return models.BinaryQuantization(
+                binary=models.BinaryQuantizationConfig(always_ram=True)
+            )
+        return None
 
-            docs = self.extract_text_from_pdf(pdf_path, chunk_size=300, chunk_overlap=50)
+    def search_params(self) -> models.SearchParams | None:
+        if Config.QDRANT_QUANTIZATION == "none":
+            return None
 
-            # create points for ingestion into qdrant
-            points: list[PointStruct] = []
-            t = int(time.time())
-            for idx, doc in enumerate(docs):
-                point = PointStruct(
-                    id=int(idx + t),
-                    vector=self.model.encode(doc.page_content).tolist(),
-                    payload={
-                        "text": doc.page_content,
-                        "user_id": user_id,
-                        **doc.metadata
-                    }
+        # Search the quantized vectors, then rescore the oversampled candidates with the originals
+        return models.SearchParams(
+            quantization=models.QuantizationSearchParams(
+                rescore=Config.QDRANT_RESCORE,
+                oversampling=Config.QDRANT_OVERSAMPLING
+            )
+        )
+
+    def update_vector_storage(self, collection_name: str):
+        """Bring an existing collection in line with the quantization and on-disk settings"""
+        collection = self.client.get_collection(collection_name)
+        vectors = collection.config.params.vectors
+        quantization_config = self.quantization_config()
+
+        on_disk_changed = bool(vectors.on_disk) != Config.QDRANT_VECTORS_ON_DISK
+        quantization_changed = type(collection.config.quantization_config) is not type(quantization_config)
+        if not on_disk_changed and not quantization_changed:
+            return
+
+        # Qdrant rebuilds the affected segments in the background, search keeps working meanwhile
+        self.client.update_collection(
+            collection_name=collection_name,
+            vectors_config={"": models.VectorParamsDiff(on_disk=Config.QDRANT_VECTORS_ON_DISK)} if on_disk_changed else None,
+            quantization_config=quantization_config if quantization_config is not None else models.Disabled.DISABLED
+        )
+
+    def create_payload_indexes(self, collection_name: str):
+        """Keyword indexes on the fields every search filters on. Safe to call on existing collections."""
+        self.client.create_payload_index(
+            collection_name=collection_name,
+            field_name="user_id",
+            field_schema=models.KeywordIndexParams(
+                type=models.KeywordIndexType.KEYWORD,
+                is_tenant=Config.QDRANT_MULTITENANCY
+            ),
+            wait=True
+        )
+        self.client.create_payload_index(
+            collection_name=collection_name,
+            field_name="source",
+            field_schema=models.KeywordIndexParams(type=models.KeywordIndexType.KEYWORD),
+            wait=True
+        )
+        self.indexed_collections.add(collection_name)
+
+    def ensure_collection(self, collection_name: str):
+        if not self.client.collection_exists(collection_name):
+            self.create_collection(collection_name)
+        elif collection_name not in self.indexed_collections:
+            self.check_vector_size(collection_name)
+            # Collections created before payload indexing or quantization existed are updated once per process
+            self.update_vector_storage(collection_name)
+            self.create_payload_indexes(collection_name)
+
+    def check_vector_size(self, collection_name: str):
+        """Refuse a collection built with another embedding model, Qdrant would reject every upsert into it"""
+        size = self.client.get_collection(collection_name).config.params.vectors.size
+        if size != self.model.dimension:
+            raise ValueError(
+                f"Collection {collection_name} holds {size}-dimensional vectors but {self.model.name} "
+                f"embeds {self.model.dimension}, re-create it or set TRANSFORMER_MODEL back"
+            )
+
+    def has_sparse_vectors(self, collection_name: str) -> bool:
+        """Whether the collection was created with BM25 sparse vectors, which can't be added later"""
+        if collection_name not in self.sparse_collections:
+            collection = self.client.get_collection(collection_name)
+            self.sparse_collections[collection_name] = SPARSE_VECTOR_NAME in (collection.config.params.sparse_vectors or {})
+
+        return self.sparse_collections[collection_name]
+
+    async def ahas_sparse_vectors(self, collection_name: str) -> bool:
+        if collection_name not in self.sparse_collections:
+            collection = await self.async_client.get_collection(collection_name)
+            self.sparse_collections[collection_name] = SPARSE_VECTOR_NAME in (collection.config.params.sparse_vectors or {})
+
+        return self.sparse_collections[collection_name]
+
+    def hybrid_enabled(self, has_sparse_vectors: bool) -> bool:
+        return Config.RETRIEVAL_MODE == "hybrid" and has_sparse_vectors
+
+    def encode_texts(self, texts: list[str], batch_size: int = Config.EMBEDDING_BATCH_SIZE) -> np.ndarray:
+        """Encode a list of texts into a float32 matrix of shape (len(texts), dim)"""
+        return self.model.encode(texts, batch_size=batch_size)
+
+    def embed_documents(self, texts: list[str], batch_size: int = Config.EMBEDDING_BATCH_SIZE) -> np.ndarray:
+        """Like encode_texts, but only runs the model for chunks missing from the embedding store"""
+        if self.embedding_store is None:
+            return self.encode_texts(texts, batch_size=batch_size)
+
+        vectors = self.embedding_store.get_many(texts)
+        missing = [idx for idx, vector in enumerate(vectors) if vector is None]
+        if missing:
+            missing_texts = [texts[idx] for idx in missing]
+            encoded = self.encode_texts(missing_texts, batch_size=batch_size)
+            self.embedding_store.set_many(missing_texts, encoded)
+            for idx, vector in zip(missing, encoded):
+                vectors[idx] = vector
+
+        return np.vstack(vectors)
+
+    def encode_query(self, query: str) -> np.ndarray:
+        vector = self.query_cache.get(query)
+        if vector is None:
+            vector = self.encode_texts([query])[0]
+            self.query_cache.set(query, vector)
+
+        return vector
+
+    def encode_sparse_query(self, query: str) -> models.SparseVector:
+        return self.sparse_model.encode_query(query)
+
+    def upsert_points(self, collection_name: str, points: list[PointStruct]):
+        self.client.upsert(
+            collection_name=collection_name,
+            points=points,
+            wait=True
+        )
+
+    @staticmethod
+    def point_id(document_id: str, chunk_index: int) -> str:
+        """Deterministic point id, so re-ingesting a document overwrites its points instead of duplicating them"""
+        return str(uuid.uuid5(POINT_ID_NAMESPACE, f"{document_id}:{chunk_index}"))
+
+    @staticmethod
+    def source_filter(source: str) -> models.Filter:
+        return models.Filter(
+            must=[
+                models.FieldCondition(
+                    key="source",
+                    match=models.MatchValue(value=source)
                 )
-                points.append(point)
+            ]
+        )
+
+    @staticmethod
+    def as_list(value: str | list[str]) -> list[str]:
+        return value if isinstance(value, list) else [value]
+
+    def association_lock(self):
+        """
+        Serializes the edits of the `source` and `user_id` lists of shared points
+        across workers, since Qdrant can only overwrite a payload field, not append to it
+        """
+        return self.lock_client.lock("askpdf:points:associations", timeout=15 * 60)
+
+    def group_by_association(self, records: list[models.Record]) -> dict[tuple[tuple[str, ...], tuple[str, ...]], list]:
+        """Ids of the records by their (sources, user ids), so each group is updated in a single operation"""
+        groups: dict[tuple[tuple[str, ...], tuple[str, ...]], list] = {}
+        for record in records:
+            key = (tuple(self.as_list(record.payload["source"])), tuple(self.as_list(record.payload["user_id"])))
+            groups.setdefault(key, []).append(record.id)
+        return groups
 
-            self.client.upsert(
+    def delete_points(self, collection_name: str, source: str, batch_size: int = Config.PURGE_BATCH_SIZE) -> int:
+        """
+        Remove a pdf from its points, `batch_size` points at a time, and return how many were deleted.
+
+        Points shared with other pdfs only lose this pdf's association, the others
+        are deleted. Small batches keep a large document from holding one long
+        delete on the shared collection that every search has to wait behind.
+        """
+        if not self.client.collection_exists(collection_name):
+            return 0
+
+        deleted = 0
+        with self.association_lock():
+            while True:
+                # Handled points drop out of the filter, so every page starts from the beginning
+                records, _ = self.client.scroll(
+                    collection_name=collection_name,
+                    scroll_filter=self.source_filter(source),
+                    limit=batch_size,
+                    with_payload=["source", "user_id"],
+                    with_vectors=False
+                )
+                if not records:
+                    return deleted
+
+                orphans = []
+                operations = []
+                for (sources, user_ids), ids in self.group_by_association(records).items():
+                    # `user_id` holds the owner of each pdf in `source`, at the same position
+                    remaining = [(other, user_id) for other, user_id in zip(sources, user_ids) if other != source]
+                    if not remaining:
+                        orphans.extend(ids)
+                        continue
+
+                    operations.append(models.SetPayloadOperation(set_payload=models.SetPayload(
+                        payload={"source": [other for other, _ in remaining], "user_id": [user_id for _, user_id in remaining]},
+                        points=ids
+                    )))
+
+                if orphans:
+                    self.client.delete(
+                        collection_name=collection_name,
+                        points_selector=models.PointIdsList(points=orphans),
+                        wait=True
+                    )
+                if operations:
+                    self.client.batch_update_points(collection_name=collection_name, update_operations=operations, wait=True)
+                deleted += len(orphans)
+
+    def iter_sources(self, collection_name: str, batch_size: int = Config.PURGE_BATCH_SIZE) -> Iterator[list[str]]:
+        """
+        Every pdf with points in the collection, in batches of pdfs not seen before.
+
+        Scrolls the `source` payload of every point rather than faceting on it,
+        since a facet only returns the pdfs with the most points.
+        """
+        if not self.client.collection_exists(collection_name):
+            return
+
+        seen: set[str] = set()
+        offset = None
+        while True:
+            records, offset = self.client.scroll(
                 collection_name=collection_name,
-                points=points
+                limit=batch_size,
+                offset=offset,
+                with_payload=["source"],
+                with_vectors=False
             )
+            new = {source for record in records for source in self.as_list(record.payload["source"])} - seen
+            if new:
+                seen.update(new)
+                yield sorted(new)
+
+            if offset is None:
+                return
+
+    def associate_points(
+        self,
+        collection_name: str,
+        from_source: str,
+        to_source: str,
+        user_id: str,
+        expected: int,
+        batch_size: int = Config.QDRANT_UPSERT_BATCH_SIZE,
+        on_progress: ProgressCallback | None = None
+    ) -> int:
+        """
+        Share the points of an already ingested pdf with a new document, without
+        re-embedding or copying its vectors, and return how many points it has.
+
+        Each point keeps a single vector and lists every pdf using it in `source`,
+        with the owner of each in `user_id` at the same position, so the search
+        filters match it for every one of them. Returns 0, leaving the points as
+        they are, when the pdf has fewer than the `expected` points it was ingested
+        with, e.g. a failed purge removed some of them.
+        """
+        scroll_filter = self.source_filter(from_source)
+
+        with self.association_lock():
+            # Scroll goes by point id, not by page, so progress is the share of the source's points done so far
+            total = self.client.count(collection_name=collection_name, count_filter=scroll_filter, exact=True).count
+            if total < expected:
+                print(f"associate_points: {from_source} has {total} of its {expected} points left, ingesting instead")
+                return 0
+
+            associated = 0
+            offset = None
+            while associated < total:
+                records, offset = self.client.scroll(
+                    collection_name=collection_name,
+                    scroll_filter=scroll_filter,
+                    limit=batch_size,
+                    offset=offset,
+                    with_payload=["source", "user_id", "total_pages"],
+                    with_vectors=False
+                )
+
+                operations = [
+                    models.SetPayloadOperation(set_payload=models.SetPayload(
+                        payload={"source": [*sources, to_source], "user_id": [*user_ids, user_id]},
+                        points=ids
+                    ))
+                    for (sources, user_ids), ids in self.group_by_association(records).items()
+                    # Already done by an earlier run of a redelivered task
+                    if to_source not in sources
+                ]
+                if operations:
+                    self.client.batch_update_points(collection_name=collection_name, update_operations=operations, wait=True)
+
+                associated += len(records)
+                if records and on_progress is not None:
+                    pages_total = records[-1].payload.get("total_pages")
+                    pages_done = pages_total * min(associated, total) // total if pages_total else 0
+                    on_progress(associated, pages_done, pages_total)
+
+                if offset is None:
+                    break
+
+        return associated
+
+    def ingest_documents(
+        self,
+        collection_name: str,
+        document_id: str,
+        pdf_path: str,
+        user_id: str,
+        reuse_from: str | None = None,
+        reuse_points: int = 0,
+        local_path: str | None = None,
+        batch_size: int = Config.EMBEDDING_BATCH_SIZE,
+        upsert_batch_size: int = Config.QDRANT_UPSERT_BATCH_SIZE,
+        on_progress: ProgressCallback | None = None,
+        timings: dict[str, float] | None = None
+    ):
+        """
+        Stream the pdf through page -> chunk -> embedding batch -> upsert batch.
+
+        At most `upsert_batch_size + batch_size` chunks (text, vector and payload)
+        are held in memory at any time, whatever the size of the pdf.
+
+        `reuse_from` is the url of an ingested pdf with the same content hash, whose
+        points are shared with this document instead of parsing and embedding it again,
+        provided it still has the `reuse_points` points it was ingested with.
+
+        `local_path` is a local copy of the pdf to parse instead of downloading `pdf_path`.
+
+        Point ids are derived from the document id and chunk index and progress is
+        checkpointed after every upsert batch, so running this again for the same
+        document is idempotent and resumes after the last committed batch.
+
+        `on_progress(chunks_done, pages_done, pages_total)` is called after every
+        committed upsert batch, and may raise IngestCancelled to stop there. Time spent in each stage is added to `timings`.
+        """
+        try:
+            self.ensure_collection(collection_name)
+
+            if reuse_from is not None and self.associate_points(collection_name, reuse_from, pdf_path, user_id, reuse_points, upsert_batch_size, on_progress):
+                self.checkpoint.clear(document_id)
+                return
+
+            # Chunks before the checkpoint are already in qdrant, so only parse them
+            committed = self.checkpoint.get(document_id)
+            chunks = islice(enumerate(self.iter_chunks_from_pdf(pdf_path, local_path=local_path, timings=timings)), committed, None)
+
+            # BM25 vectors are computed alongside the dense ones whenever hybrid search is on
+            hybrid = self.hybrid_enabled(self.has_sparse_vectors(collection_name))
+
+            # create points for ingestion into qdrant, encoding the chunks batch by batch
+            points: list[PointStruct] = []
+            for batch in batched(chunks, batch_size):
+                texts = [doc.page_content for _, doc in batch]
+                with track("embed", timings):
+                    vectors = self.embed_documents(texts, batch_size=batch_size)
+                    sparse_vectors = self.sparse_model.encode(texts, batch_size=batch_size) if hybrid else [None] * len(batch)
+                for (idx, doc), vector, sparse_vector in zip(batch, vectors, sparse_vectors):
+                    point = PointStruct(
+                        id=self.point_id(document_id, idx),
+                        vector=vector.tolist() if sparse_vector is None else {"": vector.tolist(), SPARSE_VECTOR_NAME: sparse_vector},
+                        payload={
+                            "text": doc.page_content,
+                            "user_id": user_id,
+                            **doc.metadata
+                        }
+                    )
+                    points.append(point)
+
+                if len(points) >= upsert_batch_size:
+                    with track("upsert", timings):
+                        self.upsert_points(collection_name, points)
+                    self.checkpoint.set(document_id, idx + 1)
+                    points = []
+                    if on_progress is not None:
+                        on_progress(idx + 1, doc.metadata.get("page", 0) + 1, doc.metadata.get("total_pages"))
+
+            if points:
+                with track("upsert", timings):
+                    self.upsert_points(collection_name, points)
+                if on_progress is not None:
+                    on_progress(idx + 1, doc.metadata.get("page", 0) + 1, doc.metadata.get("total_pages"))
+
+            self.checkpoint.clear(document_id)
+        except IngestCancelled:
+            raise
         except Exception as e:
             print("ingest_documents: Error: ", str(e))
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Something went wrong!")
 
+    def document_filter(self, user_id: str, pdf_url: str) -> models.Filter:
+        # Filter based on user id, pdf_name and pdf_url
+        return models.Filter(
+            must=[
+                models.FieldCondition(
+                    key="user_id",
+                    match=models.MatchValue(value=user_id)
+                ),
+                models.FieldCondition(
+                    key="source",
+                    match=models.MatchValue(value=pdf_url)
+                )
+            ]
+        )
+
+    def query_request(
+        self,
+        query_vector: np.ndarray,
+        sparse_vector: models.SparseVector | None,
+        query_filter: models.Filter,
+        limit: int
+    ) -> dict:
+        """Arguments of query_points for a dense search, or a hybrid one when a sparse query vector is given"""
+        if sparse_vector is None:
+            return {
+                "query": query_vector.tolist(),
+                "query_filter": query_filter,
+                "search_params": self.search_params(),
+                "limit": limit
+            }
+
+        # Both searches run inside Qdrant and are fused with reciprocal rank fusion in the same request
+        prefetch_limit = max(limit, Config.HYBRID_PREFETCH_LIMIT)
+        return {
+            "prefetch": [
+                models.Prefetch(
+                    query=query_vector.tolist(),
+                    filter=query_filter,
+                    params=self.search_params(),
+                    limit=prefetch_limit
+                ),
+                models.Prefetch(
+                    query=sparse_vector,
+                    using=SPARSE_VECTOR_NAME,
+                    filter=query_filter,
+                    limit=prefetch_limit
+                )
+            ],
+            "query": models.FusionQuery(fusion=models.Fusion.RRF),
+            "query_filter": query_filter,
+            "limit": limit
+        }
+
     def retrieve_documents(self, collection_name: str, query: str, user_id: str, pdf_url: str, limit: int = 5):
         try:
-            # Filter based on user id, pdf_name and pdf_url
-            filter_match = models.Filter(
-                must=[
-                    models.FieldCondition(
-                        key="user_id",
-                        match=models.MatchValue(value=user_id)
-                    ),
-                    models.FieldCondition(
-                        key="source",
-                        match=models.MatchValue(value=pdf_url)
-                    )
-                ]
-            )
+            sparse_vector = None
+            if self.hybrid_enabled(self.has_sparse_vectors(collection_name)):
+                sparse_vector = self.encode_sparse_query(query)
 
             # Search
-            response = self.client.search(
+            response = self.client.query_points(
                 collection_name=collection_name,
-                limit=limit,
-                query_vector=self.model.encode(query).tolist(),
-                query_filter=filter_match
+                **self.query_request(self.encode_query(query), sparse_vector, self.document_filter(user_id, pdf_url), limit)
             )
 
             # Extract only text field
             results = []
-            for result in response:
+            for result in response.points:
                 results.append(result.payload["text"])
 
             return results
@@ -141,17 +661,116 @@ class QdrantService:
             print("retrieve_documents: Error: ", str(e))
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Something went wrong!")
 
+    async def aencode_query(self, query: str) -> np.ndarray:
+        """Run query encoding on the bounded inference pool instead of the event loop"""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, self.encode_query, query)
+
+    def rerank(self, query: str, texts: list[str], limit: int, deadline: float) -> list[str] | None:
+        """
+        Order texts by cross-encoder relevance to the query and keep the top `limit`.
+
+        Scores in batches and gives up, returning None, when the next batch would
+        likely end after `deadline` (a time.perf_counter() value).
+        """
+        scores = []
+        batch_time = 0.0
+        for batch in batched(texts, Config.RERANK_BATCH_SIZE):
+            if time.perf_counter() + batch_time > deadline:
+                return None
+
+            start = time.perf_counter()
+            scores.extend(self.reranker.score(query, batch, batch_size=len(batch)))
+            batch_time = time.perf_counter() - start
+
+        order = np.argsort(scores)[::-1][:limit]
+        return [texts[idx] for idx in order]
+
+    async def arerank(self, query: str, texts: list[str], limit: int) -> list[str]:
+        """Rerank on the inference pool within RERANK_BUDGET_MS, falling back to the vector search order"""
+        budget = Config.RERANK_BUDGET_MS / 1000
+        deadline = time.perf_counter() + budget
+
+        reranked = None
+        try:
+            loop = asyncio.get_running_loop()
+            reranked = await asyncio.wait_for(
+                loop.run_in_executor(self.executor, self.rerank, query, texts, limit, deadline),
+                timeout=budget
+            )
+        except asyncio.TimeoutError:
+            # The worker thread stops by itself at its next deadline check
+            pass
+
+        if reranked is None:
+            print("arerank: Latency budget exceeded, keeping vector search order")
+            return texts[:limit]
+
+        return reranked
+
+    async def aretrieve_documents(
+        self,
+        collection_name: str,
+        query: str,
+        user_id: str,
+        pdf_url: str,
+        limit: int = 5,
+        timings: dict[str, float] | None = None
+    ):
+        """
+        Non-blocking variant of retrieve_documents for the API.
+
+        With RERANK_ENABLED, RERANK_CANDIDATES chunks are fetched and the top `limit`
+        kept after reranking. Stage durations are added to `timings` when given.
+        """
+        try:
+            with track("query_embed", timings):
+                if self.hybrid_enabled(await self.ahas_sparse_vectors(collection_name)):
+                    query_vector, sparse_vector = await asyncio.gather(
+                        self.aencode_query(query),
+                        asyncio.get_running_loop().run_in_executor(self.executor, self.encode_sparse_query, query)
+                    )
+                else:
+                    query_vector, sparse_vector = await self.aencode_query(query), None
+
+            # Search
+            candidates = max(limit, Config.RERANK_CANDIDATES) if Config.RERANK_ENABLED else limit
+            with track("search", timings):
+                response = await self.async_client.query_points(
+                    collection_name=collection_name,
+                    **self.query_request(query_vector, sparse_vector, self.document_filter(user_id, pdf_url), candidates)
+                )
+
+            # Extract only text field
+            texts = [result.payload["text"] for result in response.points]
+
+            if Config.RERANK_ENABLED and len(texts) > limit:
+                with track("rerank", timings):
+                    texts = await self.arerank(query, texts, limit)
+
+            return texts
+        except Exception as e:
+            print("aretrieve_documents: Error: ", str(e))
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Something went wrong!")
+
 class AIService:
-    client: Groq
+    def __init__(self, api_key: str, model: str = "llama3-8b-8192"):
+        self.api_key = api_key
+        self.model = model
+
+    @cached_property
+    def client(self) -> Groq:
+        return Groq(api_key=self.api_key)
 
-    def __init__(self, api_key: str):
-        self.client = Groq(api_key=api_key)
+    @cached_property
+    def async_client(self) -> AsyncGroq:
+        return AsyncGroq(api_key=self.api_key)
 
     def get_ai_response(self, messages: list[dict]):
         try:
             response = self.client.chat.completions.create(
                 messages=messages,
-                model="llama3-8b-8192"
+                model=self.model
             )
 
             return response.choices[0].message.content
@@ -159,17 +778,88 @@ class AIService:
             print("get_ai_response: Error: ", str(e))
             raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Something went wrong!")
 
-supabase_service = SupabaseService(
-    supabase_key=Config.SUPABASE_KEY,
-    supabase_url=Config.SUPABASE_URL
-)
+    async def aget_ai_response(self, messages: list[dict]):
+        try:
+            response = await self.async_client.chat.completions.create(
+                messages=messages,
+                model=self.model
+            )
+
+            return response.choices[0].message.content
+        except Exception as e:
+            print("aget_ai_response: Error: ", str(e))
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Something went wrong!")
+
+    async def astream_ai_response(self, messages: list[dict]) -> AsyncIterator[str]:
+        """Yield the completion tokens as Groq generates them"""
+        try:
+            stream = await self.async_client.chat.completions.create(
+                messages=messages,
+                model=self.model,
+                stream=True
+            )
+
+            async for chunk in stream:
+                token = chunk.choices[0].delta.content
+                if token:
+                    yield token
+        except Exception as e:
+            print("astream_ai_response: Error: ", str(e))
+            raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail="Something went wrong!")
+
+class FakeAIService:
+    """
+    Stand-in for AIService in load tests, with no network calls.
+
+    Answers with `answer_tokens` words of the question, after `latency_ms` and
+    then at `tokens_per_second`, so chat latency can be measured without Groq.
+    """
+
+    def __init__(self, latency_ms: int, tokens_per_second: float, answer_tokens: int):
+        self.latency_ms = latency_ms
+        self.tokens_per_second = tokens_per_second
+        self.answer_tokens = answer_tokens
+
+    def tokens(self, messages: list[dict]) -> list[str]:
+        words = messages[-1]["content"].split() or ["answer"]
+        return [f"{words[i % len(words)]} " for i in range(self.answer_tokens)]
+
+    def duration(self) -> float:
+        return self.latency_ms / 1000 + self.answer_tokens / self.tokens_per_second
+
+    def get_ai_response(self, messages: list[dict]):
+        time.sleep(self.duration())
+        return "".join(self.tokens(messages))
+
+    async def aget_ai_response(self, messages: list[dict]):
+        await asyncio.sleep(self.duration())
+        return "".join(self.tokens(messages))
+
+    async def astream_ai_response(self, messages: list[dict]) -> AsyncIterator[str]:
+        await asyncio.sleep(self.latency_ms / 1000)
+        for token in self.tokens(messages):
+            yield token
+            await asyncio.sleep(1 / self.tokens_per_second)
+
+def get_ai_service(backend: str = Config.LLM_BACKEND) -> AIService | FakeAIService:
+    if backend == "groq":
+        if not Config.GROQ_API_KEY:
+            raise ValueError("GROQ_API_KEY is required with LLM_BACKEND=groq")
+        return AIService(api_key=Config.GROQ_API_KEY)
+    if backend == "fake":
+        return FakeAIService(
+            latency_ms=Config.FAKE_LLM_LATENCY_MS,
+            tokens_per_second=Config.FAKE_LLM_TOKENS_PER_SECOND,
+            answer_tokens=Config.FAKE_LLM_ANSWER_TOKENS
+        )
+
+    raise ValueError(f"Unknown LLM backend: {backend}")
 
 qdrant_service = QdrantService(
     qdrant_host=Config.QDRANT_HOST,
     qdrant_port=Config.QDRANT_PORT, 
-    transformer_model=Config.TRANSFORMER_MODEL
+    transformer_model=Config.TRANSFORMER_MODEL,
+    location=Config.QDRANT_LOCATION
 )
 
-ai_service = AIService(
-    api_key=Config.GROQ_API_KEY
-)
\ No newline at end of file
+ai_service = get_ai_service()
\ No newline at end of file
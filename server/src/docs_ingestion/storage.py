@@ -0,0 +1,269 @@
+from fastapi import UploadFile, HTTPException, status
+from starlette.concurrency import run_in_threadpool
+from datetime import datetime, timezone
+from typing import AsyncIterator, Protocol
+from urllib.parse import quote, urlparse
+import xml.etree.ElementTree as ElementTree
+import hashlib
+import hmac
+import httpx
+import os
+
+from src.config import Config
+
+
+class UploadReader:
+    """
+    Read an upload in chunks, hashing and size-checking the bytes as they go through.
+
+    Iterate it once to stream the file, then read `sha256` and `size`.
+    """
+
+    def __init__(self, file: UploadFile, chunk_size: int, max_bytes: int):
+        self.file = file
+        self.chunk_size = chunk_size
+        self.max_bytes = max_bytes
+        self.hasher = hashlib.sha256()
+        self.size = 0
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        while chunk := await self.file.read(self.chunk_size):
+            self.size += len(chunk)
+            if self.size > self.max_bytes:
+                raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="File is too large")
+
+            self.hasher.update(chunk)
+            yield chunk
+
+    @property
+    def sha256(self) -> str:
+        return self.hasher.hexdigest()
+
+class Storage(Protocol):
+    async def upload(self, key: str, chunks: AsyncIterator[bytes], content_type: str) -> str:
+        """Stream an object to the bucket and return its public url"""
+        ...
+
+    async def delete(self, key: str):
+        ...
+
+    async def close(self):
+        ...
+
+class SupabaseStorage:
+    """Supabase Storage REST API, with the body streamed instead of read into memory first"""
+
+    def __init__(self, supabase_url: str, supabase_key: str, bucket: str):
+        self.supabase_url = supabase_url
+        self.bucket = bucket
+        self.client = httpx.AsyncClient(
+            base_url=f"{supabase_url}/storage/v1",
+            headers={"Authorization": f"Bearer {supabase_key}", "apikey": supabase_key},
+            timeout=httpx.Timeout(60.0, connect=10.0)
+        )
+
+    async def upload(self, key: str, chunks: AsyncIterator[bytes], content_type: str) -> str:
+        response = await self.client.post(
+            f"/object/{self.bucket}/{quote(key)}",
+            content=chunks,
+            headers={"Content-Type": content_type, "x-upsert": "false"}
+        )
+        response.raise_for_status()
+
+        return f"{self.supabase_url}/storage/v1/object/public/{self.bucket}/{key}"
+
+    async def delete(self, key: str):
+        response = await self.client.request("DELETE", f"/object/{self.bucket}", json={"prefixes": [key]})
+        response.raise_for_status()
+
+    async def close(self):
+        await self.client.aclose()
+
+class S3Storage:
+    """
+    Any S3-compatible store: AWS S3, Supabase's S3 endpoint, or a local MinIO.
+
+    Objects larger than one part go through a multipart upload, so at most
+    `part_size` bytes of an upload are held in memory. Requests are signed with
+    AWS Signature Version 4 and use path-style urls.
+    """
+
+    def __init__(self, endpoint_url: str, access_key_id: str, secret_access_key: str, region: str, bucket: str, part_size: int, public_url: str | None = None):
+        self.endpoint_url = endpoint_url.rstrip("/")
+        self.access_key_id = access_key_id
+        self.secret_access_key = secret_access_key
+        self.region = region
+        self.bucket = bucket
+        self.part_size = part_size
+        self.public_url = (public_url or self.endpoint_url).rstrip("/")
+        self.client = httpx.AsyncClient(timeout=httpx.Timeout(60.0, connect=10.0))
+
+    def sign(
+        self,
+        method: str,
+        path: str,
+        query: dict[str, str],
+        headers: dict[str, str] | None = None,
+        payload_hash: str = "UNSIGNED-PAYLOAD",
+        now: datetime | None = None
+    ) -> dict[str, str]:
+        """
+        SigV4 headers for a request, `headers` included in the signature.
+
+        The payload is unsigned by default so upload parts are not hashed twice.
+        """
+        now = now or datetime.now(timezone.utc)
+        amz_date = now.strftime("%Y%m%dT%H%M%SZ")
+        date = now.strftime("%Y%m%d")
+        host = urlparse(self.endpoint_url).netloc
+        base_path = urlparse(self.endpoint_url).path
+
+        headers = {
+            "host": host,
+            **{name.lower(): value for name, value in (headers or {}).items()},
+            "x-amz-content-sha256": payload_hash,
+            "x-amz-date": amz_date
+        }
+        signed_headers = ";".join(sorted(headers))
+        canonical_request = "\n".join([
+            method,
+            quote(f"{base_path}{path}"),
+            "&".join(f"{quote(name, safe='')}={quote(value, safe='')}" for name, value in sorted(query.items())),
+            "".join(f"{name}:{headers[name]}\n" for name in sorted(headers)),
+            signed_headers,
+            payload_hash
+        ])
+
+        scope = f"{date}/{self.region}/s3/aws4_request"
+        string_to_sign = "\n".join(["AWS4-HMAC-SHA256", amz_date, scope, hashlib.sha256(canonical_request.encode()).hexdigest()])
+
+        key = f"AWS4{self.secret_access_key}".encode()
+        for part in (date, self.region, "s3", "aws4_request"):
+            key = hmac.new(key, part.encode(), hashlib.sha256).digest()
+        signature = hmac.new(key, string_to_sign.encode(), hashlib.sha256).hexdigest()
+
+        headers["Authorization"] = f"AWS4-HMAC-SHA256 Credential={self.access_key_id}/{scope}, SignedHeaders={signed_headers}, Signature={signature}"
+        del headers["host"]
+        return headers
+
+    async def request(self, method: str, key: str, query: dict[str, str] | None = None, **kwargs) -> httpx.Response:
+        path = f"/{self.bucket}/{key}"
+        query = query or {}
+        headers = {**self.sign(method, path, query), **kwargs.pop("headers", {})}
+
+        response = await self.client.request(method, f"{self.endpoint_url}{quote(path)}", params=query, headers=headers, **kwargs)
+        response.raise_for_status()
+        return response
+
+    async def upload(self, key: str, chunks: AsyncIterator[bytes], content_type: str) -> str:
+        buffer = bytearray()
+        upload_id = None
+        etags: list[str] = []
+        try:
+            async for chunk in chunks:
+                buffer.extend(chunk)
+                if len(buffer) < self.part_size:
+                    continue
+
+                if upload_id is None:
+                    response = await self.request("POST", key, {"uploads": ""}, headers={"Content-Type": content_type})
+                    upload_id = ElementTree.fromstring(response.content).findtext("{*}UploadId")
+
+                part, buffer = bytes(buffer[:self.part_size]), buffer[self.part_size:]
+                response = await self.request("PUT", key, {"partNumber": str(len(etags) + 1), "uploadId": upload_id}, content=part)
+                etags.append(response.headers["ETag"])
+
+            # Small files are a single PUT
+            if upload_id is None:
+                await self.request("PUT", key, content=bytes(buffer), headers={"Content-Type": content_type})
+                return f"{self.public_url}/{self.bucket}/{key}"
+
+            if buffer:
+                response = await self.request("PUT", key, {"partNumber": str(len(etags) + 1), "uploadId": upload_id}, content=bytes(buffer))
+                etags.append(response.headers["ETag"])
+
+            parts = "".join(f"<Part><PartNumber>{number}</PartNumber><ETag>{etag}</ETag></Part>" for number, etag in enumerate(etags, start=1))
+            await self.request("POST", key, {"uploadId": upload_id}, content=f"<CompleteMultipartUpload>{parts}</CompleteMultipartUpload>")
+
+            return f"{self.public_url}/{self.bucket}/{key}"
+        except BaseException:
+            # Don't leave orphan parts behind, they are billed until the upload is aborted
+            if upload_id is not None:
+                try:
+                    await self.request("DELETE", key, {"uploadId": upload_id})
+                except Exception as e:
+                    print("S3Storage.upload: Error aborting upload: ", str(e))
+            raise
+
+    async def delete(self, key: str):
+        await self.request("DELETE", key)
+
+    async def close(self):
+        await self.client.aclose()
+
+class LocalStorage:
+    """
+    Files in a local directory, for load tests and development without a storage service.
+
+    The returned url is the absolute path of the file, which the ingestion
+    worker opens directly instead of downloading it.
+    """
+
+    def __init__(self, root_dir: str):
+        self.root_dir = os.path.abspath(root_dir)
+        os.makedirs(self.root_dir, exist_ok=True)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.root_dir, os.path.basename(key))
+
+    async def upload(self, key: str, chunks: AsyncIterator[bytes], content_type: str) -> str:
+        path = self.path(key)
+        file = await run_in_threadpool(open, path, "xb")
+        try:
+            async for chunk in chunks:
+                await run_in_threadpool(file.write, chunk)
+        except BaseException:
+            file.close()
+            os.remove(path)
+            raise
+        file.close()
+
+        return path
+
+    async def delete(self, key: str):
+        try:
+            await run_in_threadpool(os.remove, self.path(key))
+        except FileNotFoundError:
+            pass
+
+    async def close(self):
+        pass
+
+def get_storage(backend: str = Config.STORAGE_BACKEND) -> Storage:
+    if backend == "supabase":
+        if not Config.SUPABASE_URL or not Config.SUPABASE_KEY:
+            raise ValueError("SUPABASE_URL and SUPABASE_KEY are required with STORAGE_BACKEND=supabase")
+        return SupabaseStorage(
+            supabase_url=Config.SUPABASE_URL,
+            supabase_key=Config.SUPABASE_KEY,
+            bucket=Config.STORAGE_BUCKET
+        )
+    if backend == "s3":
+        if not Config.S3_ENDPOINT_URL or not Config.S3_ACCESS_KEY_ID or not Config.S3_SECRET_ACCESS_KEY:
+            raise ValueError("S3_ENDPOINT_URL, S3_ACCESS_KEY_ID and S3_SECRET_ACCESS_KEY are required with STORAGE_BACKEND=s3")
+        return S3Storage(
+            endpoint_url=Config.S3_ENDPOINT_URL,
+            access_key_id=Config.S3_ACCESS_KEY_ID,
+            secret_access_key=Config.S3_SECRET_ACCESS_KEY,
+            region=Config.S3_REGION,
+            bucket=Config.STORAGE_BUCKET,
+            part_size=Config.UPLOAD_PART_BYTES,
+            public_url=Config.S3_PUBLIC_URL
+        )
+
+    if backend == "local":
+        return LocalStorage(root_dir=Config.STORAGE_LOCAL_DIR)
+
+    raise ValueError(f"Unknown storage backend: {backend}")
+
+storage = get_storage()
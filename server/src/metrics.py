@@ -0,0 +1,138 @@
+from prometheus_client import Histogram, Gauge, CollectorRegistry, REGISTRY, make_asgi_app, multiprocess
+from prometheus_client.core import GaugeMetricFamily
+from prometheus_client.registry import Collector
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.pool import QueuePool
+from contextlib import contextmanager
+from typing import Iterable, Iterator, TypeVar
+import time
+import os
+import redis
+
+from src.middlewares import current_route
+from src.tracing import current_trace_id
+
+T = TypeVar("T")
+
+# Kombu's Redis transport keeps one list per priority step, the default step has the bare queue name
+PRIORITY_STEPS = (0, 3, 6, 9)
+
+DB_QUERY_SECONDS = Histogram(
+    "askpdf_db_query_seconds",
+    "Latency of SQL statements, by the API route that issued them",
+    ["route"],
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+)
+
+STAGE_SECONDS = Histogram(
+    "askpdf_stage_seconds",
+    "Latency of the steps of ingestion (upload, parse, chunk, embed, upsert) and chat (query_embed, search, rerank, history, llm)",
+    ["stage"],
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+)
+
+CELERY_TASK_SECONDS = Histogram(
+    "askpdf_celery_task_seconds",
+    "Run time of Celery tasks, by task and final state",
+    ["task", "state"],
+    buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600, 1800)
+)
+
+DB_POOL_CONNECTIONS = Gauge(
+    "askpdf_db_pool_connections",
+    "Connections of the API database pool, checked out or idle",
+    ["state"]
+)
+
+def instrument_engine(engine: Engine):
+    """Time every statement run through the engine and expose its pool usage"""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        start = conn.info["query_start"].pop()
+        DB_QUERY_SECONDS.labels(route=current_route()).observe(time.perf_counter() - start)
+
+    if isinstance(engine.pool, QueuePool):
+        DB_POOL_CONNECTIONS.labels(state="checked_out").set_function(lambda: engine.pool.checkedout())
+        DB_POOL_CONNECTIONS.labels(state="idle").set_function(lambda: engine.pool.checkedin())
+
+
+def observe_stage(stage: str, seconds: float, timings: dict[str, float] | None = None):
+    """Record a stage in STAGE_SECONDS, with the current trace id as exemplar, and in `timings` in milliseconds"""
+    trace_id = current_trace_id()
+    STAGE_SECONDS.labels(stage=stage).observe(seconds, exemplar={"trace_id": trace_id} if trace_id else None)
+    if timings is not None:
+        timings[stage] = timings.get(stage, 0) + seconds * 1000
+
+@contextmanager
+def track(stage: str, timings: dict[str, float] | None = None):
+    """Observe the wall time of the block as `stage`, see observe_stage and server_timing"""
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        observe_stage(stage, time.perf_counter() - start, timings)
+
+def track_iter(iterable: Iterable[T], stage: str, timings: dict[str, float] | None = None) -> Iterator[T]:
+    """Like `track`, for the time spent producing each item of a lazy iterable"""
+    iterator = iter(iterable)
+    while True:
+        start = time.perf_counter()
+        try:
+            item = next(iterator)
+        except StopIteration:
+            return
+        observe_stage(stage, time.perf_counter() - start, timings)
+        yield item
+
+class CeleryQueueCollector(Collector):
+    """Number of messages waiting in the Celery queues of the Redis broker, read on every scrape"""
+
+    def __init__(self, redis_url: str, queues: list[str]):
+        self.client = redis.Redis.from_url(redis_url, socket_timeout=1)
+        self.queues = queues
+
+    def family(self) -> GaugeMetricFamily:
+        return GaugeMetricFamily("askpdf_celery_queue_depth", "Messages waiting in a Celery queue", labels=["queue"])
+
+    def describe(self):
+        # Keeps the registry from calling collect, and so Redis, when the collector is registered
+        yield self.family()
+
+    def collect(self):
+        depth = self.family()
+        try:
+            with self.client.pipeline(transaction=False) as pipe:
+                for queue in self.queues:
+                    for step in PRIORITY_STEPS:
+                        pipe.llen(queue if step == 0 else f"{queue}\x06\x16{step}")
+                lengths = pipe.execute()
+        except redis.RedisError as e:
+            print("CeleryQueueCollector.collect: Error: ", str(e))
+            return
+
+        for i, queue in enumerate(self.queues):
+            depth.add_metric([queue], sum(lengths[i * len(PRIORITY_STEPS):(i + 1) * len(PRIORITY_STEPS)]))
+        yield depth
+
+def metrics_registry() -> CollectorRegistry:
+    """
+    The default registry, or with PROMETHEUS_MULTIPROC_DIR set (several uvicorn
+    workers, Celery prefork children), one that adds up the metrics of every process
+    """
+    if "PROMETHEUS_MULTIPROC_DIR" not in os.environ:
+        return REGISTRY
+
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+def make_metrics_app(redis_url: str, queues: list[str]):
+    registry = metrics_registry()
+    registry.register(CeleryQueueCollector(redis_url, queues))
+    return make_asgi_app(registry)
@@ -1,6 +1,13 @@
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi import Request, HTTPException, status
+from fastapi.responses import JSONResponse
+from starlette.types import ASGIApp, Scope, Receive, Send, Message
+from contextvars import ContextVar
+import uuid
 from src.utils import verify_token
+from src.tracing import start_span, current_traceparent
+
+request_scope: ContextVar[Scope | None] = ContextVar("request_scope", default=None)
 
 class TokenBearer(HTTPBearer):
     def __init__(self, auto_error = True):
@@ -17,6 +24,111 @@ class TokenBearer(HTTPBearer):
         if not decoded_payload:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid token")
 
+        # The token carries the id as a string, queries compare it with UUID columns
+        try:
+            decoded_payload["user"]["id"] = uuid.UUID(decoded_payload["user"]["id"])
+        except (KeyError, TypeError, ValueError):
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Invalid token")
+
         return {"token": token, **decoded_payload}
 
-token_bearer = TokenBearer()
\ No newline at end of file
+token_bearer = TokenBearer()
+
+class RequestContextMiddleware:
+    """
+    Make the ASGI scope of the current request available to code that has no access to it, like SQL event hooks.
+
+    Also starts the trace span of the request, continuing the trace of an
+    incoming `traceparent` header, and returns it in the `traceparent` response
+    header so a slow request can be looked up in the logs and metric exemplars.
+    """
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        parent = dict(scope["headers"]).get(b"traceparent")
+        trace_token = start_span(parent.decode("latin-1") if parent else None)
+        traceparent = current_traceparent.get()
+
+        async def send_with_trace(message: Message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (b"traceparent", traceparent.encode())]
+            await send(message)
+
+        token = request_scope.set(scope)
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            request_scope.reset(token)
+            current_traceparent.reset(trace_token)
+
+class MaxBodySizeMiddleware:
+    """
+    Reject request bodies larger than `max_body_size` bytes with a 413, before they are buffered or spooled.
+
+    The declared Content-Length is checked up front, and the bytes actually
+    received are counted for chunked bodies and clients that lie about it.
+    """
+
+    def __init__(self, app: ASGIApp, max_body_size: int):
+        self.app = app
+        self.max_body_size = max_body_size
+
+    def too_large(self) -> JSONResponse:
+        return JSONResponse(content={"detail": "Request body is too large"}, status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE)
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        content_length = dict(scope["headers"]).get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > self.max_body_size:
+            await self.too_large()(scope, receive, send)
+            return
+
+        received = 0
+        exceeded = False
+        response_started = False
+
+        async def limited_receive() -> Message:
+            nonlocal received, exceeded
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_size:
+                    exceeded = True
+                    raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail="Request body is too large")
+            return message
+
+        async def limited_send(message: Message):
+            nonlocal response_started
+            if not exceeded:
+                response_started = response_started or message["type"] == "http.response.start"
+                await send(message)
+            elif not response_started:
+                # FastAPI turns errors while parsing a form into a 400, answer with the 413 instead
+                response_started = True
+                await self.too_large()(scope, receive, send)
+
+        try:
+            await self.app(scope, limited_receive, limited_send)
+        except Exception:
+            if not exceeded or response_started:
+                raise
+            await self.too_large()(scope, receive, send)
+
+def current_route() -> str:
+    """Path template of the route handling the current request, e.g. /api/v1/documents/{doc_id}"""
+    scope = request_scope.get()
+    if scope is None:
+        return "none"
+
+    # Set by the router once the request is matched, on the same scope dict
+    route = scope.get("route")
+    return route.path if route is not None else "unmatched"
\ No newline at end of file
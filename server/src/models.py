@@ -1,4 +1,4 @@
-from sqlmodel import SQLModel, Field, Column
+from sqlmodel import SQLModel, Field, Column, Index
 import sqlalchemy.dialects.postgresql as pg
 import uuid
 from datetime import datetime
@@ -22,13 +22,16 @@ class User(SQLModel, table=True):
     password: str = Field(sa_column=Column(pg.TEXT, nullable=False))
     plan: str = Field(sa_column=Column(pg.TEXT, nullable=False))
 
-    created_at: datetime = Field(sa_column=Column(pg.TIMESTAMP, default=datetime.now(), nullable=False))
+    created_at: datetime = Field(sa_column=Column(pg.TIMESTAMP, default=datetime.now, nullable=False))
     
     def __repr__(self) -> str:
         return f"<User {self.email}>"
 
 class Document(SQLModel, table=True):
     __tablename__ = "documents"
+    __table_args__ = (
+        Index("ix_documents_user_id_created_at", "user_id", "created_at"),
+    )
 
     id: uuid.UUID = Field(
         sa_column=Column(
@@ -43,16 +46,29 @@ class Document(SQLModel, table=True):
     pdf_url: str
     pdf_name: str
     insert_status: bool = False
+    content_hash: Optional[str] = Field(default=None, index=True)
+
+    # Ingestion progress, written by the Celery worker
+    chunks_done: int = 0
+    pages_done: int = 0
+    pages_total: Optional[int] = None
+    ingest_duration_ms: Optional[int] = None
+
+    # Set when the document is deleted, until purge_document removes the row
+    deleted_at: Optional[datetime] = None
 
     user_id: Optional[uuid.UUID]  = Field(default=None, foreign_key="users.id")
 
-    created_at: datetime = Field(sa_column=Column(pg.TIMESTAMP, default=datetime.now(), nullable=False))
+    created_at: datetime = Field(sa_column=Column(pg.TIMESTAMP, default=datetime.now, nullable=False))
 
     def __repr__(self) -> str:
         return f"<Document {self.pdf_name}>"
 
 class Chat(SQLModel, table=True):
     __tablename__ = "chats"
+    __table_args__ = (
+        Index("ix_chats_user_id_pdf_id_created_at", "user_id", "pdf_id", "created_at"),
+    )
 
     id: uuid.UUID = Field(
         sa_column=Column(
@@ -69,4 +85,4 @@ class Chat(SQLModel, table=True):
     role: str = Field(sa_column=Column(pg.ENUM("user", "assistant", name="role"), nullable=False))
     content: str
 
-    created_at: datetime = Field(sa_column=Column(pg.TIMESTAMP, default=datetime.now(), nullable=False))
\ No newline at end of file
+    created_at: datetime = Field(sa_column=Column(pg.TIMESTAMP, default=datetime.now, nullable=False))
\ No newline at end of file
@@ -0,0 +1,24 @@
+from contextvars import ContextVar, Token
+import secrets
+import re
+
+# W3C Trace Context: https://www.w3.org/TR/trace-context/#traceparent-header
+TRACEPARENT_PATTERN = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+current_traceparent: ContextVar[str | None] = ContextVar("current_traceparent", default=None)
+
+
+def child_traceparent(parent: str | None = None) -> str:
+    """A new span in the trace of `parent`, or in a new trace if there is no valid parent"""
+    match = TRACEPARENT_PATTERN.match(parent or "")
+    trace_id = match.group(1) if match else secrets.token_hex(16)
+    flags = match.group(3) if match else "01"
+    return f"00-{trace_id}-{secrets.token_hex(8)}-{flags}"
+
+def start_span(parent: str | None = None) -> Token:
+    """Make a child span of `parent` the current one, until `current_traceparent.reset(token)`"""
+    return current_traceparent.set(child_traceparent(parent))
+
+def current_trace_id() -> str | None:
+    match = TRACEPARENT_PATTERN.match(current_traceparent.get() or "")
+    return match.group(1) if match else None
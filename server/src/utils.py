@@ -3,6 +3,10 @@ from datetime import datetime, timedelta
 import jwt
 from fastapi import HTTPException, status
 import uuid
+import base64
+from typing import Iterable, Iterator, TypeVar
+from sqlalchemy import tuple_
+from sqlmodel.sql.expression import SelectOfScalar
 
 from src.config import Config
 
@@ -50,4 +54,50 @@ def generate_file_path(file_path: str) -> str:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Only PDF files are allowed")
 
     timestamp = datetime.now().timestamp()
-    return f"{file_path.split('.')[0]}_{str(timestamp).split(".")[0]}_{str(uuid.uuid4())[:6]}.{ext}"
\ No newline at end of file
+    return f"{file_path.split('.')[0]}_{str(timestamp).split(".")[0]}_{str(uuid.uuid4())[:6]}.{ext}"
+
+def batched(iterable: Iterable, size: int) -> Iterator[list]:
+    """Yield successive lists of at most `size` items from `iterable`"""
+    batch = []
+    for item in iterable:
+        batch.append(item)
+        if len(batch) == size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+Row = TypeVar("Row")
+
+def encode_cursor(created_at: datetime, id: uuid.UUID) -> str:
+    """Opaque keyset pagination cursor pointing at the last row of a page"""
+    return base64.urlsafe_b64encode(f"{created_at.isoformat()}|{id.hex}".encode()).decode()
+
+def decode_cursor(cursor: str) -> tuple[datetime, uuid.UUID]:
+    try:
+        created_at, id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+        return datetime.fromisoformat(created_at), uuid.UUID(hex=id)
+    except Exception:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+def keyset_page(statement: SelectOfScalar[Row], model: type[Row], after: tuple[datetime, uuid.UUID] | None, limit: int) -> SelectOfScalar[Row]:
+    """
+    Newest rows of `statement` first, starting after the row `after` was decoded
+    from, plus one row to tell whether there is a next page, see next_cursor.
+
+    Rows are ordered by (created_at, id), so rows created at the same time are
+    neither repeated nor skipped across pages.
+    """
+    if after is not None:
+        statement = statement.where(tuple_(model.created_at, model.id) < after)
+    return statement.order_by(model.created_at.desc(), model.id.desc()).limit(limit + 1)
+
+def next_cursor(rows: list, limit: int) -> str | None:
+    """Cursor of the page after the rows fetched by keyset_page, None on the last page"""
+    return encode_cursor(rows[limit - 1].created_at, rows[limit - 1].id) if len(rows) > limit else None
+
+
+def server_timing(timings: dict[str, float]) -> str:
+    """Format stage timings as a Server-Timing header, shown by browser dev tools"""
+    return ", ".join(f"{stage};dur={duration:.1f}" for stage, duration in timings.items())
\ No newline at end of file
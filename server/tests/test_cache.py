@@ -0,0 +1,114 @@
+import numpy as np
+
+from src.docs_ingestion import cache
+from src.docs_ingestion.cache import AnswerCache, QueryEmbeddingCache
+
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self.values[key] = value
+
+class BrokenRedis:
+    def get(self, key):
+        raise ConnectionError("Redis is down")
+
+    def set(self, key, value, ex=None):
+        raise ConnectionError("Redis is down")
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+def make_cache(max_size: int = 3, ttl_seconds: int = 60, client=None) -> QueryEmbeddingCache:
+    query_cache = QueryEmbeddingCache(model_name="test", max_size=max_size, ttl_seconds=ttl_seconds)
+    query_cache.client = client
+    return query_cache
+
+def vector(value: float) -> np.ndarray:
+    return np.full(4, value, dtype=np.float32)
+
+def test_hit_on_normalized_query():
+    query_cache = make_cache()
+    query_cache.set("What is  the Refund policy?", vector(1))
+
+    assert np.array_equal(query_cache.get("what is the refund policy?"), vector(1))
+    assert query_cache.get("another question") is None
+
+def test_evicts_least_recently_used():
+    query_cache = make_cache(max_size=2)
+    query_cache.set("a", vector(1))
+    query_cache.set("b", vector(2))
+    # Reading "a" makes "b" the least recently used
+    query_cache.get("a")
+    query_cache.set("c", vector(3))
+
+    assert query_cache.get("b") is None
+    assert query_cache.get("a") is not None
+    assert query_cache.get("c") is not None
+    assert query_cache.stats()["size"] == 2
+
+def test_entries_expire_after_ttl(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(cache.time, "monotonic", clock)
+    query_cache = make_cache(ttl_seconds=60)
+    query_cache.set("a", vector(1))
+
+    clock.now += 59
+    assert query_cache.get("a") is not None
+
+    clock.now += 2
+    assert query_cache.get("a") is None
+    assert query_cache.stats()["size"] == 0
+
+def test_redis_is_a_shared_second_level():
+    client = FakeRedis()
+    make_cache(client=client).set("a", vector(1))
+
+    # Another replica, with an empty local cache
+    replica = make_cache(client=client)
+    assert np.array_equal(replica.get("a"), vector(1))
+    assert replica.stats()["size"] == 1
+    assert replica.stats()["backend"] == "redis"
+
+def test_falls_back_to_memory_when_redis_fails():
+    query_cache = make_cache(client=BrokenRedis())
+
+    query_cache.set("a", vector(1))
+    assert np.array_equal(query_cache.get("a"), vector(1))
+    assert query_cache.get("b") is None
+
+def test_stats_count_hits_and_misses():
+    query_cache = make_cache()
+    query_cache.set("a", vector(1))
+    query_cache.get("a")
+    query_cache.get("a")
+    query_cache.get("b")
+
+    stats = query_cache.stats()
+    assert (stats["hits"], stats["misses"], stats["backend"]) == (2, 1, "memory")
+    assert stats["hit_rate"] == 2 / 3
+
+def messages(query: str, history: list[str] = []) -> list[dict]:
+    return [
+        {"role": "system", "content": "Answer from the pdf"},
+        *[{"role": "user", "content": turn} for turn in history],
+        {"role": "user", "content": "chunk 1"},
+        {"role": "user", "content": query}
+    ]
+
+def test_answer_prompt_hash_ignores_only_the_query():
+    assert AnswerCache.prompt_hash(messages("What is the scope?")) == AnswerCache.prompt_hash(messages("What's the scope?"))
+
+def test_answer_prompt_hash_depends_on_the_history():
+    # "And the second one?" means something else after another conversation
+    assert AnswerCache.prompt_hash(messages("And the second one?", ["List the parties"])) != AnswerCache.prompt_hash(messages("And the second one?", ["List the clauses"]))
+    assert AnswerCache.prompt_hash(messages("And the second one?", ["List the parties"])) != AnswerCache.prompt_hash(messages("And the second one?"))
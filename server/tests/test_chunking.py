@@ -0,0 +1,103 @@
+import re
+
+import pytest
+from langchain_core.documents.base import Document
+
+from src.docs_ingestion.chunking import TokenChunker, carry_sections
+
+
+class Encoding:
+    """One token per whitespace separated word, with the offsets the tokenizers library reports"""
+
+    def __init__(self, text: str):
+        self.offsets = [match.span() for match in re.finditer(r"\S+", text)]
+        self.ids = list(range(len(self.offsets)))
+
+class WhitespaceTokenizer:
+    def encode(self, text: str, add_special_tokens: bool = True) -> Encoding:
+        return Encoding(text)
+
+    def encode_batch(self, texts: list[str], add_special_tokens: bool = True) -> list[Encoding]:
+        return [Encoding(text) for text in texts]
+
+def tokens(text: str) -> int:
+    return len(Encoding(text).ids)
+
+@pytest.fixture
+def chunker(monkeypatch) -> TokenChunker:
+    monkeypatch.setattr(TokenChunker, "tokenizer", property(lambda self: WhitespaceTokenizer()))
+    return TokenChunker("test", max_tokens=20, overlap_tokens=4)
+
+def sentences(count: int, start: int = 0) -> str:
+    return " ".join(f"Sentence number {idx} of the text." for idx in range(start, start + count))
+
+PAGE = "\n".join([
+    "1. INTRODUCTION",
+    sentences(2),
+    "",
+    sentences(1, start=2),
+    "",
+    # Longer than max_tokens, split in windows
+    sentences(9, start=3),
+    "",
+    "2. Scope",
+    sentences(2, start=12),
+    "- first item.",
+    "- second item.",
+])
+
+def page(text: str, number: int) -> Document:
+    return Document(page_content=text, metadata={"source": "a.pdf", "page": number, "total_pages": 2})
+
+def test_chunks_are_slices_of_the_page(chunker):
+    chunks = chunker.split(page(PAGE, 0))
+
+    assert len(chunks) > 3
+    for chunk in chunks:
+        assert chunk.page_content == PAGE[chunk.metadata["char_start"]:chunk.metadata["char_end"]]
+        assert chunk.metadata["page"] == 0
+
+def test_chunks_stay_within_max_tokens(chunker):
+    chunks = chunker.split(page(PAGE, 0))
+
+    assert max(tokens(chunk.page_content) for chunk in chunks) <= chunker.max_tokens
+    # Nothing is dropped between the chunks
+    covered = set()
+    for chunk in chunks:
+        covered.update(range(chunk.metadata["char_start"], chunk.metadata["char_end"]))
+    assert all(idx in covered for idx, char in enumerate(PAGE) if not char.isspace())
+
+def test_long_paragraphs_end_windows_on_sentences(chunker):
+    text = sentences(9)
+    chunks = chunker.split(page(text, 0))
+
+    assert len(chunks) > 1
+    assert all(chunk.page_content.endswith(".") for chunk in chunks)
+
+def test_headings_set_the_section(chunker):
+    chunks = chunker.split(page(PAGE, 0))
+
+    assert chunks[0].page_content.startswith("1. INTRODUCTION")
+    assert chunks[0].metadata["section"] == "1. INTRODUCTION"
+    assert chunks[-1].metadata["section"] == "2. Scope"
+
+def test_sections_carry_over_page_breaks(chunker):
+    pages = [
+        page("1. INTRODUCTION\n" + sentences(2), 0),
+        page(sentences(2, start=2) + "\n\n2. Scope\n" + sentences(1, start=4), 1),
+    ]
+
+    chunks = list(carry_sections(chunk for p in pages for chunk in chunker.split(p)))
+
+    assert [(chunk.metadata["page"], chunk.metadata["section"]) for chunk in chunks] == [
+        (0, "1. INTRODUCTION"),
+        (1, "1. INTRODUCTION"),
+        (1, "2. Scope"),
+    ]
+    # The page's own offsets still apply
+    assert chunks[1].page_content == pages[1].page_content[chunks[1].metadata["char_start"]:chunks[1].metadata["char_end"]]
+
+def test_pages_before_any_heading_have_no_section(chunker):
+    chunks = list(carry_sections(chunker.split(page(sentences(2), 0))))
+
+    assert "section" not in chunks[0].metadata
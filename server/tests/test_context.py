@@ -0,0 +1,128 @@
+from datetime import datetime, timedelta
+import asyncio
+import json
+
+from src.docs_ingestion.context import ChatContextBuilder, ChatSummaryStore, estimate_tokens
+
+
+START = datetime(2025, 1, 1, 12, 0, 0)
+
+def make_turns(count: int, words: int = 10) -> list[dict]:
+    return [
+        {
+            "role": "user" if i % 2 == 0 else "assistant",
+            "content": f"turn {i} " + "word " * words,
+            "created_at": START + timedelta(minutes=i)
+        }
+        for i in range(count)
+    ]
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def set(self, key, value, ex=None):
+        self.values[key] = value
+
+class FakeAIService:
+    def __init__(self, fail_on_call: int | None = None):
+        self.calls = []
+        self.fail_on_call = fail_on_call
+
+    async def aget_ai_response(self, messages):
+        self.calls.append(messages)
+        if self.fail_on_call == len(self.calls):
+            raise RuntimeError("LLM unavailable")
+        return f"summary {len(self.calls)}"
+
+def make_store(batch_tokens: int = 6000) -> ChatSummaryStore:
+    store = ChatSummaryStore(redis_url="redis://localhost:6379/0", ttl_seconds=60, batch_tokens=batch_tokens)
+    store.client = FakeRedis()
+    return store
+
+def test_build_keeps_everything_within_budget():
+    history = make_turns(4)
+    messages, dropped = ChatContextBuilder(token_budget=10_000).build("system", history, ["chunk a", "chunk b"], "question")
+
+    assert dropped == []
+    assert [m["content"] for m in messages] == ["system", *[t["content"] for t in history], "chunk a", "chunk b", "question"]
+
+def test_build_drops_oldest_turns_over_budget():
+    history = make_turns(6)
+    turn_cost = estimate_tokens(history[0]["content"])
+    budget = estimate_tokens("system") + estimate_tokens("question") + 2 * turn_cost
+
+    messages, dropped = ChatContextBuilder(token_budget=budget).build("system", history, [], "question")
+
+    assert dropped == history[:4]
+    assert [m["content"] for m in messages[1:-1]] == [t["content"] for t in history[4:]]
+
+def test_build_prefers_chunks_and_summary_over_history():
+    history = make_turns(2)
+    chunk = "chunk " * 20
+    budget = estimate_tokens("system") + estimate_tokens("question") + estimate_tokens(chunk) + estimate_tokens("summary")
+
+    messages, dropped = ChatContextBuilder(token_budget=budget).build("system", history, [chunk], "question", summary="summary")
+
+    assert dropped == history
+    assert messages[1]["role"] == "system" and messages[1]["content"].endswith("summary")
+    assert messages[2]["content"] == chunk
+
+def test_fold_summarizes_and_records_until():
+    store = make_store()
+    ai_service = FakeAIService()
+    turns = make_turns(3)
+
+    asyncio.run(store.fold("u", "d", turns, ai_service))
+
+    assert len(ai_service.calls) == 1
+    assert all(t["content"] in ai_service.calls[0][1]["content"] for t in turns)
+    summary, until = asyncio.run(store.get("u", "d"))
+    assert summary == "summary 1"
+    assert until == turns[-1]["created_at"]
+
+def test_fold_skips_turns_already_folded():
+    store = make_store()
+    ai_service = FakeAIService()
+    turns = make_turns(6)
+    store.client.values[store.key("u", "d")] = json.dumps({"summary": "earlier", "until": turns[2]["created_at"].isoformat()})
+
+    asyncio.run(store.fold("u", "d", turns, ai_service))
+
+    prompt = ai_service.calls[0][1]["content"]
+    assert "earlier" in prompt
+    assert all(t["content"] not in prompt for t in turns[:3])
+    assert all(t["content"] in prompt for t in turns[3:])
+
+    # Nothing new to fold the second time
+    asyncio.run(store.fold("u", "d", turns, ai_service))
+    assert len(ai_service.calls) == 1
+
+def test_fold_covers_turns_out_of_the_window_in_batches():
+    # 30 turns fell out of the window, far more than one prompt's worth
+    turns = make_turns(30)
+    turn_cost = estimate_tokens(turns[0]["content"])
+    store = make_store(batch_tokens=10 * turn_cost)
+    ai_service = FakeAIService()
+
+    asyncio.run(store.fold("u", "d", turns, ai_service))
+
+    assert len(ai_service.calls) == 3
+    # Each batch builds on the summary of the previous one
+    assert "summary 1" in ai_service.calls[1][1]["content"]
+    summary, until = asyncio.run(store.get("u", "d"))
+    assert summary == "summary 3"
+    assert until == turns[-1]["created_at"]
+
+def test_fold_keeps_progress_of_batches_before_a_failure():
+    turns = make_turns(20)
+    store = make_store(batch_tokens=10 * estimate_tokens(turns[0]["content"]))
+
+    asyncio.run(store.fold("u", "d", turns, FakeAIService(fail_on_call=2)))
+
+    summary, until = asyncio.run(store.get("u", "d"))
+    assert summary == "summary 1"
+    assert until == turns[9]["created_at"]
@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+import base64
+import uuid
+
+import pytest
+from fastapi import HTTPException
+from sqlmodel import Session, SQLModel, create_engine, select
+
+from src.models import Document
+from src.utils import decode_cursor, encode_cursor, keyset_page, next_cursor
+
+
+NOW = datetime(2025, 1, 1, 12, 0, 0)
+
+@pytest.fixture
+def session():
+    engine = create_engine("sqlite://")
+    SQLModel.metadata.create_all(engine)
+    with Session(engine) as session:
+        yield session
+
+def add_documents(session: Session, created_at: list[datetime]) -> list[Document]:
+    documents = [Document(pdf_url=f"{idx}.pdf", pdf_name=f"{idx}.pdf", created_at=at) for idx, at in enumerate(created_at)]
+    session.add_all(documents)
+    session.commit()
+    return documents
+
+def read_all_pages(session: Session, limit: int) -> list[list[uuid.UUID]]:
+    pages, cursor = [], None
+    while True:
+        after = decode_cursor(cursor) if cursor else None
+        rows = session.exec(keyset_page(select(Document), Document, after, limit)).all()
+        pages.append([document.id for document in rows[:limit]])
+        cursor = next_cursor(rows, limit)
+        if cursor is None:
+            return pages
+
+def test_cursor_round_trip():
+    id = uuid.uuid4()
+    assert decode_cursor(encode_cursor(NOW, id)) == (NOW, id)
+
+@pytest.mark.parametrize("cursor", [
+    "not base64!",
+    base64.urlsafe_b64encode(b"no separator").decode(),
+    base64.urlsafe_b64encode(b"yesterday|" + uuid.uuid4().hex.encode()).decode(),
+    base64.urlsafe_b64encode(NOW.isoformat().encode() + b"|not-a-uuid").decode(),
+    base64.urlsafe_b64encode(b"\xff\xfe").decode(),
+])
+def test_malformed_cursor_is_a_bad_request(cursor):
+    with pytest.raises(HTTPException) as error:
+        decode_cursor(cursor)
+    assert error.value.status_code == 400
+
+def test_pages_are_newest_first(session):
+    documents = add_documents(session, [NOW + timedelta(minutes=idx) for idx in range(5)])
+
+    pages = read_all_pages(session, limit=2)
+
+    assert pages == [[documents[4].id, documents[3].id], [documents[2].id, documents[1].id], [documents[0].id]]
+
+def test_ties_on_created_at_are_neither_repeated_nor_skipped(session):
+    documents = add_documents(session, [NOW] * 5 + [NOW - timedelta(minutes=1)] * 2)
+
+    pages = read_all_pages(session, limit=2)
+    ids = [id for page in pages for id in page]
+
+    assert sorted(ids) == sorted(document.id for document in documents)
+    assert len(ids) == len(set(ids))
+    # Ties are ordered by id, the older rows come last
+    assert ids[:5] == sorted((document.id for document in documents[:5]), reverse=True)
+
+def test_last_page_has_no_cursor(session):
+    add_documents(session, [NOW, NOW])
+
+    pages = read_all_pages(session, limit=2)
+
+    assert len(pages) == 1
+    assert len(pages[0]) == 2
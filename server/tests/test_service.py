@@ -0,0 +1,244 @@
+from contextlib import nullcontext
+import numpy as np
+import asyncio
+import time
+
+import pytest
+from fastapi import HTTPException
+from langchain_core.documents.base import Document
+from qdrant_client import models
+
+from src.config import Config
+from src.docs_ingestion.service import IngestCancelled, QdrantService
+
+
+COLLECTION = "pdf_docs"
+
+class FakeEmbedder:
+    name = "fake"
+
+    def __init__(self, dimension: int):
+        self.dimension = dimension
+
+@pytest.fixture
+def service(monkeypatch) -> QdrantService:
+    service = QdrantService(qdrant_host="localhost", qdrant_port=6333, transformer_model="test", location=":memory:")
+    service.client.create_collection(COLLECTION, vectors_config=models.VectorParams(size=4, distance=models.Distance.COSINE))
+    # The associations lock is a Redis lock, a single process needs none
+    monkeypatch.setattr(service, "association_lock", nullcontext)
+    monkeypatch.setattr(QdrantService, "model", property(lambda self: FakeEmbedder(4)))
+    return service
+
+def seed(service: QdrantService, source: str, user_id: str, count: int):
+    service.client.upsert(COLLECTION, [
+        models.PointStruct(
+            id=service.point_id(source, idx),
+            vector=[1.0, 0.0, 0.0, idx + 1.0],
+            payload={"text": f"chunk {idx}", "source": source, "user_id": user_id, "page": idx, "total_pages": count}
+        )
+        for idx in range(count)
+    ])
+
+def count(service: QdrantService, query_filter: models.Filter | None = None) -> int:
+    return service.client.count(COLLECTION, count_filter=query_filter, exact=True).count
+
+def payloads(service: QdrantService) -> list[dict]:
+    records, _ = service.client.scroll(COLLECTION, limit=100, with_payload=True)
+    return [record.payload for record in records]
+
+def test_associate_shares_points_without_copying(service):
+    seed(service, "a.pdf", "u1", 5)
+    progress = []
+
+    associated = service.associate_points(COLLECTION, "a.pdf", "b.pdf", "u2", expected=5, batch_size=2, on_progress=lambda *args: progress.append(args))
+
+    assert associated == 5
+    assert count(service) == 5
+    assert count(service, service.document_filter("u2", "b.pdf")) == 5
+    assert count(service, service.document_filter("u1", "a.pdf")) == 5
+    assert all(p["source"] == ["a.pdf", "b.pdf"] and p["user_id"] == ["u1", "u2"] for p in payloads(service))
+    assert [chunks for chunks, _, _ in progress] == [2, 4, 5]
+    assert progress[-1][1:] == (5, 5)
+
+def test_associate_is_idempotent(service):
+    seed(service, "a.pdf", "u1", 3)
+
+    service.associate_points(COLLECTION, "a.pdf", "b.pdf", "u2", expected=3)
+    service.associate_points(COLLECTION, "a.pdf", "b.pdf", "u2", expected=3)
+
+    assert all(p["source"] == ["a.pdf", "b.pdf"] for p in payloads(service))
+
+def test_associate_refuses_a_truncated_source(service):
+    seed(service, "a.pdf", "u1", 3)
+
+    assert service.associate_points(COLLECTION, "a.pdf", "b.pdf", "u2", expected=5) == 0
+    assert count(service, service.source_filter("b.pdf")) == 0
+
+def test_associate_without_points(service):
+    assert service.associate_points(COLLECTION, "gone.pdf", "b.pdf", "u2", expected=0) == 0
+
+def test_delete_keeps_points_shared_with_other_pdfs(service):
+    seed(service, "a.pdf", "u1", 4)
+    seed(service, "c.pdf", "u3", 2)
+    service.associate_points(COLLECTION, "a.pdf", "b.pdf", "u2", expected=4)
+
+    assert service.delete_points(COLLECTION, "a.pdf", batch_size=3) == 0
+    assert count(service) == 6
+    assert count(service, service.document_filter("u1", "a.pdf")) == 0
+    assert count(service, service.document_filter("u2", "b.pdf")) == 4
+    # The owner of the deleted pdf is removed along with it
+    assert count(service, service.document_filter("u1", "b.pdf")) == 0
+
+    assert service.delete_points(COLLECTION, "b.pdf", batch_size=3) == 4
+    assert count(service) == 2
+    assert count(service, service.source_filter("c.pdf")) == 2
+
+def test_delete_unshared_points(service):
+    seed(service, "a.pdf", "u1", 7)
+
+    assert service.delete_points(COLLECTION, "a.pdf", batch_size=3) == 7
+    assert count(service) == 0
+
+class FakeRedis:
+    def __init__(self):
+        self.values = {}
+
+    def get(self, key):
+        return self.values.get(key)
+
+    def set(self, key, value, ex=None):
+        self.values[key] = str(value).encode()
+
+    def delete(self, key):
+        self.values.pop(key, None)
+
+def make_chunks(count: int, per_page: int = 4) -> list[Document]:
+    return [
+        Document(page_content=f"chunk {idx}", metadata={"source": "a.pdf", "page": idx // per_page, "total_pages": -(-count // per_page)})
+        for idx in range(count)
+    ]
+
+def test_redelivered_ingest_resumes_after_the_last_committed_batch(service, monkeypatch):
+    service.checkpoint.client = FakeRedis()
+    chunks = make_chunks(10)
+    monkeypatch.setattr(service, "iter_chunks_from_pdf", lambda *args, **kwargs: iter(chunks))
+    embedded: list[str] = []
+
+    def encode_texts(texts, batch_size=None):
+        embedded.extend(texts)
+        return np.array([[1.0, 0.0, 0.0, float(text.split()[-1]) + 1] for text in texts], dtype=np.float32)
+    monkeypatch.setattr(service, "encode_texts", encode_texts)
+
+    # The worker dies on the third upsert batch, after 4 chunks were committed
+    upsert_points = service.upsert_points
+    upserts = 0
+    def dying_upsert(collection_name, points):
+        nonlocal upserts
+        upserts += 1
+        if upserts == 3:
+            raise RuntimeError("worker lost")
+        upsert_points(collection_name, points)
+    monkeypatch.setattr(service, "upsert_points", dying_upsert)
+
+    ingest = lambda: service.ingest_documents(COLLECTION, "doc-1", "a.pdf", "u1", batch_size=2, upsert_batch_size=2)
+    with pytest.raises(HTTPException):
+        ingest()
+    assert count(service) == 4
+    assert service.checkpoint.get("doc-1") == 4
+
+    embedded.clear()
+    ingest()
+
+    # Only the chunks after the checkpoint are embedded again
+    assert embedded == [chunk.page_content for chunk in chunks[4:]]
+    assert count(service) == 10
+    records, _ = service.client.scroll(COLLECTION, limit=100, with_payload=True)
+    assert {record.id for record in records} == {service.point_id("doc-1", idx) for idx in range(10)}
+    assert {record.id: record.payload["text"] for record in records} == {service.point_id("doc-1", idx): f"chunk {idx}" for idx in range(10)}
+    assert service.checkpoint.get("doc-1") == 0
+
+def test_a_cancelled_ingest_stops_after_the_batch(service, monkeypatch):
+    service.checkpoint.client = FakeRedis()
+    monkeypatch.setattr(service, "iter_chunks_from_pdf", lambda *args, **kwargs: iter(make_chunks(10)))
+    monkeypatch.setattr(service, "encode_texts", lambda texts, batch_size=None: np.ones((len(texts), 4), dtype=np.float32))
+
+    def on_progress(chunks_done, pages_done, pages_total):
+        raise IngestCancelled("doc-1")
+
+    # Not turned into an HTTPException, so the task can tell it from a failure
+    with pytest.raises(IngestCancelled):
+        service.ingest_documents(COLLECTION, "doc-1", "a.pdf", "u1", batch_size=2, upsert_batch_size=2, on_progress=on_progress)
+    assert count(service) == 2
+
+def test_ingesting_again_overwrites_instead_of_duplicating(service, monkeypatch):
+    service.checkpoint.client = FakeRedis()
+    monkeypatch.setattr(service, "iter_chunks_from_pdf", lambda *args, **kwargs: iter(make_chunks(5)))
+    monkeypatch.setattr(service, "encode_texts", lambda texts, batch_size=None: np.ones((len(texts), 4), dtype=np.float32))
+
+    service.ingest_documents(COLLECTION, "doc-1", "a.pdf", "u1", batch_size=2, upsert_batch_size=2)
+    service.ingest_documents(COLLECTION, "doc-1", "a.pdf", "u1", batch_size=2, upsert_batch_size=2)
+
+    assert count(service) == 5
+
+def test_collections_are_sized_by_the_embedding_model(service, monkeypatch):
+    monkeypatch.setattr(QdrantService, "model", property(lambda self: FakeEmbedder(8)))
+
+    service.ensure_collection("other_docs")
+
+    assert service.client.get_collection("other_docs").config.params.vectors.size == 8
+
+def test_a_collection_of_another_model_is_refused(service, monkeypatch):
+    monkeypatch.setattr(QdrantService, "model", property(lambda self: FakeEmbedder(8)))
+
+    with pytest.raises(ValueError):
+        service.ensure_collection(COLLECTION)
+
+class FakeReranker:
+    """Prefers the chunks vector search ranks last, taking `delay` seconds per batch"""
+    name = "fake"
+
+    def __init__(self, delay: float):
+        self.delay = delay
+
+    def score(self, query, texts, batch_size):
+        time.sleep(self.delay)
+        return np.array([-int(text.split()[-1]) for text in texts], dtype=np.float32)
+
+@pytest.fixture
+def rerank_service(service, monkeypatch):
+    # Vector search ranks chunk 9 first, down to chunk 0
+    seed(service, "a.pdf", "u1", 10)
+    monkeypatch.setattr(service, "encode_texts", lambda texts, batch_size=None: np.array([[0.0, 0.0, 0.0, 1.0]] * len(texts), dtype=np.float32))
+    monkeypatch.setattr(Config, "RERANK_ENABLED", True)
+    monkeypatch.setattr(Config, "RERANK_CANDIDATES", 10)
+    monkeypatch.setattr(Config, "RERANK_BATCH_SIZE", 5)
+    monkeypatch.setattr(Config, "RERANK_BUDGET_MS", 100)
+    return service
+
+def test_rerank_reorders_the_candidates(rerank_service, monkeypatch):
+    monkeypatch.setattr(QdrantService, "reranker", property(lambda self: FakeReranker(delay=0)))
+
+    texts = asyncio.run(rerank_service.aretrieve_documents(COLLECTION, "query", "u1", "a.pdf", limit=3))
+
+    assert texts == ["chunk 0", "chunk 1", "chunk 2"]
+
+def test_rerank_past_its_deadline_keeps_the_search_order(rerank_service, monkeypatch):
+    monkeypatch.setattr(QdrantService, "reranker", property(lambda self: FakeReranker(delay=0.3)))
+    timings = {}
+
+    texts = asyncio.run(rerank_service.aretrieve_documents(COLLECTION, "query", "u1", "a.pdf", limit=3, timings=timings))
+
+    assert texts == ["chunk 9", "chunk 8", "chunk 7"]
+    # The request waited for the budget, not for the reranker
+    assert timings["rerank"] < 250
+
+def test_iter_sources_finds_every_pdf(service):
+    seed(service, "big.pdf", "u1", 30)
+    seed(service, "small.pdf", "u2", 1)
+    service.associate_points(COLLECTION, "big.pdf", "copy.pdf", "u3", expected=30)
+
+    batches = list(service.iter_sources(COLLECTION, batch_size=4))
+
+    sources = [source for batch in batches for source in batch]
+    assert sorted(sources) == ["big.pdf", "copy.pdf", "small.pdf"]
+    assert len(sources) == len(set(sources))